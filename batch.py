@@ -0,0 +1,291 @@
+"""
+Batch mode: streams a JSONL file of chat requests through the providers.
+
+Each input line is one request:
+
+    {"id": "q1", "provider": "https://api.routstr.com", "model": "openai/gpt-4o-mini",
+     "messages": [{"role": "user", "content": "Hi"}], "max_tokens": 50}
+
+Other keys than id, provider, model and messages are passed on as request
+parameters. Requests are paid with the provider's ledger token (see
+get_or_create_token), at most --concurrency at once and --per-provider at once
+per provider. Input is read only as fast as requests finish and every result
+is appended to the output JSONL right away, so memory stays flat however long
+the file is.
+
+Progress is checkpointed to <output>.checkpoint: the input offset up to which
+every line is done, plus the few lines after it that finished early. Running
+the same command again after a crash continues from there, skipping lines
+whose result is already in the output, so they are not paid for twice:
+
+    python batch.py chat_requests.jsonl results.jsonl --concurrency 16 --per-provider 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import routstr_bot
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_PER_PROVIDER = 4
+DEFAULT_TOKEN_SATS = 500
+DEFAULT_TIMEOUT = 60
+WINDOW_FACTOR = 8  # read at most concurrency * WINDOW_FACTOR lines past the checkpoint
+CHECKPOINT_INTERVAL = 2.0  # seconds between checkpoint writes
+REQUIRED_FIELDS = {"provider": str, "model": str, "messages": list}  # every input line needs these, of these types
+
+
+def _send(session: requests.Session, provider_url: str, headers: dict, payload: dict,
+          timeout: float) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        response = session.post(provider_url + "/v1/chat/completions", headers=headers,
+                                json=payload, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        return {"status": "error", "error": str(e), "latency": round(time.perf_counter() - started, 3)}
+    result = {"http_status": response.status_code, "latency": round(time.perf_counter() - started, 3)}
+    try:
+        data = response.json()
+    except ValueError:
+        data = None
+    if response.ok and isinstance(data, dict) and data.get("choices"):
+        result.update({
+            "status": "ok",
+            "response": data["choices"][0].get("message", {}).get("content"),
+            "usage": data.get("usage"),
+        })
+    else:
+        result.update({"status": "error", "error": response.text[:500]})
+    return result
+
+
+class Checkpoint:
+    """Which input lines are done: all before `line` (ending at byte `offset`), plus `done_ahead`."""
+
+    def __init__(self, path: str, input_path: str):
+        self.path = path
+        self.input_path = input_path
+        self.offset = 0
+        self.line = 0
+        self.output_offset = 0
+        self.done_ahead: Dict[int, int] = {}  # line number -> input offset after it
+        self.saved_at = 0.0
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            data = json.load(f)
+        if data["input"] != os.path.abspath(self.input_path):
+            raise ValueError(f"{self.path} belongs to {data['input']}, remove it to start over")
+        self.offset = data["offset"]
+        self.line = data["line"]
+        self.output_offset = data["output_offset"]
+        self.done_ahead = {int(line): end for line, end in data["done_ahead"].items()}
+        return True
+
+    def done(self, line: int, end_offset: int):
+        self.done_ahead[line] = end_offset
+        while self.line in self.done_ahead:
+            self.offset = self.done_ahead.pop(self.line)
+            self.line += 1
+
+    def save(self, output_offset: int):
+        self.output_offset = output_offset
+        tmp_file = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"input": os.path.abspath(self.input_path), "offset": self.offset, "line": self.line,
+                       "output_offset": output_offset, "done_ahead": self.done_ahead}, f)
+        os.replace(tmp_file, self.path)
+        self.saved_at = time.monotonic()
+
+
+def _recover_output(output_path: str, checkpoint: Checkpoint):
+    """Marks lines written after the last checkpoint as done and cuts off a half-written last line."""
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        f.seek(checkpoint.output_offset)
+        position = checkpoint.output_offset
+        for raw in iter(f.readline, b""):
+            if not raw.endswith(b"\n"):
+                f.truncate(position)
+                break
+            record = json.loads(raw)
+            checkpoint.done_ahead.setdefault(record["line"], record["input_end"])
+            position += len(raw)
+
+
+class BatchRunner:
+    def __init__(self, input_path: str, output_path: str, concurrency: int = DEFAULT_CONCURRENCY,
+                 per_provider: int = DEFAULT_PER_PROVIDER, token_sats: int = DEFAULT_TOKEN_SATS,
+                 timeout: float = DEFAULT_TIMEOUT, checkpoint_path: Optional[str] = None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.per_provider = per_provider
+        self.token_sats = token_sats
+        self.timeout = timeout
+        self.checkpoint = Checkpoint(checkpoint_path or output_path + ".checkpoint", input_path)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=per_provider)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.provider_slots: Dict[str, asyncio.Semaphore] = {}
+        self.provider_headers: Dict[str, dict] = {}
+        self.provider_requests: Dict[str, int] = {}
+        self.stats = {"ok": 0, "error": 0, "skipped": 0}
+
+    async def _headers(self, provider_url: str) -> Optional[dict]:
+        if provider_url not in self.provider_headers:
+            cashu_token = await routstr_bot.get_or_create_token(self.token_sats, provider_url)
+            # The stored balance is stale from the first paid request until synced at the end
+            routstr_bot.set_token_synced(provider_url, False)
+            self.provider_headers[provider_url] = routstr_bot.build_payment_headers(cashu_token) if cashu_token else None
+        return self.provider_headers[provider_url]
+
+    async def _run_line(self, line: int, end_offset: int, request: Dict[str, Any], executor, output,
+                        progress: asyncio.Condition):
+        provider_url = request["provider"].rstrip("/")
+        slot = self.provider_slots.setdefault(provider_url, asyncio.Semaphore(self.per_provider))
+        async with slot:
+            headers = await self._headers(provider_url)
+            if headers is None:
+                result = {"status": "error", "error": "no cashu token for provider"}
+            else:
+                payload = {key: value for key, value in request.items() if key not in ("id", "provider")}
+                self.provider_requests[provider_url] = self.provider_requests.get(provider_url, 0) + 1
+                result = await asyncio.get_running_loop().run_in_executor(
+                    executor, _send, self.session, provider_url, headers, payload, self.timeout)
+        record = {"line": line, "input_end": end_offset, "id": request.get("id"),
+                  "provider": provider_url, "model": request.get("model"), **result}
+        self._finish(line, end_offset, record, output)
+        async with progress:
+            progress.notify_all()
+
+    def _finish(self, line: int, end_offset: int, record: Optional[Dict[str, Any]], output):
+        if record is not None:
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            self.stats[record["status"]] += 1
+        self.checkpoint.done(line, end_offset)
+        if time.monotonic() - self.checkpoint.saved_at >= CHECKPOINT_INTERVAL:
+            os.fsync(output.fileno())
+            self.checkpoint.save(output.tell())
+
+    async def run(self) -> Dict[str, Any]:
+        if self.checkpoint.load():
+            print(f"Resuming at line {self.checkpoint.line} (byte {self.checkpoint.offset})")
+        _recover_output(self.output_path, self.checkpoint)
+        already_done = set(self.checkpoint.done_ahead)
+        started = time.monotonic()
+        window = self.concurrency * WINDOW_FACTOR
+        in_flight = asyncio.Semaphore(self.concurrency)
+        progress = asyncio.Condition()
+        tasks = set()
+
+        def release(task):
+            tasks.discard(task)
+            in_flight.release()
+
+        with open(self.input_path, "rb") as source, open(self.output_path, "a") as output, \
+                ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            source.seek(self.checkpoint.offset)
+            line = self.checkpoint.line
+            try:
+                for raw in iter(source.readline, b""):
+                    end_offset = source.tell()
+                    if line in already_done:
+                        already_done.discard(line)
+                        self.stats["skipped"] += 1
+                        self._finish(line, end_offset, None, output)
+                    elif not raw.strip():
+                        self._finish(line, end_offset, None, output)
+                    else:
+                        # Backpressure: a slow line holds the checkpoint, don't read too far past it
+                        async with progress:
+                            await progress.wait_for(lambda: line < self.checkpoint.line + window)
+                        await in_flight.acquire()
+                        try:
+                            request = json.loads(raw)
+                            if not isinstance(request, dict):
+                                raise ValueError("not a JSON object")
+                            missing = [field for field in REQUIRED_FIELDS if field not in request]
+                            if missing:
+                                raise ValueError(f"missing {', '.join(missing)}")
+                            wrong = [field for field, kind in REQUIRED_FIELDS.items()
+                                     if not isinstance(request[field], kind)]
+                            if wrong:
+                                raise ValueError(", ".join(f"{field} must be a {REQUIRED_FIELDS[field].__name__}"
+                                                           for field in wrong))
+                            if not request["provider"].strip():
+                                raise ValueError("provider is empty")
+                        except ValueError as e:
+                            in_flight.release()
+                            self._finish(line, end_offset, {"line": line, "input_end": end_offset,
+                                                            "status": "error", "error": f"invalid request: {e}"}, output)
+                        else:
+                            task = asyncio.create_task(self._run_line(line, end_offset, request, executor,
+                                                                      output, progress))
+                            tasks.add(task)
+                            task.add_done_callback(release)
+                    line += 1
+                if tasks:
+                    await asyncio.gather(*tasks)
+            finally:
+                # Interrupted: unfinished lines are not in the output and run again on resume
+                for task in tasks:
+                    task.cancel()
+            output.flush()
+            os.fsync(output.fileno())
+            self.checkpoint.save(output.tell())
+
+        await self._sync_balances()
+        elapsed = time.monotonic() - started
+        done = self.stats["ok"] + self.stats["error"]
+        return {**self.stats, "elapsed": round(elapsed, 2),
+                "rps": round(done / elapsed, 2) if elapsed else 0.0}
+
+    async def _sync_balances(self):
+        for provider_url, headers in self.provider_headers.items():
+            if headers is None:
+                continue
+            try:
+                response = await asyncio.to_thread(self.session.get, provider_url + "/v1/wallet/info",
+                                                   headers=headers, timeout=10)
+                if response.ok:
+                    balance = response.json()["balance"]
+                    routstr_bot.increment_token_usage_and_store_balance(
+                        provider_url, balance, self.provider_requests.get(provider_url, 0))
+                    routstr_bot.set_token_synced(provider_url, True, balance)
+                    continue
+                print(f"Wallet info returned {response.status_code} for {provider_url}")
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                print(f"Could not read wallet balance for {provider_url}: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a JSONL file of chat requests through Routstr providers.")
+    parser.add_argument("input", help="JSONL file, one request per line")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="most requests in flight")
+    parser.add_argument("--per-provider", type=int, default=DEFAULT_PER_PROVIDER,
+                        help="most requests in flight per provider")
+    parser.add_argument("--token-sats", type=int, default=DEFAULT_TOKEN_SATS,
+                        help="sats on a provider's token when one has to be created")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds per request")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.checkpoint)")
+    args = parser.parse_args()
+
+    runner = BatchRunner(args.input, args.output, args.concurrency, args.per_provider,
+                         args.token_sats, args.timeout, args.checkpoint)
+    summary = asyncio.run(runner.run())
+    print(f"{summary['ok']} ok, {summary['error']} failed, {summary['skipped']} already done, "
+          f"{summary['rps']} requests/s")
@@ -0,0 +1,67 @@
+"""
+Compares parsing a provider root document with response.json() against the
+streaming, field-selective parse_provider_document.
+
+Measures wall time and peak traced memory (tracemalloc) for a synthetic catalog,
+counting everything each approach keeps alive until model selection.
+
+    python -m benchmarks.catalog_parse --models 20000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import fake_services
+from catalog import parse_provider_document, STREAM_CHUNK_SIZE
+
+
+def _chunks(body: bytes):
+    for start in range(0, len(body), STREAM_CHUNK_SIZE):
+        yield body[start:start + STREAM_CHUNK_SIZE]
+
+
+def _full_parse(body_chunks):
+    # What response.json() does: join the whole body, decode it, build every dict
+    return json.loads(b"".join(body_chunks).decode("utf-8"))["models"]
+
+
+def _streaming_parse(body_chunks):
+    return parse_provider_document(body_chunks)["models"]
+
+
+def measure(parse, body: bytes, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(_chunks(body))
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    models = parse(_chunks(body))
+    _, peak = tracemalloc.get_traced_memory()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "models": len(models),
+        "best_ms": round(min(timings) * 1000, 2),
+        "peak_mb": round(peak / 1e6, 2),
+        "retained_mb": round(retained / 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark provider catalog parsing.")
+    parser.add_argument("--models", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    body = json.dumps({"version": "0.0.0-fake", "models": fake_services.generate_catalog(args.models)}).encode()
+    print(f"Document: {len(body) / 1e6:.2f} MB, {args.models} models")
+    for name, parse in (("response.json()", _full_parse), ("parse_provider_document", _streaming_parse)):
+        result = measure(parse, body, args.repeat)
+        print(f"{name:24s} best {result['best_ms']:8.2f} ms   peak {result['peak_mb']:7.2f} MB   "
+              f"retained {result['retained_mb']:7.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
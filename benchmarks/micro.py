@@ -0,0 +1,240 @@
+"""
+Micro-benchmarks of the bot's hot paths, with saved baselines and regression checks.
+
+Covers model selection (routstr_bot.get_cheapest_model_above_price on the
+parsed records the probe sees, and model_utils.get_cheapest_model_above_price
+on raw USD-priced models) for catalogs of 100 to 100k models, the token
+ledger with many providers, building the status report, and the per-request
+overhead of CashuWalletClient against a local FakeWallet. The startup.*
+benchmarks time fresh interpreters running cli.py commands (probe against a
+FakeProvider), next to bare python and a plain `import routstr_bot`.
+
+Each benchmark reports the best time per call over several timeit repeats.
+Save a baseline before a change, then compare; the run exits with status 1 if
+a benchmark got slower than the baseline by more than its threshold:
+
+    python -m benchmarks.micro --save
+    python -m benchmarks.micro --threshold 0.25
+    python -m benchmarks.micro --only 'cheapest.*' --quick
+"""
+import argparse
+import asyncio
+import contextlib
+import fnmatch
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+from pynostr.event import Event
+
+import fake_services
+import model_utils
+import routstr_bot
+import wallet
+from catalog import parse_provider_document
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_THRESHOLD = 0.25  # fail when 25% slower than the baseline
+THRESHOLDS = {"wallet.*": 0.5, "startup.*": 0.3}  # loopback HTTP and process startup are noisier
+CATALOG_SIZES = [100, 1_000, 10_000, 100_000]
+LEDGER_PROVIDERS = 1_000
+REPORT_PROVIDERS = [4, 100]
+REPEAT = 5
+STARTUP_CASES = ("startup.python", "startup.import_routstr_bot", "startup.cli_ledger", "startup.cli_scores",
+                 "startup.cli_probe")
+
+
+def _quiet(func):
+    """Runs func with stdout discarded (the bot prints on every ledger update)."""
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func()
+    return run
+
+
+def _selection_cases(sizes, selected):
+    for size in sizes:
+        if not (selected(f"cheapest.bot.{size}") or selected(f"cheapest.model_utils.{size}")):
+            continue
+        models = fake_services.generate_catalog(size)
+        body = json.dumps({"version": "0.0.0-fake", "models": models}).encode()
+        records = parse_provider_document([body])["models"]
+        yield (f"cheapest.bot.{size}",
+               lambda records=records: routstr_bot.get_cheapest_model_above_price(
+                   records, routstr_bot.CHEAPEST_MODELS_ABOVE, routstr_bot.DEFAULT_MAX_COSTS_RANGE, True))
+        document = {"models": models}
+        yield (f"cheapest.model_utils.{size}",
+               lambda document=document: model_utils.get_cheapest_model_above_price(document, 10))
+
+
+def _ledger_cases(tmp):
+    routstr_bot.DATA_FILE = os.path.join(tmp, "routstr_data.json")
+    routstr_bot.save_data({"cashu_tokens": {
+        f"https://provider-{i}.example": {"cashu_token": f"cashuFake{i}x{i:032x}", "count": 0, "balance": 100_000}
+        for i in range(LEDGER_PROVIDERS)
+    }})
+    provider_url = f"https://provider-{LEDGER_PROVIDERS // 2}.example"
+    # One loop for every call, so the timing is the ledger lookup and not asyncio.run's setup
+    loop = asyncio.new_event_loop()
+    try:
+        yield (f"ledger.get_or_create_token.{LEDGER_PROVIDERS}",
+               lambda: loop.run_until_complete(routstr_bot.get_or_create_token(100, provider_url)))
+        yield (f"ledger.increment_usage.{LEDGER_PROVIDERS}",
+               _quiet(lambda: routstr_bot.increment_token_usage_and_store_balance(provider_url, 99_000)))
+    finally:
+        loop.close()
+
+
+def _report_cases():
+    latest_event = Event(content="A recent note about sound money.")
+    latest_event.sign("1" * 64)
+    outcomes = [("up", "good", "unknown"), ("up", "good", "success"), ("up", "bad 1200.0", "failed"),
+                ("down", "unknown", "unknown"), ("timeout", "unknown", "unknown")]
+    for count in REPORT_PROVIDERS:
+        results = []
+        for i in range(count):
+            status, cost_check, refund_status = outcomes[i % len(outcomes)]
+            results.append({
+                "provider_url": f"https://provider-{i}.example", "status": status, "model_id": f"fake/model-{i}",
+                "cost_check": cost_check, "refund_status": refund_status, "version": "0.1.0",
+                "response": "Witty comment about the note. " * 4 if status == "up" else "",
+            })
+        yield (f"report.build_status_report.{count}",
+               lambda results=results: routstr_bot.build_status_report(latest_event, results))
+
+
+def _wallet_cases(wallet_url):
+    client = wallet.CashuWalletClient(wallet_url)
+    yield "wallet.get_balance", _quiet(client.get_balance)
+    yield "wallet.send_token", _quiet(lambda: client.send_token(1))
+
+
+def _startup_cases(tmp, wallet_url, selected):
+    # Starting the fake provider and the import check is skipped unless a startup case runs
+    if not any(map(selected, STARTUP_CASES)):
+        return
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    provider = fake_services.serve_in_thread(fake_services.FakeProvider(catalog_size=50))
+    env = dict(os.environ, PYTHONPATH=root, CASHU_WALLET_URL=wallet_url,
+               ROUTSTR_STATE_DB=os.path.join(tmp, "state.db"))
+    cli = os.path.join(root, "cli.py")
+
+    def command(*argv):
+        # cwd=tmp: the ledger (DATA_FILE) is relative to the working directory
+        return lambda: subprocess.run([sys.executable, *argv], cwd=tmp, env=env, check=True,
+                                      stdout=subprocess.DEVNULL)
+
+    probe = [cli, "probe", fake_services.base_url(provider), "--no-record"]
+    try:
+        if selected("startup.cli_probe"):
+            check = subprocess.run([sys.executable, "-X", "importtime", *probe], cwd=tmp, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if b" pynostr" in check.stderr:
+                print("warning: cli.py probe imports pynostr")
+        yield "startup.python", command("-c", "pass")
+        yield "startup.import_routstr_bot", command("-c", "import routstr_bot")
+        yield "startup.cli_ledger", command(cli, "ledger")
+        yield "startup.cli_scores", command(cli, "scores")
+        yield "startup.cli_probe", command(*probe)
+    finally:
+        provider.shutdown()
+
+
+def measure(func, repeat: int = REPEAT) -> float:
+    """Best seconds per call over `repeat` samples, each running at least ~0.2s."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def threshold_for(name: str, default: float) -> float:
+    for pattern, threshold in THRESHOLDS.items():
+        if fnmatch.fnmatch(name, pattern):
+            return max(threshold, default)
+    return default
+
+
+def run(patterns, quick: bool = False) -> dict:
+    """Runs the benchmarks matching any of `patterns` and returns {name: seconds per call}."""
+    results = {}
+    sizes = [size for size in CATALOG_SIZES if not quick or size <= 10_000]
+    wallet_server = fake_services.serve_in_thread(fake_services.FakeWallet())
+    data_file = routstr_bot.DATA_FILE
+
+    def selected(name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            wallet_url = fake_services.base_url(wallet_server)
+            groups = (_selection_cases(sizes, selected), _ledger_cases(tmp), _report_cases(),
+                      _wallet_cases(wallet_url), _startup_cases(tmp, wallet_url, selected))
+            for group in groups:
+                for name, func in group:
+                    if not selected(name):
+                        continue
+                    results[name] = measure(func)
+                    print(f"{name:40s} {results[name] * 1e6:12.1f} us")
+    finally:
+        routstr_bot.DATA_FILE = data_file
+        wallet_server.shutdown()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Names of benchmarks slower than their baseline by more than the threshold."""
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        change = seconds / baseline[name] - 1
+        limit = threshold_for(name, threshold)
+        flag = "REGRESSION" if change > limit else ""
+        print(f"{name:40s} {baseline[name] * 1e6:12.1f} -> {seconds * 1e6:12.1f} us  {change:+7.1%}  {flag}")
+        if change > limit:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark the bot's hot paths against a saved baseline.")
+    parser.add_argument("--only", action="append", help="glob of benchmark names to run (repeatable)")
+    parser.add_argument("--quick", action="store_true", help="skip the 100k model catalogs")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file")
+    parser.add_argument("--save", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed relative slowdown before failing (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    results = run(args.only or ["*"], args.quick)
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)["results"]
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({"saved_at": time.time(), "python": platform.python_version(),
+                       "machine": platform.machine(), "results": baseline}, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save first")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    print("\nCompared with baseline:")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+End-to-end benchmark of the provider probe pipeline against the local fakes.
+
+Starts a FakeProvider and a FakeWallet in-process, points the bot's ledger and
+wallet client at them and runs get_witty_bitcoin_comment for many providers
+over several rounds, one provider after another like main().
+
+Run from the repository root:
+
+    python -m benchmarks.probe_pipeline --providers 50 --rounds 3 --catalog-size 2000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import fake_services
+import routstr_bot
+import wallet
+
+
+def _percentile(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+async def run_benchmark(provider_base_url: str, providers: int, rounds: int, verbose: bool = False) -> dict:
+    """Probes `providers` fake provider URLs `rounds` times and returns the summary."""
+    provider_urls = [f"{provider_base_url}/p/{i}" for i in range(providers)]
+    latencies = []
+    statuses = {}
+    cost_checks = {}
+    refunds = {}
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for n, provider_url in enumerate(provider_urls):
+            probe_started = time.perf_counter()
+            output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                _, status, _, cost_check, refund_status, _ = await routstr_bot.get_witty_bitcoin_comment(
+                    "Benchmark note about sound money and fast payments.",
+                    routstr_bot.PROMPTS[n % len(routstr_bot.PROMPTS)],
+                    provider_url,
+                )
+            latencies.append(time.perf_counter() - probe_started)
+            statuses[status] = statuses.get(status, 0) + 1
+            cost_key = "good" if cost_check == "good" else cost_check.split(" ")[0]
+            cost_checks[cost_key] = cost_checks.get(cost_key, 0) + 1
+            refunds[refund_status] = refunds.get(refund_status, 0) + 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        "probes": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_probes_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1000, 2),
+            "p50": round(_percentile(latencies, 50) * 1000, 2),
+            "p90": round(_percentile(latencies, 90) * 1000, 2),
+            "p99": round(_percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2),
+        },
+        "statuses": statuses,
+        "cost_checks": cost_checks,
+        "refunds": refunds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the probe pipeline against fake services.")
+    parser.add_argument("--providers", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--catalog-size", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--overbilling", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's own output")
+    args = parser.parse_args()
+
+    provider = fake_services.serve_in_thread(fake_services.FakeProvider(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        overbilling=args.overbilling, catalog_size=args.catalog_size, seed=args.seed,
+    ))
+    wallet_server = fake_services.serve_in_thread(fake_services.FakeWallet(seed=args.seed))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        routstr_bot.DATA_FILE = os.path.join(tmp, "routstr_data.json")
+        routstr_bot.COMPLETION_CACHE_DIR = ""  # don't fill ./completion_cache with fake completions
+        wallet.DEFAULT_BASE_URL = fake_services.base_url(wallet_server)
+        summary = asyncio.run(run_benchmark(
+            fake_services.base_url(provider), args.providers, args.rounds, args.verbose
+        ))
+
+    provider.shutdown()
+    wallet_server.shutdown()
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"Probes: {summary['probes']} in {summary['elapsed_s']}s "
+          f"({summary['throughput_probes_per_s']} probes/s)")
+    print("Latency (ms): " + ", ".join(f"{k}={v}" for k, v in summary["latency_ms"].items()))
+    print(f"Statuses: {summary['statuses']}  Cost checks: {summary['cost_checks']}  Refunds: {summary['refunds']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Record/replay of the HTTP traffic the bot exchanges with providers and the wallet.
+
+Everything the bot sends over HTTP goes through requests.Session.request, both
+the probes made on routstr_bot.HTTP_SESSION and the session used by
+CashuWalletClient._make_request. While a cassette is active that method is
+swapped out:
+
+    with cassette.record("incident.cassette.gz", metadata={"ledger": load_data(),
+                                                           "wallet_url": wallet.DEFAULT_BASE_URL}):
+        ...  # every exchange is written to the cassette, tokens redacted
+
+    with cassette.replay("incident.cassette.gz", speed=10):
+        ...  # exchanges are answered from the cassette, 10x faster than recorded
+
+A cassette is a gzipped JSON-lines file: a header line with the metadata,
+then one line per exchange in the order it happened. Replay answers requests
+with the next unused exchange for the same method and URL and raises
+CassetteMiss (a requests ConnectionError) when there is none.
+
+Command line, from the repository root:
+
+    python cassette.py show incident.cassette.gz
+    python cassette.py replay incident.cassette.gz --speed 0
+"""
+import argparse
+import contextlib
+import gzip
+import json
+import re
+import threading
+import time
+from datetime import timedelta
+from typing import Optional, Dict, Any, List
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CASSETTE_VERSION = 1
+REDACTED = "<redacted>"
+REDACTED_HEADERS = {"authorization", "x-cashu"}
+RECORDED_REQUEST_HEADERS = {"authorization", "x-cashu", "content-type"}
+RECORDED_RESPONSE_HEADERS = {"content-type", "x-cashu"}
+_CASHU_TOKEN_PATTERN = re.compile(r"cashu[A-Za-z0-9_\-+/=]{8,}")
+_SECRET_FIELD_PATTERN = re.compile(r'("(?:token|cashu_token|api_key)"\s*:\s*)"[^"]*"')
+
+_original_request = requests.Session.request
+_patch_lock = threading.Lock()
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """Raised during replay when a request has no recorded exchange left."""
+
+
+def redact(text: str) -> str:
+    """Replaces cashu tokens and api keys in a string with a placeholder."""
+    text = _SECRET_FIELD_PATTERN.sub(rf'\1"{REDACTED}"', text)
+    return _CASHU_TOKEN_PATTERN.sub(REDACTED, text)
+
+
+def _redact_headers(headers, keep: set) -> Dict[str, str]:
+    redacted = {}
+    for name, value in (headers or {}).items():
+        if name.lower() not in keep:
+            continue
+        if name.lower() in REDACTED_HEADERS:
+            value = "Bearer " + REDACTED if str(value).startswith("Bearer ") else REDACTED
+        redacted[name] = value
+    return redacted
+
+
+def _request_body(kwargs: Dict[str, Any]) -> Optional[str]:
+    if kwargs.get("json") is not None:
+        return redact(json.dumps(kwargs["json"]))
+    data = kwargs.get("data")
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", "replace")
+    return redact(data) if isinstance(data, str) else None
+
+
+class _Recorder:
+    def __init__(self, path: str, metadata: Optional[Dict[str, Any]]):
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.seq = 0
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        header = {"cassette": CASSETTE_VERSION, "recorded_at": time.time(), "metadata": metadata or {}}
+        self.file.write(redact(json.dumps(header)) + "\n")
+
+    def request(self, session: requests.Session, method: str, url: str, *args, **kwargs) -> requests.Response:
+        offset = time.monotonic() - self.started
+        started = time.perf_counter()
+        exchange = {
+            "method": method.upper(),
+            "url": url,
+            "request_headers": _redact_headers(kwargs.get("headers"), RECORDED_REQUEST_HEADERS),
+            "request_body": _request_body(kwargs),
+            "offset": round(offset, 6),
+        }
+        try:
+            response = _original_request(session, method, url, *args, **kwargs)
+            body = response.content  # reads streamed bodies too, iter_content replays them
+        except requests.exceptions.RequestException as e:
+            exchange.update({"error": type(e).__name__, "message": redact(str(e)),
+                             "elapsed": round(time.perf_counter() - started, 6)})
+            self._write(exchange)
+            raise
+        exchange.update({
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": _redact_headers(response.headers, RECORDED_RESPONSE_HEADERS),
+            "body": redact(body.decode("utf-8", "replace")),
+            "elapsed": round(time.perf_counter() - started, 6),
+        })
+        self._write(exchange)
+        return response
+
+    def _write(self, exchange: Dict[str, Any]):
+        with self.lock:
+            exchange["seq"] = self.seq
+            self.seq += 1
+            self.file.write(json.dumps(exchange, separators=(",", ":")) + "\n")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class _Player:
+    def __init__(self, path: str, speed: float):
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.header, exchanges = load(path)
+        self.queues: Dict[tuple, List[Dict[str, Any]]] = {}
+        for exchange in exchanges:
+            self.queues.setdefault((exchange["method"], exchange["url"]), []).append(exchange)
+
+    def request(self, session: requests.Session, method: str, url: str, *args, **kwargs) -> requests.Response:
+        with self.lock:
+            queue = self.queues.get((method.upper(), url))
+            exchange = queue.pop(0) if queue else None
+        if exchange is None:
+            raise CassetteMiss(f"No recorded exchange left for {method.upper()} {url}")
+        if self.speed > 0:
+            time.sleep(exchange["elapsed"] / self.speed)
+        if "error" in exchange:
+            error_type = getattr(requests.exceptions, exchange["error"], requests.exceptions.ConnectionError)
+            raise error_type(exchange["message"])
+
+        response = requests.Response()
+        response.status_code = exchange["status"]
+        response.reason = exchange.get("reason")
+        response.headers = CaseInsensitiveDict(exchange.get("headers", {}))
+        response._content = exchange["body"].encode("utf-8")
+        response._content_consumed = True
+        response.encoding = "utf-8"
+        response.url = url
+        response.elapsed = timedelta(seconds=exchange["elapsed"])
+        return response
+
+    def remaining(self) -> int:
+        with self.lock:
+            return sum(len(queue) for queue in self.queues.values())
+
+
+def load(path: str) -> tuple:
+    """Reads a cassette file and returns (header, exchanges)."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("cassette") != CASSETTE_VERSION:
+            raise ValueError(f"Unsupported cassette version in {path}: {header.get('cassette')}")
+        exchanges = [json.loads(line) for line in f if line.strip()]
+    return header, exchanges
+
+
+@contextlib.contextmanager
+def _patched(handler):
+    with _patch_lock:
+        if requests.Session.request is not _original_request:
+            raise RuntimeError("A cassette is already active")
+
+        def request(session, method, url, *args, **kwargs):
+            return handler.request(session, method, url, *args, **kwargs)
+
+        requests.Session.request = request
+    try:
+        yield handler
+    finally:
+        with _patch_lock:
+            requests.Session.request = _original_request
+
+
+@contextlib.contextmanager
+def record(path: str, metadata: Optional[Dict[str, Any]] = None):
+    """Records every HTTP exchange made inside the block into a cassette file."""
+    recorder = _Recorder(path, metadata)
+    try:
+        with _patched(recorder):
+            yield recorder
+    finally:
+        recorder.close()
+
+
+@contextlib.contextmanager
+def replay(path: str, speed: float = 1.0):
+    """
+    Answers HTTP requests made inside the block from a cassette file.
+
+    Args:
+        path: Cassette file written by record()
+        speed: 1.0 replays recorded timings, 10 replays 10x faster, 0 without any delay
+    """
+    with _patched(_Player(path, speed)) as player:
+        yield player
+
+
+def provider_urls(exchanges: List[Dict[str, Any]]) -> List[str]:
+    """Provider base URLs probed in a cassette, in the order they were first probed."""
+    suffix = "/v1/chat/completions"
+    urls = []
+    for exchange in exchanges:
+        if exchange["url"].endswith(suffix):
+            url = exchange["url"][:-len(suffix)]
+            if url not in urls:
+                urls.append(url)
+    return urls
+
+
+def _show(path: str):
+    header, exchanges = load(path)
+    print(f"Cassette recorded at {time.asctime(time.localtime(header['recorded_at']))}, "
+          f"{len(exchanges)} exchanges")
+    for exchange in exchanges:
+        outcome = exchange.get("status", exchange.get("error"))
+        print(f"{exchange['offset']:9.3f}s {exchange['elapsed'] * 1000:8.1f}ms  {outcome}  "
+              f"{exchange['method']} {exchange['url']}")
+
+
+def _replay_probes(path: str, speed: float):
+    import asyncio
+    import os
+    import tempfile
+    import routstr_bot
+    import wallet
+
+    header, exchanges = load(path)
+    if header["metadata"].get("wallet_url"):
+        wallet.DEFAULT_BASE_URL = header["metadata"]["wallet_url"]
+    with tempfile.TemporaryDirectory() as tmp:
+        # Start from the ledger as it was when the cassette was recorded
+        routstr_bot.DATA_FILE = os.path.join(tmp, "routstr_data.json")
+        routstr_bot.save_data(header["metadata"].get("ledger", {"cashu_tokens": {}}))
+        routstr_bot.COMPLETION_CACHE_DIR = ""  # replayed completions are not new observations
+        with replay(path, speed) as player:
+            for n, provider_url in enumerate(provider_urls(exchanges)):
+                _, status, model_id, cost_check, refund_status, version = asyncio.run(
+                    routstr_bot.get_witty_bitcoin_comment(
+                        "Replayed note", routstr_bot.PROMPTS[n % len(routstr_bot.PROMPTS)], provider_url
+                    )
+                )
+                print(f"{provider_url} ({version}): {status}, model {model_id}, "
+                      f"cost check {cost_check}, refund {refund_status}")
+            print(f"{player.remaining()} recorded exchanges were not replayed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or replay an HTTP cassette.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    show_parser = subparsers.add_parser("show", help="list the recorded exchanges")
+    show_parser.add_argument("path")
+    replay_parser = subparsers.add_parser("replay", help="re-run the recorded provider probes")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="1 = recorded timings, 10 = ten times faster, 0 = no delays")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        _show(args.path)
+    else:
+        _replay_probes(args.path, args.speed)
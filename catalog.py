@@ -0,0 +1,517 @@
+"""
+Merged model catalog across providers.
+
+Every provider's model list is ingested into one index keyed by model id. Each
+(provider, model) offer becomes a row in a set of column arrays, with both
+pricing schemas normalized to sats per token:
+
+    sats_pricing  {"prompt", "completion", "max_cost"}  already in sats
+    pricing       {"prompt", "completion"} in USD        converted with SATS_PER_USD
+
+Queries work column-wise over the arrays (map/compress over whole columns run
+in C) instead of walking model dicts in Python:
+
+    catalog = load_catalog(PROXIES)
+    catalog.cheapest_provider("openai/gpt-4o-mini")
+    catalog.find(max_sats=10, min_context=32000, image_input=True)
+    catalog.price_spread()
+
+Provider root documents can be several megabytes, mostly model descriptions and
+parameter lists the bot never looks at. parse_provider_document streams the
+body and keeps each model only as a compact ModelRecord; with keep_raw=True the
+raw JSON of every model is also spooled to a temporary file, so the full dict
+stays loadable on demand.
+"""
+import argparse
+import json
+import math
+import operator
+import os
+import re
+import tempfile
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from itertools import compress, repeat
+from typing import Optional, Dict, Any, List
+
+import requests
+
+PRICE_FIELDS = ("prompt", "completion", "total", "max_cost")
+NAN = float("nan")
+STREAM_CHUNK_SIZE = 64 * 1024
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Sats per USD for offers priced only in USD (1000 is BTC at $100k). Set it to the
+# current rate; 0 leaves USD-only offers out of price comparisons.
+SATS_PER_USD = float(os.getenv("ROUTSTR_SATS_PER_USD", "1000"))
+
+
+def _float(value, scale: float = 1.0) -> float:
+    try:
+        return float(value) * scale
+    except (TypeError, ValueError):
+        return NAN
+
+
+def normalize_pricing(model: Dict[str, Any]) -> tuple:
+    """Returns (prompt, completion, max_cost) in sats per token; unknown values are NaN."""
+    sats_pricing = model.get("sats_pricing")
+    if sats_pricing:
+        return (_float(sats_pricing.get("prompt")),
+                _float(sats_pricing.get("completion")),
+                _float(sats_pricing.get("max_cost")))
+    pricing = model.get("pricing") or {}
+    if SATS_PER_USD <= 0:
+        return NAN, NAN, NAN
+    return (_float(pricing.get("prompt"), SATS_PER_USD),
+            _float(pricing.get("completion"), SATS_PER_USD),
+            NAN)
+
+
+def _accepts_images(model: Dict[str, Any]) -> bool:
+    architecture = model.get("architecture") or {}
+    if "image" in (architecture.get("input_modalities") or []):
+        return True
+    return "image" in (architecture.get("modality") or "").split("->")[0]
+
+
+class _RawStore:
+    """Temporary file holding the raw document bytes of a streamed catalog, shared by its records."""
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.lock = threading.Lock()
+
+    def write(self, chunk: bytes):
+        with self.lock:
+            self.file.write(chunk)
+
+    def read(self, offset: int, length: int) -> bytes:
+        with self.lock:
+            self.file.seek(offset)
+            data = self.file.read(length)
+            self.file.seek(0, 2)
+            return data
+
+
+def _from_latin1(value):
+    """Undoes the latin-1 decoding of the stream for values that leave the parser."""
+    if isinstance(value, str):
+        try:
+            return value.encode("latin-1").decode("utf-8")
+        except UnicodeError:
+            return value
+    if isinstance(value, list):
+        return [_from_latin1(item) for item in value]
+    if isinstance(value, dict):
+        return {_from_latin1(k): _from_latin1(v) for k, v in value.items()}
+    return value
+
+
+class ModelRecord:
+    """
+    Compact stand-in for a model dict from a provider root document.
+
+    Keeps the fields model selection and the catalog need; supports the
+    model["id"] / model.get("sats_pricing") access the bot uses on plain
+    dicts. Any other key loads the full model from the raw store, if the
+    document was parsed with keep_raw=True.
+    """
+
+    __slots__ = ("id", "prompt", "completion", "max_cost", "context_length",
+                 "image_input", "sats_pricing", "_store", "_offset", "_length")
+
+    def __init__(self, model: Dict[str, Any], store: Optional[_RawStore] = None,
+                 offset: int = 0, length: int = 0):
+        # Runs once per model of every fetched catalog, so it reads the dict
+        # directly instead of going through normalize_pricing and friends
+        get = model.get
+        model_id = get("id")
+        # Ids are almost always ASCII, which reads the same in latin-1
+        self.id = model_id if type(model_id) is str and model_id.isascii() else _from_latin1(model_id)
+        sats_pricing = get("sats_pricing")
+        if sats_pricing:
+            self.prompt = _float(sats_pricing.get("prompt"))
+            self.completion = _float(sats_pricing.get("completion"))
+            self.max_cost = _float(sats_pricing.get("max_cost"))
+            # Built once: model selection reads it for every model of every probe
+            self.sats_pricing = {"prompt": self.prompt, "completion": self.completion}
+            if self.max_cost == self.max_cost:  # not NaN
+                self.sats_pricing["max_cost"] = self.max_cost
+        else:
+            self.prompt, self.completion, self.max_cost = normalize_pricing(model)
+            self.sats_pricing = None
+        context_length = get("context_length")
+        if not context_length:
+            context_length = (get("top_provider") or {}).get("context_length") or 0
+        self.context_length = int(context_length)
+        architecture = get("architecture")
+        self.image_input = bool(architecture) and _accepts_images(model)
+        self._store = store
+        self._offset = offset
+        self._length = length
+
+    def load(self) -> Dict[str, Any]:
+        """Returns the full model dict as the provider published it."""
+        if self._store is None:
+            raise LookupError(f"No raw record stored for model {self.id}")
+        return json.loads(self._store.read(self._offset, self._length).decode("utf-8"))
+
+    def get(self, key: str, default=None):
+        if key == "sats_pricing":  # fast path, model selection calls it per model
+            return self.sats_pricing if self.sats_pricing is not None else default
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key: str):
+        if key == "id":
+            return self.id
+        if key == "sats_pricing":
+            pricing = self.sats_pricing
+            if pricing is None:
+                raise KeyError(key)
+            return pricing
+        if key == "context_length":
+            return self.context_length
+        if self._store is None:
+            raise KeyError(key)
+        return self.load()[key]
+
+    def __repr__(self) -> str:
+        return f"ModelRecord(id={self.id!r}, prompt={self.prompt}, completion={self.completion}, max_cost={self.max_cost})"
+
+
+class _JSONStream:
+    """
+    Incremental reader over a JSON document arriving in byte chunks.
+
+    Bytes are decoded as latin-1 so that string positions are byte offsets
+    into the document; JSON syntax is ASCII, so structure parses the same and
+    the few string values kept are converted back with _from_latin1.
+    """
+
+    def __init__(self, chunks, store: Optional[_RawStore] = None):
+        self.chunks = iter(chunks)
+        self.store = store
+        self.scan = json.JSONDecoder().scan_once
+        self.buffer = ""
+        self.base = 0  # byte offset of buffer[0] in the document
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, min_length: int = 0) -> bool:
+        """
+        Appends the next chunk, and more until `min_length` unread characters are buffered.
+
+        Returns False if the document had no more chunks.
+        """
+        if self.eof:
+            return False
+        pieces = [self.buffer[self.pos:]]
+        length = len(pieces[0])
+        for chunk in self.chunks:
+            if chunk:
+                if self.store is not None:
+                    self.store.write(chunk)
+                pieces.append(chunk.decode("latin-1"))
+                length += len(chunk)
+                if length >= min_length:
+                    break
+        else:
+            self.eof = True
+        if len(pieces) == 1:
+            return False
+        self.base += self.pos
+        self.buffer = "".join(pieces)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character ('' at the end)."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise json.JSONDecodeError(f"Expected one of {chars!r}", self.buffer, self.pos)
+        self.pos += 1
+        return char
+
+    def value(self) -> tuple:
+        """Decodes the next complete JSON value; returns (value, byte offset, byte length)."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.scan(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    start, self.pos = self.pos, end
+                    return value, self.base + start, end - start
+            except (StopIteration, json.JSONDecodeError):
+                if self.eof:
+                    raise json.JSONDecodeError("Expecting value", self.buffer, self.pos) from None
+            # The value is rescanned from its start, so at least double what is buffered
+            # of it: a value spanning many chunks is rescanned a few times, not once per chunk
+            self._fill(2 * (len(self.buffer) - self.pos))
+
+
+def parse_provider_document(chunks, keep_raw: bool = False) -> Dict[str, Any]:
+    """
+    Parses a provider root document from an iterable of byte chunks.
+
+    Top-level fields other than "models" are returned as decoded. "models" is
+    returned as a list of ModelRecord, decoded one model at a time, so peak
+    memory is one chunk plus one model instead of the whole document. With
+    keep_raw the document is also spooled to a temporary file, so
+    ModelRecord.load() can return the full model dicts.
+
+    Raises:
+        json.JSONDecodeError: If the body is not a JSON object
+    """
+    store = _RawStore() if keep_raw else None
+    stream = _JSONStream(chunks, store)
+    document: Dict[str, Any] = {}
+    stream.expect("{")
+    if stream.peek() == "}":
+        return document
+    while True:
+        key = _from_latin1(stream.value()[0])
+        stream.expect(":")
+        if key == "models" and stream.peek() == "[":
+            stream.expect("[")
+            models = []
+            if stream.peek() != "]":
+                while True:
+                    model, offset, length = stream.value()
+                    if isinstance(model, dict):
+                        models.append(ModelRecord(model, store, offset, length))
+                    # Fast path for the common "},{" separator
+                    if stream.buffer[stream.pos:stream.pos + 1] == ",":
+                        stream.pos += 1
+                    elif stream.expect(",]") == "]":
+                        break
+            else:
+                stream.expect("]")
+            document["models"] = models
+        else:
+            document[key] = _from_latin1(stream.value()[0])
+        if stream.expect(",}") == "}":
+            # Read to the end so the connection can go back to the pool
+            if stream.peek():
+                raise json.JSONDecodeError("Extra data", stream.buffer, stream.pos)
+            return document
+
+
+class ModelCatalog:
+    """Index of every model offered by every ingested provider."""
+
+    def __init__(self):
+        self.providers: List[str] = []
+        self.model_ids: List[str] = []
+        self._provider_index: Dict[str, int] = {}
+        self._model_index: Dict[str, int] = {}
+        self._reset_columns()
+
+    def _reset_columns(self):
+        self.provider_col = array("I")
+        self.model_col = array("I")
+        self.prompt_col = array("d")
+        self.completion_col = array("d")
+        self.total_col = array("d")
+        self.max_cost_col = array("d")
+        self.context_col = array("q")
+        self.image_col = array("b")
+        self._rows_by_model: Dict[int, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.model_col)
+
+    def _column(self, price: str) -> array:
+        if price not in PRICE_FIELDS:
+            raise ValueError(f"Unknown price field '{price}', expected one of {PRICE_FIELDS}")
+        return getattr(self, f"{price}_col")
+
+    def add_provider(self, provider_url: str, models: List[Dict[str, Any]]):
+        """Ingests a provider's model list, replacing whatever was known about it before."""
+        if provider_url in self._provider_index:
+            self.remove_provider(provider_url)
+        provider = self._provider_index.setdefault(provider_url, len(self.providers))
+        if provider == len(self.providers):
+            self.providers.append(provider_url)
+
+        for model in models:
+            model_id = model.get("id")
+            if not model_id:
+                continue
+            index = self._model_index.get(model_id)
+            if index is None:
+                index = self._model_index[model_id] = len(self.model_ids)
+                self.model_ids.append(model_id)
+            if isinstance(model, ModelRecord):
+                prompt, completion, max_cost = model.prompt, model.completion, model.max_cost
+                context, image_input = model.context_length, model.image_input
+            else:
+                prompt, completion, max_cost = normalize_pricing(model)
+                context = model.get("context_length") or (model.get("top_provider") or {}).get("context_length") or 0
+                image_input = _accepts_images(model)
+            self._rows_by_model.setdefault(index, []).append(len(self.model_col))
+            self.provider_col.append(provider)
+            self.model_col.append(index)
+            self.prompt_col.append(prompt)
+            self.completion_col.append(completion)
+            self.total_col.append(prompt + completion)
+            self.max_cost_col.append(max_cost)
+            self.context_col.append(int(context))
+            self.image_col.append(image_input)
+
+    def remove_provider(self, provider_url: str):
+        """Drops every row of a provider; the provider keeps its index for re-ingestion."""
+        provider = self._provider_index.get(provider_url)
+        if provider is None:
+            return
+        keep = list(map(operator.ne, self.provider_col, repeat(provider, len(self))))
+        columns = {name: getattr(self, name) for name in (
+            "provider_col", "model_col", "prompt_col", "completion_col",
+            "total_col", "max_cost_col", "context_col", "image_col")}
+        self._reset_columns()
+        for name, column in columns.items():
+            setattr(self, name, array(column.typecode, compress(column, keep)))
+        for row, model in enumerate(self.model_col):
+            self._rows_by_model.setdefault(model, []).append(row)
+
+    def row(self, row: int) -> Dict[str, Any]:
+        """Returns one offer as a dict."""
+        max_cost = self.max_cost_col[row]
+        return {
+            "provider": self.providers[self.provider_col[row]],
+            "model": self.model_ids[self.model_col[row]],
+            "prompt_sats": self.prompt_col[row],
+            "completion_sats": self.completion_col[row],
+            "max_cost_sats": None if math.isnan(max_cost) else max_cost,
+            "context_length": self.context_col[row],
+            "image_input": bool(self.image_col[row]),
+        }
+
+    def offers(self, model_id: str) -> List[Dict[str, Any]]:
+        """All providers offering a model."""
+        index = self._model_index.get(model_id)
+        return [self.row(row) for row in self._rows_by_model.get(index, [])]
+
+    def cheapest_provider(self, model_id: str, price: str = "total") -> Optional[Dict[str, Any]]:
+        """The cheapest offer for a model by the given price field, or None if nobody offers it."""
+        column = self._column(price)
+        index = self._model_index.get(model_id)
+        rows = [row for row in self._rows_by_model.get(index, []) if not math.isnan(column[row])]
+        if not rows:
+            return None
+        return self.row(min(rows, key=column.__getitem__))
+
+    def find(self, max_sats: Optional[float] = None, price: str = "total",
+             min_context: Optional[int] = None, image_input: Optional[bool] = None,
+             min_sats: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Offers matching every given filter, cheapest first.
+
+        Offers without a value for `price` are left out: max_cost is only known
+        for offers with sats_pricing, so price="max_cost" skips USD-only ones.
+
+        Args:
+            max_sats: Upper bound (exclusive) on `price`
+            price: Price field the bounds apply to: prompt, completion, total (default) or max_cost
+            min_context: Minimum context length in tokens
+            image_input: If set, whether the model must (True) or must not (False) accept images
+            min_sats: Lower bound (inclusive) on `price`
+        """
+        n = len(self)
+        column = self._column(price)
+        mask = list(map(operator.eq, column, column))  # False for NaN
+        if max_sats is not None:
+            mask = list(map(operator.and_, mask, map(operator.lt, column, repeat(max_sats, n))))
+        if min_sats is not None:
+            mask = list(map(operator.and_, mask, map(operator.ge, column, repeat(min_sats, n))))
+        if min_context is not None:
+            mask = list(map(operator.and_, mask, map(operator.ge, self.context_col, repeat(min_context, n))))
+        if image_input is not None:
+            mask = list(map(operator.and_, mask, map(operator.eq, self.image_col, repeat(int(image_input), n))))
+        rows = sorted(compress(range(n), mask), key=column.__getitem__)
+        return [self.row(row) for row in rows]
+
+    def price_spread(self, price: str = "total") -> Dict[str, Dict[str, Any]]:
+        """Per model: cheapest and most expensive offer, their spread and the number of providers."""
+        column = self._column(price)
+        spreads = {}
+        for index, rows in self._rows_by_model.items():
+            prices = [p for p in map(column.__getitem__, rows) if not math.isnan(p)]
+            if not prices:
+                continue
+            low, high = min(prices), max(prices)
+            spreads[self.model_ids[index]] = {
+                "min": low,
+                "max": high,
+                "spread": high - low,
+                "providers": len(prices),
+            }
+        return spreads
+
+
+def fetch_provider_models(provider_url: str, timeout: float = 10) -> List[ModelRecord]:
+    """Streams a provider's root document and returns its model list as ModelRecords."""
+    response = requests.get(provider_url, timeout=timeout, stream=True)
+    with response:
+        response.raise_for_status()
+        return parse_provider_document(response.iter_content(STREAM_CHUNK_SIZE)).get("models") or []
+
+
+def load_catalog(provider_urls: List[str], timeout: float = 10) -> ModelCatalog:
+    """Fetches every provider's model list in parallel and merges them into one catalog."""
+    catalog = ModelCatalog()
+
+    def fetch(provider_url):
+        try:
+            return provider_url, fetch_provider_models(provider_url, timeout)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Could not load models from {provider_url}: {e}")
+            return provider_url, None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(16, len(provider_urls)))) as executor:
+        for provider_url, models in executor.map(fetch, provider_urls):
+            if models is not None:
+                catalog.add_provider(provider_url, models)
+    return catalog
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the merged model catalog of all providers.")
+    parser.add_argument("--provider", action="append", help="provider URL (default: PROXIES)")
+    parser.add_argument("--price", choices=PRICE_FIELDS, default=None)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    cheapest_parser = subparsers.add_parser("cheapest", help="cheapest provider for a model")
+    cheapest_parser.add_argument("model_id")
+    find_parser = subparsers.add_parser("find", help="models matching filters")
+    find_parser.add_argument("--max-sats", type=float)
+    find_parser.add_argument("--min-context", type=int)
+    find_parser.add_argument("--image", action="store_true", help="only models accepting image input")
+    subparsers.add_parser("spread", help="price spread per model across providers")
+    args = parser.parse_args()
+
+    if args.provider:
+        providers = args.provider
+    else:
+        from routstr_bot import PROXIES
+        providers = PROXIES
+    catalog = load_catalog([url.rstrip("/") for url in providers])
+
+    if args.command == "cheapest":
+        result = catalog.cheapest_provider(args.model_id, args.price or "total")
+    elif args.command == "find":
+        result = catalog.find(args.max_sats, args.price or "total", args.min_context, True if args.image else None)
+    else:
+        result = catalog.price_spread(args.price or "total")
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,194 @@
+"""
+Command line entry point for one-off checks and maintenance.
+
+    python cli.py probe https://api.routstr.com     # probe one provider, exit 1 unless up
+    python cli.py probe-all                         # probe known providers by priority
+    python cli.py ledger                            # cashu tokens held per provider
+    python cli.py scores                            # provider scores from the probe history
+    python cli.py publish                           # publish status updates from stored results
+
+Only the modules a command needs are imported, inside the command: probe
+doesn't touch pynostr or the relays, and ledger/scores only import config and
+the state store, not routstr_bot.
+`python routstr_bot.py` still runs the full scheduled cycle.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+DEFAULT_NOTE = "Checking in on sound money, one block at a time."
+
+
+def _print_json(data):
+    print(json.dumps(data, indent=2, default=str))
+
+
+def _print_result(result: dict):
+    print(f"{result['provider_url']} ({result['version']}): {result['status']}, model {result['model_id']}, "
+          f"cost check {result['cost_check']}, refund {result['refund_status']}, {result['latency']:.2f}s")
+
+
+def cmd_probe(args) -> int:
+    import asyncio
+    import routstr_bot
+    from store import StateStore
+
+    store = None if args.no_record else StateStore(routstr_bot.STATE_DB)
+    try:
+        result = asyncio.run(routstr_bot.probe_provider(
+            args.note, routstr_bot.PROMPTS[args.prompt % len(routstr_bot.PROMPTS)], args.provider_url.rstrip("/"),
+            store, deadline=routstr_bot.Deadline(args.timeout),
+        ))
+    finally:
+        if store:
+            store.close()
+    if args.json:
+        _print_json(result)
+    else:
+        _print_result(result)
+    return 0 if result["status"] == "up" else 1
+
+
+def cmd_probe_all(args) -> int:
+    import asyncio
+    import routstr_bot
+    from scheduler import ProbeQueue, ProbeBudget
+    from store import StateStore
+
+    store = StateStore(routstr_bot.STATE_DB)
+    deadline = routstr_bot.Deadline(args.timeout)
+    try:
+        if args.discover:
+            discovered = asyncio.run(routstr_bot.discover_providers(store, deadline))
+        else:
+            discovered = routstr_bot.stored_discoveries(store)
+        queue = ProbeQueue(store, routstr_bot.PROXIES, discovered)
+        results = asyncio.run(routstr_bot.probe_by_priority(
+            queue, args.note, store, deadline, ProbeBudget(
+                routstr_bot.CYCLE_SATS_BUDGET if args.sats is None else args.sats, routstr_bot.PROBE_MAX_SATS,
+                routstr_bot.CHEAPEST_MODELS_ABOVE),
+        ))
+    finally:
+        store.close()
+    if args.json:
+        _print_json(results)
+    else:
+        for result in results:
+            _print_result(result)
+    return 0 if all(result["status"] == "up" for result in results) else 1
+
+
+def cmd_ledger(args) -> int:
+    import config
+
+    tokens = {}
+    if os.path.exists(config.DATA_FILE):
+        with open(config.DATA_FILE) as f:
+            tokens = json.load(f).get("cashu_tokens", {})
+    if args.json:
+        _print_json({url: {k: v for k, v in entry.items() if k != "cashu_token"} for url, entry in tokens.items()})
+        return 0
+    total = 0
+    for provider_url, entry in sorted(tokens.items()):
+        balance = entry.get("balance")
+        total += balance or 0
+        balance_text = f"{balance / 1000:12.3f} sats" if balance is not None else "     unknown     "
+        print(f"{provider_url:45s} {balance_text}  {entry.get('count', 0):6d} requests"
+              f"{'  (unsynced)' if entry.get('unsynced') else ''}")
+    print(f"{len(tokens)} token(s), {total / 1000:.3f} sats held at providers")
+    return 0
+
+
+def cmd_scores(args) -> int:
+    import config
+    from store import StateStore, provider_score
+
+    store = StateStore(config.STATE_DB)
+    try:
+        scores = {url: provider_score(store.history(url, args.limit)) for url in store.providers()}
+    finally:
+        store.close()
+    ranked = sorted(scores.items(), key=lambda item: item[1]["score"], reverse=True)
+    if args.json:
+        _print_json(dict(ranked))
+        return 0
+    for provider_url, score in ranked:
+        latency = f"{score['latency_p50']:6.2f}s" if score["latency_p50"] is not None else "     -"
+        print(f"{provider_url:45s} score {score['score']:5.1f}  up {score['uptime']:6.1%}  "
+              f"cost ok {score['cost_ok']:6.1%}  p50 {latency}  {score['probes']:4d} probes, "
+              f"last {score['last_status']}")
+    return 0
+
+
+def cmd_publish(args) -> int:
+    import asyncio
+    import routstr_bot
+    from store import StateStore
+
+    public_key = routstr_bot.get_bot_public_key()
+    if not public_key:
+        return 1
+    deadline = routstr_bot.Deadline(routstr_bot.PUBLISH_RESERVE_SECONDS + 10)
+    latest_event = asyncio.run(routstr_bot.get_latest_nostr_event(public_key, deadline))
+    if not latest_event:
+        print("Could not fetch the latest note from the relays")
+        return 1
+    store = StateStore(routstr_bot.STATE_DB)
+    try:
+        providers = None if args.any_provider else routstr_bot.known_providers(store)
+        results = store.latest_results(since=time.time() - args.since, providers=providers)
+        if not results:
+            print(f"No results recorded in the last {args.since:.0f}s")
+            return 1
+        asyncio.run(routstr_bot.publish_status_updates(latest_event, results, deadline, store))
+    finally:
+        store.close()
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Routstr provider checks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    probe = subparsers.add_parser("probe", help="probe one provider (exit status 1 unless up)")
+    probe.add_argument("provider_url")
+    probe.add_argument("--note", default=DEFAULT_NOTE, help="note the witty comment is about")
+    probe.add_argument("--prompt", type=int, default=0, help="index into PROMPTS")
+    probe.add_argument("--timeout", type=float, default=60, help="seconds before giving up")
+    probe.add_argument("--no-record", action="store_true", help="don't add the result to the probe history")
+    probe.add_argument("--json", action="store_true")
+    probe.set_defaults(func=cmd_probe)
+
+    probe_all = subparsers.add_parser("probe-all", help="probe known providers by priority within the budgets")
+    probe_all.add_argument("--discover", action="store_true", help="refresh providers from relay announcements first")
+    probe_all.add_argument("--sats", type=float, default=None, help="sats budget (default: CYCLE_SATS_BUDGET)")
+    probe_all.add_argument("--note", default=DEFAULT_NOTE, help="note the first witty comment is about")
+    probe_all.add_argument("--timeout", type=float, default=240, help="seconds for all probes together")
+    probe_all.add_argument("--json", action="store_true")
+    probe_all.set_defaults(func=cmd_probe_all)
+
+    ledger = subparsers.add_parser("ledger", help="show the cashu tokens held per provider")
+    ledger.add_argument("--json", action="store_true")
+    ledger.set_defaults(func=cmd_ledger)
+
+    scores = subparsers.add_parser("scores", help="show provider scores from the probe history")
+    scores.add_argument("--limit", type=int, default=100, help="latest probes per provider to score")
+    scores.add_argument("--json", action="store_true")
+    scores.set_defaults(func=cmd_scores)
+
+    publish = subparsers.add_parser("publish", help="publish status updates from the stored results")
+    publish.add_argument("--since", type=float, default=3600, help="use results from the last N seconds")
+    publish.add_argument("--any-provider", action="store_true", help="include providers no longer known")
+    publish.set_defaults(func=cmd_publish)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
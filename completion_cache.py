@@ -0,0 +1,248 @@
+"""
+Content-addressed cache of raw completion responses, for re-scoring past runs offline.
+
+Every paid completion the probe receives is stored together with the usage,
+response headers, timing and what the provider actually charged. Entries are
+immutable and keyed by a hash of their content, so a later response to the
+same request adds an entry instead of replacing the one an earlier run
+recorded. Requests are identified by the provider, the model id, a hash of
+the messages and the sampling parameters (completion_key); lookup returns the
+latest response to a request. Entries are gzipped JSON files; a SQLite index
+next to them tracks their sizes and last use, and the least recently used
+entries are evicted once the cache grows past its size limit.
+
+Each entry is also listed under the run (see routstr_bot.RUN_ID) that stored
+it, so a run can be re-scored later with the current scoring code, without
+sending a single request:
+
+    python completion_cache.py runs
+    python completion_cache.py rescore --run 3f2a9c1b7d4e
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Optional, Dict, Any, List, Iterator
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    request_key TEXT,
+    provider_url TEXT NOT NULL,
+    model TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE INDEX IF NOT EXISTS entries_request ON entries (request_key, stored_at);
+CREATE TABLE IF NOT EXISTS run_entries (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS run_entries_run ON run_entries (run_id, seq);
+CREATE INDEX IF NOT EXISTS run_entries_key ON run_entries (key);
+"""
+
+
+def _canonical(value: Any) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def completion_key(provider_url: str, model: str, messages: List[Dict[str, Any]],
+                   params: Optional[Dict[str, Any]] = None) -> str:
+    """The cache key of a completion request: sha256 over provider, model, messages hash and params."""
+    messages_hash = hashlib.sha256(_canonical(messages)).hexdigest()
+    return hashlib.sha256(_canonical({
+        "provider": provider_url.rstrip("/"), "model": model, "messages": messages_hash, "params": params or {},
+    })).hexdigest()
+
+
+class CompletionCache:
+    """Gzipped completion entries under `directory`, at most `max_bytes` on disk (compressed)."""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, "index.db"), timeout=30,
+                                          isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json.gz")
+
+    def put(self, provider_url: str, model: str, messages: List[Dict[str, Any]], params: Optional[Dict[str, Any]],
+            response: Dict[str, Any], run_id: Optional[str] = None) -> str:
+        """
+        Stores a completion and returns its entry key (a hash of its content).
+
+        An identical entry stored before is reused, never rewritten.
+
+        Args:
+            response: status_code, headers, body (raw text), elapsed and, for
+                      scoring, usage, sats_pricing and actual_costs_msats
+            run_id: Run the entry is listed under for rescoring
+        """
+        request_key = completion_key(provider_url, model, messages, params)
+        content = {"request_key": request_key, "provider": provider_url.rstrip("/"), "model": model,
+                   "messages": messages, "params": params or {}, **response}
+        key = hashlib.sha256(_canonical(content)).hexdigest()
+        now = time.time()
+        updated = self.connection.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key)).rowcount
+        if not updated or not os.path.exists(self._path(key)):
+            data = gzip.compress(_canonical({"key": key, "stored_at": now, **content}), compresslevel=6)
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_file = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as f:
+                f.write(data)
+            os.replace(tmp_file, path)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, request_key, provider_url, model, size, stored_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, request_key, content["provider"], model, len(data), now, now),
+            )
+        if run_id:
+            self.connection.execute("INSERT INTO run_entries (run_id, key, recorded_at) VALUES (?, ?, ?)",
+                                    (run_id, key, now))
+        self.evict()
+        return key
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns a stored entry (marking it recently used), or None if absent or evicted."""
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = json.loads(gzip.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        self.connection.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return entry
+
+    def lookup(self, provider_url: str, model: str, messages: List[Dict[str, Any]],
+               params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """The latest cached response to a request, or None."""
+        row = self.connection.execute(
+            "SELECT key FROM entries WHERE request_key = ? ORDER BY stored_at DESC LIMIT 1",
+            (completion_key(provider_url, model, messages, params),),
+        ).fetchone()
+        return self.get(row[0]) if row else None
+
+    def size(self) -> int:
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self) -> int:
+        """
+        Removes least recently used entries until the cache fits max_bytes; returns how many.
+
+        Evicted entries are also removed from the runs that listed them.
+        """
+        excess = self.size() - self.max_bytes
+        evicted = 0
+        if excess <= 0:
+            return 0
+        for row in self.connection.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            if excess <= 0:
+                break
+            try:
+                os.remove(self._path(row["key"]))
+            except FileNotFoundError:
+                pass
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (row["key"],))
+            self.connection.execute("DELETE FROM run_entries WHERE key = ?", (row["key"],))
+            excess -= row["size"]
+            evicted += 1
+        return evicted
+
+    def runs(self) -> List[Dict[str, Any]]:
+        """Every run with entries, oldest first: run_id, entries (still cached) and time span."""
+        rows = self.connection.execute(
+            "SELECT run_id, COUNT(entries.key) AS entries, MIN(recorded_at) AS started, "
+            "MAX(recorded_at) AS finished FROM run_entries LEFT JOIN entries USING (key) "
+            "GROUP BY run_id ORDER BY started"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def iter_run(self, run_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Streams the entries of a run in the order they were stored (every cached entry if run_id is None).
+
+        Entries evicted since are skipped. Entries are read one at a time, so
+        memory stays flat however large the run is.
+        """
+        if run_id is None:
+            keys = self.connection.execute("SELECT key FROM entries ORDER BY stored_at").fetchall()
+        else:
+            keys = self.connection.execute("SELECT key FROM run_entries WHERE run_id = ? ORDER BY seq",
+                                           (run_id,)).fetchall()
+        for row in keys:
+            try:
+                with open(self._path(row[0]), "rb") as f:
+                    yield json.loads(gzip.decompress(f.read()))
+            except FileNotFoundError:
+                continue
+
+
+def rescore(cache: CompletionCache, run_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Re-runs the current scoring on a cached run; yields per entry the stored and the new verdict."""
+    from routstr_bot import score_completion
+
+    for entry in cache.iter_run(run_id):
+        yield {"key": entry["key"], "provider": entry["provider"], "model": entry["model"],
+               "stored": entry.get("scores", {}), "rescored": score_completion(entry)}
+
+
+def _rescore_command(cache: CompletionCache, run_id: Optional[str], as_json: bool):
+    started = time.perf_counter()
+    total = changed = 0
+    for result in rescore(cache, run_id):
+        total += 1
+        differs = {name: value for name, value in result["rescored"].items()
+                   if result["stored"].get(name) != value}
+        if differs:
+            changed += 1
+        if as_json:
+            print(json.dumps(result))
+        elif differs:
+            print(f"{result['provider']} ({result['model']}): " + ", ".join(
+                f"{name} {result['stored'].get(name)} -> {value}" for name, value in differs.items()))
+    elapsed = time.perf_counter() - started
+    if not as_json:
+        print(f"{total} entries rescored in {elapsed:.2f}s "
+              f"({total / elapsed if elapsed else 0:.0f}/s), {changed} verdict(s) changed")
+
+
+if __name__ == "__main__":
+    import routstr_bot
+
+    parser = argparse.ArgumentParser(description="Inspect and re-score cached completions.")
+    parser.add_argument("--dir", default=routstr_bot.COMPLETION_CACHE_DIR, help="cache directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("runs", help="list the runs with cached completions")
+    rescore_parser = subparsers.add_parser("rescore", help="score a cached run again with the current code")
+    rescore_parser.add_argument("--run", help="run id (default: every cached entry)")
+    rescore_parser.add_argument("--json", action="store_true", help="print every result as a JSON line")
+    args = parser.parse_args()
+
+    cache = CompletionCache(args.dir, routstr_bot.COMPLETION_CACHE_MAX_BYTES)
+    try:
+        if args.command == "runs":
+            for run in cache.runs():
+                print(f"{run['run_id']}  {time.asctime(time.localtime(run['started']))}  "
+                      f"{run['entries']} cached entries")
+            print(f"{cache.size() / 1e6:.1f} MB of {cache.max_bytes / 1e6:.0f} MB used")
+        else:
+            _rescore_command(cache, args.run, args.json)
+    finally:
+        cache.close()
@@ -0,0 +1,15 @@
+"""
+Settings shared by the bot and the command line, loaded from the environment and .env.
+
+Kept free of heavy imports: cli.py commands that only read local state
+(ledger, scores) import this instead of routstr_bot.
+"""
+import os
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file, before any module reads its settings
+load_dotenv()
+
+DATA_FILE = "routstr_data.json" # File to store last status and event ID
+STATE_DB = os.getenv("ROUTSTR_STATE_DB", "routstr_state.db") # Probe history and worker leases
@@ -0,0 +1,148 @@
+"""
+Provider discovery from Nostr provider announcement events.
+
+Routstr providers announce themselves with parameterized replaceable events
+(kind PROVIDER_ANNOUNCEMENT_KIND in routstr_bot, 38421 by default). Only the
+newest announcement per author and "d" tag counts, so URLs a provider dropped
+from a replaced announcement are not picked up again. The endpoint URLs are
+read from "u" tags, or from the JSON content (endpoint_url(s) / url(s)) for
+announcements that put them there, normalized and de-duplicated.
+
+The bot pays every provider it probes, so only announcements from trusted
+authors count (ROUTSTR_PROVIDER_ANNOUNCERS in routstr_bot), and URLs pointing
+at the bot's own host or private network are dropped.
+"""
+import ipaddress
+import json
+import re
+import socket
+from typing import Optional, List, Dict, Any
+from urllib.parse import urlparse
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+URL_TAGS = ("u", "url", "endpoint")
+URL_FIELDS = ("endpoint_url", "endpoint_urls", "url", "urls")
+LOCAL_SUFFIXES = (".localhost", ".local", ".internal", ".onion")  # .onion: no Tor proxy is configured
+_HEX_PUBKEY = re.compile(r"^[0-9a-f]{64}$")
+
+
+def parse_authors(value: str) -> List[str]:
+    """Hex public keys from a comma or whitespace separated list; anything else is printed and skipped."""
+    authors = []
+    for author in re.split(r"[\s,]+", value.strip().lower()):
+        if not author:
+            continue
+        if _HEX_PUBKEY.match(author):
+            authors.append(author)
+        else:
+            print(f"Ignoring provider announcer '{author}': not a hex public key")
+    return authors
+
+
+def is_public_host(host: str) -> bool:
+    """False for localhost, .local/.internal/.onion names and loopback, private, link-local or reserved IPs."""
+    host = host.rstrip(".").lower()
+    if not host or host == "localhost" or host.endswith(LOCAL_SUFFIXES):
+        return False
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        try:
+            # Numeric forms the resolver also accepts, like 2130706433 or 127.1
+            address = ipaddress.IPv4Address(socket.inet_aton(host))
+        except OSError:
+            return True
+    return address.is_global
+
+
+def normalize_provider_url(url: str) -> Optional[str]:
+    """
+    Canonical form of a provider URL (lower-case scheme and host, no default port or trailing slash).
+
+    Returns None for anything the bot can't or mustn't probe: non-HTTP schemes,
+    missing hosts and hosts that aren't public (see is_public_host).
+    """
+    if not isinstance(url, str):
+        return None
+    parsed = urlparse(url.strip())
+    if parsed.scheme.lower() not in DEFAULT_PORTS or not parsed.hostname:
+        return None
+    host = parsed.hostname.lower().rstrip(".")
+    if not is_public_host(host):
+        return None
+    try:
+        port = parsed.port
+    except ValueError:
+        return None
+    if ":" in host:  # IPv6 literal
+        host = f"[{host}]"
+    netloc = host if port in (None, DEFAULT_PORTS[parsed.scheme.lower()]) else f"{host}:{port}"
+    return f"{parsed.scheme.lower()}://{netloc}{parsed.path.rstrip('/')}"
+
+
+def announced_urls(tags: List[List[str]], content: str) -> List[str]:
+    """The normalized provider URLs of one announcement, in announcement order."""
+    candidates = [tag[1] for tag in tags if len(tag) > 1 and tag[0] in URL_TAGS]
+    try:
+        data = json.loads(content) if content else {}
+    except ValueError:
+        data = {}
+    if isinstance(data, dict):
+        for field in URL_FIELDS:
+            value = data.get(field)
+            candidates.extend(value if isinstance(value, list) else [value] if value else [])
+    urls = []
+    for candidate in candidates:
+        url = normalize_provider_url(candidate)
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def latest_announcements(events) -> list:
+    """Keeps the newest event per (author, "d" tag), as relays do for replaceable events."""
+    latest = {}
+    for event in events:
+        d_tag = next((tag[1] for tag in event.tags if len(tag) > 1 and tag[0] == "d"), "")
+        key = (event.pubkey, d_tag)
+        if key not in latest or event.created_at > latest[key].created_at:
+            latest[key] = event
+    return list(latest.values())
+
+
+def providers_from_events(events, authors: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    De-duplicated providers announced by `events`: url, pubkey and announced_at (newest wins).
+
+    With `authors`, events by anyone else are ignored (relays don't all honour the author filter).
+    """
+    if authors is not None:
+        events = [event for event in events if event.pubkey in authors]
+    providers = {}
+    for event in latest_announcements(events):
+        for url in announced_urls(event.tags, event.content):
+            if url not in providers or event.created_at > providers[url]["announced_at"]:
+                providers[url] = {"url": url, "pubkey": event.pubkey, "announced_at": event.created_at}
+    return list(providers.values())
+
+
+def fetch_announcements(relays: List[str], kind: int, timeout: float, limit: int = 1000,
+                        authors: Optional[List[str]] = None) -> list:
+    """Queries the relays for provider announcement events, by `authors` if given (blocking, run it in a thread)."""
+    import uuid
+    from pynostr.filters import FiltersList, Filters
+    from pynostr.relay_manager import RelayManager
+
+    relay_manager = RelayManager(timeout=timeout)
+    for relay_url in relays:
+        relay_manager.add_relay(relay_url)
+    relay_manager.add_subscription_on_all_relays(
+        uuid.uuid1().hex, FiltersList([Filters(authors=authors, kinds=[kind], limit=limit)]))
+    relay_manager.run_sync()
+    events = {}
+    while relay_manager.message_pool.has_events():
+        event = relay_manager.message_pool.get_event().event
+        if event.kind == kind and event.verify():
+            events[event.id] = event  # the same event arrives from every relay
+    relay_manager.close_all_relay_connections()
+    return list(events.values())
@@ -0,0 +1,486 @@
+"""
+Local stand-ins for a Routstr provider and the Cashu wallet REST API.
+
+Both servers only use the standard library so they can be started anywhere
+the bot runs. They speak the same endpoints the bot and CashuWalletClient use:
+
+    Provider:  GET  /                      root document (version + models)
+               POST /v1/chat/completions   streaming and non-streaming
+               GET  /v1/wallet/info        balance of the api key (msats)
+               POST /v1/wallet/refund      returns the remaining balance as a token
+    Wallet:    GET  /api/balance
+               POST /api/send
+               POST /api/receive
+
+Tokens handed out by either server are fake cashu strings that encode their
+amount, so the provider can credit a token minted by the wallet and the wallet
+can import a refund or change token issued by the provider.
+
+A single provider server can stand in for many providers: any path prefixed
+with /p/<n> is served by the same backend, e.g. http://127.0.0.1:8000/p/3.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List
+
+from catalog import SATS_PER_USD
+
+FAKE_TOKEN_PREFIX = "cashuFake"
+FAKE_MINT_URL = "https://mint.fake.local"
+PROVIDER_PREFIX_PATTERN = re.compile(r"^/p/\d+")
+
+FAKE_REPLIES = [
+    "Sounds like someone finally found a use case: stacking sats while everyone else argues.",
+    "Bold take, but the only thing scaling faster than Lightning is the list of people who missed it.",
+    "Ah yes, another chain promising speed; Bitcoin just keeps producing blocks in the meantime.",
+    "Cashu makes payments so private even this comment doesn't know who paid for it.",
+]
+
+
+def make_fake_token(amount: int) -> str:
+    """Creates a fake cashu token string worth `amount` sats."""
+    return f"{FAKE_TOKEN_PREFIX}{int(amount)}x{uuid.uuid4().hex}"
+
+
+def parse_fake_token(token: str) -> Optional[int]:
+    """Returns the amount encoded in a fake cashu token, or None if it isn't one."""
+    if not token or not token.startswith(FAKE_TOKEN_PREFIX):
+        return None
+    amount, _, nonce = token[len(FAKE_TOKEN_PREFIX):].partition("x")
+    if not amount.isdigit() or not nonce:
+        return None
+    return int(amount)
+
+
+def generate_catalog(size: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Generates a provider model catalog shaped like a real Routstr root document.
+
+    Prices are spread so that a fair share of models falls into the bot's default
+    selection window (max_cost between CHEAPEST_MODELS_ABOVE and +DEFAULT_MAX_COSTS_RANGE).
+    """
+    rng = random.Random(seed)
+    models = []
+    for i in range(size):
+        prompt_sats = round(rng.uniform(0.00005, 0.005), 8)
+        completion_sats = round(prompt_sats * rng.uniform(1.5, 5), 8)
+        context_length = rng.choice([8192, 32768, 131072, 1048576])
+        max_completion_tokens = min(context_length // 4, 16384)
+        max_prompt_cost = round(prompt_sats * context_length / 50, 4)
+        max_completion_cost = round(completion_sats * max_completion_tokens / 50, 4)
+        input_modalities = ["text", "image"] if i % 3 == 0 else ["text"]
+        models.append({
+            "id": f"fake/model-{i}",
+            "name": f"Fake: Model {i}",
+            "created": 1749137257 + i,
+            "description": f"Synthetic model {i} served by the local fake provider. " * 8,
+            "context_length": context_length,
+            "architecture": {
+                "modality": "text+image->text" if "image" in input_modalities else "text->text",
+                "input_modalities": input_modalities,
+                "output_modalities": ["text"],
+                "tokenizer": "Fake",
+                "instruct_type": None,
+            },
+            "pricing": {
+                "prompt": f"{prompt_sats / SATS_PER_USD:.12f}",
+                "completion": f"{completion_sats / SATS_PER_USD:.12f}",
+                "request": "0",
+                "image": "0",
+                "web_search": "0",
+                "internal_reasoning": "0",
+            },
+            "sats_pricing": {
+                "prompt": prompt_sats,
+                "completion": completion_sats,
+                "request": 0,
+                "image": 0,
+                "web_search": 0,
+                "internal_reasoning": 0,
+                "max_prompt_cost": max_prompt_cost,
+                "max_completion_cost": max_completion_cost,
+                "max_cost": round(max_prompt_cost + max_completion_cost, 4),
+            },
+            "top_provider": {
+                "context_length": context_length,
+                "max_completion_tokens": max_completion_tokens,
+                "is_moderated": False,
+            },
+            "per_request_limits": None,
+            "supported_parameters": ["max_tokens", "temperature", "top_p", "stop", "seed"],
+        })
+    return models
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    """Shared plumbing for the fake servers: JSON bodies, latency and error injection."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; with Nagle on, the body waits
+    # for the client's delayed ACK and every keep-alive request gains ~40ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.backend.verbose:
+            super().log_message(format, *args)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except json.JSONDecodeError:
+            return {}
+
+    def _send_json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_faults(self) -> bool:
+        """Applies configured latency; returns True if an injected error was sent."""
+        backend = self.server.backend
+        if backend.latency > 0:
+            time.sleep(backend.latency + backend.rng_uniform(0, backend.jitter))
+        if backend.error_rate > 0 and backend.rng_uniform(0, 1) < backend.error_rate:
+            self._send_json(500, {"detail": "Injected failure"})
+            return True
+        return False
+
+    def do_GET(self):
+        if not self._inject_faults():
+            self.server.backend.handle(self, "GET")
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        if not self._inject_faults():
+            self.server.backend.handle(self, "POST")
+
+
+class _Backend:
+    def __init__(self, latency: float, jitter: float, error_rate: float, seed: Optional[int], verbose: bool):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def rng_uniform(self, a: float, b: float) -> float:
+        with self.lock:
+            return self._rng.uniform(a, b)
+
+
+class FakeProvider(_Backend):
+    """
+    In-memory Routstr provider.
+
+    Args:
+        latency: Seconds to sleep before answering each request
+        jitter: Extra random latency in seconds, uniformly distributed in [0, jitter]
+        error_rate: Probability (0-1) that any request is answered with HTTP 500
+        overbilling: Fraction charged on top of the advertised price (0.1 = 10% more)
+        catalog_size: Number of models in the root document
+        seed: Seed for catalog generation, token counts and fault injection
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 overbilling: float = 0.0, catalog_size: int = 50, seed: Optional[int] = 0,
+                 version: str = "0.0.0-fake", verbose: bool = False):
+        super().__init__(latency, jitter, error_rate, seed, verbose)
+        self.overbilling = overbilling
+        self.version = version
+        self.balances: Dict[str, int] = {}  # api key / token -> msats
+        self.set_models(generate_catalog(catalog_size, seed or 0))
+
+    def set_models(self, models: List[Dict[str, Any]]):
+        """Replaces the served catalog."""
+        self.models = models
+        self.models_by_id = {model["id"]: model for model in self.models}
+        self._root_document = json.dumps({
+            "name": "Fake Routstr Provider",
+            "description": "Local stand-in for offline benchmarks",
+            "version": self.version,
+            "npub": "",
+            "mints": [FAKE_MINT_URL],
+            "http_url": "",
+            "onion_url": "",
+            "models": self.models,
+        }).encode()
+
+    def _credit(self, token: str) -> Optional[str]:
+        """Returns the api key for a bearer token, crediting fresh cashu tokens."""
+        with self.lock:
+            if token in self.balances:
+                return token
+            amount = parse_fake_token(token)
+            if amount is None:
+                return None
+            self.balances[token] = amount * 1000
+            return token
+
+    def _charge(self, key: str, model: Dict[str, Any], prompt_tokens: int, completion_tokens: int) -> bool:
+        pricing = model["sats_pricing"]
+        cost_msats = (prompt_tokens * pricing["prompt"] + completion_tokens * pricing["completion"]) * 1000
+        cost_msats = int(math.ceil(cost_msats * (1 + self.overbilling)))
+        with self.lock:
+            if self.balances.get(key, 0) < pricing["max_cost"] * 1000:
+                return False
+            self.balances[key] -= cost_msats
+            return True
+
+    def handle(self, request: _JSONHandler, method: str):
+        path = PROVIDER_PREFIX_PATTERN.sub("", request.path.split("?")[0]).rstrip("/")
+        if method == "GET" and path == "":
+            request.send_response(200)
+            request.send_header("Content-Type", "application/json")
+            request.send_header("Content-Length", str(len(self._root_document)))
+            request.end_headers()
+            request.wfile.write(self._root_document)
+        elif method == "POST" and path == "/v1/chat/completions":
+            self._chat_completions(request)
+        elif method == "GET" and path == "/v1/wallet/info":
+            key = self._api_key(request)
+            if key is None:
+                request._send_json(401, {"detail": "Invalid API key"})
+            else:
+                request._send_json(200, {"api_key": key[:16], "balance": self.balances[key]})
+        elif method == "POST" and path == "/v1/wallet/refund":
+            key = self._api_key(request)
+            if key is None:
+                request._send_json(401, {"detail": "Invalid API key"})
+                return
+            with self.lock:
+                balance = self.balances.pop(key, 0)
+            request._send_json(200, {"token": make_fake_token(balance // 1000)})
+        else:
+            request._send_json(404, {"detail": "Not Found"})
+
+    def _api_key(self, request: _JSONHandler) -> Optional[str]:
+        auth = request.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            return self._credit(auth[len("Bearer "):].strip())
+        return None
+
+    def _chat_completions(self, request: _JSONHandler):
+        body = request._read_json()
+        x_cashu = request.headers.get("x-cashu")
+        key = self._credit(x_cashu) if x_cashu else self._api_key(request)
+        if key is None:
+            request._send_json(401, {"detail": "Invalid or missing payment"})
+            return
+        model = self.models_by_id.get(body.get("model"))
+        if model is None:
+            request._send_json(400, {"detail": f"Model '{body.get('model')}' not found"})
+            return
+
+        prompt_text = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        reply = FAKE_REPLIES[int(self.rng_uniform(0, len(FAKE_REPLIES))) % len(FAKE_REPLIES)]
+        prompt_tokens = max(1, int(len(prompt_text.split()) * 1.3))
+        completion_tokens = max(1, int(len(reply.split()) * 1.3))
+        if not self._charge(key, model, prompt_tokens, completion_tokens):
+            request._send_json(402, {"detail": "Insufficient balance"})
+            return
+
+        headers = {}
+        if x_cashu:
+            with self.lock:
+                change = self.balances.pop(key, 0)
+            headers["x-cashu"] = make_fake_token(change // 1000)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if not body.get("stream"):
+            request._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model["id"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }, headers)
+            return
+
+        request.send_response(200)
+        request.send_header("Content-Type", "text/event-stream")
+        request.send_header("Connection", "close")
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.end_headers()
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "model": model["id"],
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if i == 0 else " " + word},
+                    "finish_reason": "stop" if i == len(words) - 1 else None,
+                }],
+            }
+            if i == len(words) - 1:
+                chunk["usage"] = usage
+            request.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        request.wfile.write(b"data: [DONE]\n\n")
+        request.close_connection = True
+
+
+class FakeWallet(_Backend):
+    """
+    In-memory Cashu wallet REST API matching CashuWalletClient.
+
+    Args:
+        balance: Starting balance in sats, per mint
+        mints: Mint URLs the wallet holds proofs for
+        latency, jitter, error_rate, seed: See FakeProvider
+    """
+
+    def __init__(self, balance: int = 1_000_000, mints: Optional[List[str]] = None,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 seed: Optional[int] = 0, verbose: bool = False):
+        super().__init__(latency, jitter, error_rate, seed, verbose)
+        self.mint_balances = {mint: balance for mint in (mints or [FAKE_MINT_URL])}
+        self.spent_tokens = set()
+
+    def _response(self, message: str, data: Optional[Dict[str, Any]] = None, success: bool = True) -> Dict[str, Any]:
+        payload = {
+            "success": success,
+            "message": message,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        if data is not None:
+            payload["data"] = data
+        return payload
+
+    def handle(self, request: _JSONHandler, method: str):
+        path = request.path.split("?")[0].rstrip("/")
+        if method == "GET" and path == "/api/balance":
+            with self.lock:
+                data = {
+                    "balance": sum(self.mint_balances.values()),
+                    "proofCount": len(self.mint_balances),
+                    "unit": "sat",
+                    "mintBalances": [{"mintUrl": m, "balance": b} for m, b in self.mint_balances.items()],
+                }
+            request._send_json(200, self._response("Balance retrieved", data))
+        elif method == "POST" and path == "/api/send":
+            self._send(request, request._read_json())
+        elif method == "POST" and path == "/api/receive":
+            self._receive(request, request._read_json())
+        else:
+            request._send_json(404, self._response("Not Found", success=False))
+
+    def _send(self, request: _JSONHandler, body: Dict[str, Any]):
+        amount = body.get("amount")
+        mint_url = body.get("mintUrl") or next(iter(self.mint_balances))
+        if not isinstance(amount, int) or amount <= 0:
+            request._send_json(400, self._response("Amount must be a positive integer", success=False))
+            return
+        with self.lock:
+            if self.mint_balances.get(mint_url, 0) < amount:
+                request._send_json(400, self._response("Insufficient balance", success=False))
+                return
+            self.mint_balances[mint_url] -= amount
+            remaining = self.mint_balances[mint_url]
+        request._send_json(200, self._response("Token created", {
+            "token": make_fake_token(amount),
+            "amount": amount,
+            "mintUrl": mint_url,
+            "remainingBalance": remaining,
+        }))
+
+    def _receive(self, request: _JSONHandler, body: Dict[str, Any]):
+        token = body.get("token", "")
+        amount = parse_fake_token(token)
+        mint_url = body.get("mintUrl") or next(iter(self.mint_balances))
+        with self.lock:
+            if amount is None or token in self.spent_tokens:
+                request._send_json(400, self._response("Invalid or already spent token", success=False))
+                return
+            self.spent_tokens.add(token)
+            before = self.mint_balances.get(mint_url, 0)
+            self.mint_balances[mint_url] = before + amount
+        request._send_json(200, self._response("Token received", {
+            "importedAmount": amount,
+            "balanceBefore": before,
+            "balanceAfter": before + amount,
+            "mintUrl": mint_url,
+        }))
+
+
+def serve_in_thread(backend: _Backend, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    Starts a fake backend on a daemon thread and returns the running server.
+
+    Use port 0 to bind an ephemeral port; the base URL is then
+    f"http://{host}:{server.server_address[1]}". Call server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), _JSONHandler)
+    server.daemon_threads = True
+    server.backend = backend
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    """Returns the http base URL a server started by serve_in_thread listens on."""
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Routstr provider and Cashu wallet locally.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--provider-port", type=int, default=8000)
+    parser.add_argument("--wallet-port", type=int, default=3002)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of an injected HTTP 500")
+    parser.add_argument("--overbilling", type=float, default=0.0, help="fraction charged above the advertised price")
+    parser.add_argument("--catalog-size", type=int, default=50)
+    parser.add_argument("--wallet-balance", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    provider = serve_in_thread(FakeProvider(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        overbilling=args.overbilling, catalog_size=args.catalog_size,
+        seed=args.seed, verbose=args.verbose,
+    ), args.host, args.provider_port)
+    wallet = serve_in_thread(FakeWallet(balance=args.wallet_balance, seed=args.seed, verbose=args.verbose),
+                             args.host, args.wallet_port)
+    print(f"Fake provider: {base_url(provider)}  (more providers under {base_url(provider)}/p/<n>)")
+    print(f"Fake wallet:   {base_url(wallet)}  (set CASHU_WALLET_URL to use it)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        provider.shutdown()
+        wallet.shutdown()
@@ -0,0 +1,255 @@
+"""
+Load test for a single Routstr provider.
+
+Sends the same paid /v1/chat/completions request the probe uses (same model
+selection, prompt and payment headers) at increasing concurrency and records,
+per step, the achieved requests per second, error rate and latency
+percentiles. The ramp stops at the saturation knee, i.e. once adding
+concurrency stops increasing throughput, or when the sats spend cap would be
+exceeded.
+
+The test pays with a token of its own, minted for the spend cap plus the
+model's max_cost, so the probe token in the ledger is neither drained nor
+overwritten. Spending is measured from the provider's /v1/wallet/info balance
+of that token, and what is left of it is refunded into the wallet at the end.
+Requests the provider refuses for lack of funds (HTTP 402) are counted apart
+from provider errors and stop the ramp, as they say nothing about the provider.
+
+    python load_test.py https://api.routstr.com --steps 1,2,4,8,16 --duration 10 --spend-cap 200
+"""
+import argparse
+import asyncio
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
+
+import requests
+
+import routstr_bot
+from wallet import send_cashu_token
+
+DEFAULT_STEPS = [1, 2, 4, 8, 16, 32]
+DEFAULT_STEP_DURATION = 10.0
+DEFAULT_SPEND_CAP_SATS = 100
+KNEE_MIN_GAIN = 0.1  # a step must raise RPS by at least 10% over the previous one
+MAX_ERROR_RATE = 0.2
+LOAD_TEST_NOTE = "Load testing sound money, one request at a time."
+
+
+def latency_percentiles(samples: List[float]) -> Dict[str, float]:
+    """Returns p50/p90/p99/max of latency samples (seconds) in milliseconds."""
+    if not samples:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)] * 1000, 2)
+
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": round(ordered[-1] * 1000, 2)}
+
+
+def find_knee(steps: List[Dict[str, Any]], min_gain: float = KNEE_MIN_GAIN,
+              max_error_rate: float = MAX_ERROR_RATE) -> Optional[int]:
+    """
+    Returns the concurrency at which the provider saturates, or None if it kept scaling.
+
+    The knee is the last step before one that either raised RPS by less than
+    `min_gain` (relative) or pushed the error rate above `max_error_rate`.
+    """
+    for previous, current in zip(steps, steps[1:]):
+        gain = (current["rps"] - previous["rps"]) / previous["rps"] if previous["rps"] else 0.0
+        if gain < min_gain or current["error_rate"] > max_error_rate:
+            return previous["concurrency"]
+    return None
+
+
+def _wallet_balance(provider_url: str, headers: dict) -> Optional[int]:
+    try:
+        response = requests.get(provider_url + "/v1/wallet/info", headers=headers, timeout=10)
+        if response.ok:
+            return response.json()["balance"]
+        print(f"Wallet info returned {response.status_code}: {response.text}")
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        print(f"Could not read wallet balance for {provider_url}: {e}")
+    return None
+
+
+class _Budget:
+    """Thread-safe estimate of msats spent, used to stop before the cap is crossed."""
+
+    def __init__(self, cap_msats: float, spent_msats: float, per_request_msats: float):
+        self.cap_msats = cap_msats
+        self.spent_msats = spent_msats
+        self.per_request_msats = per_request_msats
+        self.lock = threading.Lock()
+
+    def reserve(self) -> bool:
+        with self.lock:
+            if self.spent_msats + self.per_request_msats > self.cap_msats:
+                return False
+            self.spent_msats += self.per_request_msats
+            return True
+
+
+def _run_step(provider_url: str, headers: dict, payload: dict, concurrency: int,
+              duration: float, budget: _Budget) -> Dict[str, Any]:
+    latencies = []
+    errors = 0
+    payment_errors = 0
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker():
+        nonlocal errors, payment_errors
+        session = requests.Session()
+        while time.monotonic() < stop_at and budget.reserve():
+            started = time.perf_counter()
+            try:
+                response = session.post(provider_url + "/v1/chat/completions",
+                                        headers=headers, json=payload, timeout=10)
+                status = response.status_code
+            except requests.exceptions.RequestException:
+                status = None
+            elapsed = time.perf_counter() - started
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                elif status == 402:
+                    payment_errors += 1
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    elapsed = time.perf_counter() - started
+
+    total = len(latencies) + errors
+    return {
+        "concurrency": concurrency,
+        "requests": total + payment_errors,
+        "errors": errors,
+        "payment_errors": payment_errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": latency_percentiles(latencies),
+    }
+
+
+async def run_load_test(provider_url: str, steps: List[int] = DEFAULT_STEPS,
+                        step_duration: float = DEFAULT_STEP_DURATION,
+                        spend_cap_sats: int = DEFAULT_SPEND_CAP_SATS) -> Dict[str, Any]:
+    """Ramps concurrent probe requests against a provider and returns per-step results."""
+    response = requests.get(provider_url, timeout=10)
+    response.raise_for_status()
+    model = routstr_bot.select_probe_model(response.json().get("models") or [])
+    if not model:
+        raise ValueError(f"No usable model found at {provider_url}")
+    max_cost = int(math.ceil(model["sats_pricing"]["max_cost"]))
+
+    minted = send_cashu_token(spend_cap_sats + max_cost + 15, timeout=routstr_bot.WALLET_TIMEOUT)
+    if not minted["success"]:
+        raise RuntimeError(f"Could not mint a token for the load test: {minted.get('message')}")
+    headers = routstr_bot.build_payment_headers(minted["data"]["token"])
+    try:
+        return await _ramp(provider_url, model, headers, steps, step_duration, spend_cap_sats)
+    finally:
+        try:
+            refunded = routstr_bot.refund_token(provider_url, headers)
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            print(f"Refund failed: {e}")
+            refunded = None
+        if refunded is None:
+            print(f"The rest of the load test token is still at {provider_url}: {minted['data']['token']}")
+        else:
+            print(f"Refunded {refunded} sats from the load test token")
+
+
+async def _ramp(provider_url: str, model: Dict[str, Any], headers: dict, steps: List[int],
+                step_duration: float, spend_cap_sats: int) -> Dict[str, Any]:
+    payload = {
+        "model": model["id"],
+        "messages": [{"role": "user", "content": routstr_bot.build_probe_prompt(
+            LOAD_TEST_NOTE, routstr_bot.PROMPTS[0])}],
+    }
+    max_cost_msats = model["sats_pricing"]["max_cost"] * 1000
+    cap_msats = spend_cap_sats * 1000
+
+    start_balance = _wallet_balance(provider_url, headers)
+    if start_balance is None:
+        raise RuntimeError(f"Could not read the starting balance at {provider_url}")
+    if start_balance < cap_msats + max_cost_msats:
+        raise RuntimeError(f"The load test token holds {start_balance / 1000} sats, "
+                           f"{spend_cap_sats} plus the model's max_cost are needed")
+    # Until real costs are observed, assume every request costs the model's max_cost
+    budget = _Budget(cap_msats, 0, max_cost_msats)
+    results = []
+    balance = start_balance
+    stop_reason = "completed all steps"
+
+    for concurrency in steps:
+        step = await asyncio.to_thread(_run_step, provider_url, headers, payload,
+                                       concurrency, step_duration, budget)
+        new_balance = _wallet_balance(provider_url, headers)
+        if new_balance is not None:
+            balance = new_balance
+        spent_msats = start_balance - balance
+        step["spent_sats"] = round(spent_msats / 1000, 3)
+        results.append(step)
+        print(f"concurrency {concurrency:4d}: {step['rps']:8.2f} rps, "
+              f"errors {step['error_rate']:.1%}, latency {step['latency_ms']}, spent {step['spent_sats']} sats")
+
+        succeeded = sum(s["requests"] - s["errors"] - s["payment_errors"] for s in results)
+        with budget.lock:
+            # Continue from the measured spend and the observed average cost per request
+            budget.spent_msats = spent_msats
+            if succeeded and spent_msats > 0:
+                budget.per_request_msats = spent_msats / succeeded
+        if step["payment_errors"]:
+            stop_reason = "token balance exhausted"
+            break
+        if find_knee(results) is not None:
+            stop_reason = "saturation knee reached"
+            break
+        if spent_msats + budget.per_request_msats > cap_msats:
+            stop_reason = "spend cap reached"
+            break
+
+    # A step cut short by the token running out isn't a measurement of the provider
+    measured = [step for step in results if not step["payment_errors"]]
+    return {
+        "provider": provider_url,
+        "model": model["id"],
+        "steps": results,
+        "knee_concurrency": find_knee(measured),
+        "spent_sats": round((start_balance - balance) / 1000, 3),
+        "stop_reason": stop_reason,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ramp concurrent paid requests against a Routstr provider.")
+    parser.add_argument("provider_url")
+    parser.add_argument("--steps", default=",".join(str(s) for s in DEFAULT_STEPS),
+                        help="comma separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=DEFAULT_STEP_DURATION, help="seconds per step")
+    parser.add_argument("--spend-cap", type=int, default=DEFAULT_SPEND_CAP_SATS, help="maximum sats to spend")
+    parser.add_argument("--json", action="store_true", help="print the full result as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load_test(
+        args.provider_url.rstrip("/"),
+        [int(s) for s in args.steps.split(",") if s.strip()],
+        args.duration,
+        args.spend_cap,
+    ))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        knee = result["knee_concurrency"]
+        print(f"Saturation knee: {'concurrency ' + str(knee) if knee else 'not reached'} "
+              f"({result['stop_reason']}), spent {result['spent_sats']} sats")
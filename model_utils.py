@@ -1,27 +1,21 @@
 import json
 
+from catalog import normalize_pricing
+
 def get_cheapest_model_above_price(models_data: dict, max_cost_sats: float) -> dict | None:
 
     cheapest_model = None
     min_prompt_cost_sats = float('inf')
 
-    # Assuming a conversion rate of 1 USD = 100,000,000 sats
-    USD_TO_SATS_RATE = 100_000_000
-
     for model in models_data.get("models", []):
-        pricing = model.get("pricing")
-        if pricing and "prompt" in pricing:
-            try:
-                prompt_cost_usd = float(pricing["prompt"])
-                prompt_cost_sats = prompt_cost_usd * USD_TO_SATS_RATE
+        # Same sats conversion as the catalog: sats_pricing, else USD at catalog.SATS_PER_USD.
+        # Prices that are missing or not numbers are NaN and never compare greater.
+        prompt_cost_sats = normalize_pricing(model)[0]
 
-                if prompt_cost_sats > max_cost_sats:
-                    if prompt_cost_sats < min_prompt_cost_sats:
-                        min_prompt_cost_sats = prompt_cost_sats
-                        cheapest_model = model
-            except ValueError:
-                # Handle cases where prompt price might not be a valid float
-                continue
+        if prompt_cost_sats > max_cost_sats:
+            if prompt_cost_sats < min_prompt_cost_sats:
+                min_prompt_cost_sats = prompt_cost_sats
+                cheapest_model = model
     return cheapest_model
 
 if __name__ == "__main__":
@@ -142,6 +136,10 @@ if __name__ == "__main__":
     # Test cases
     print("--- Test Cases ---")
 
+    # The examples below are written for 1 USD = 100,000,000 sats
+    import catalog
+    catalog.SATS_PER_USD = 100_000_000
+
     # Test 1: max_cost_sats = 10 (looking for models > 10 sats)
     # Based on the example data, there are no models with prompt pricing > 10 sats.
     # The prompt values are very small USD values, which convert to very small sats values.
@@ -1,38 +1,57 @@
+from __future__ import annotations
+
 import os
 import asyncio
+import contextlib
 import requests
 import json
-from pynostr.event import Event
-from pynostr.relay_manager import RelayManager
-from pynostr.filters import FiltersList, Filters
-from pynostr.event import EventKind
-from pynostr.key import PrivateKey
 import time
 import math
 import uuid
-from dotenv import load_dotenv
-from wallet import receive_cashu_token, send_cashu_token
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process ledger locking
+    fcntl = None
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import ssl
+
+# config loads .env, so it comes before the modules below read their settings
+from config import DATA_FILE, STATE_DB
+from wallet import receive_cashu_token, send_cashu_token, get_default_client
+from catalog import parse_provider_document, STREAM_CHUNK_SIZE
+from store import StateStore
+from completion_cache import CompletionCache
+from discovery import fetch_announcements, providers_from_events, parse_authors
+from scheduler import ProbeQueue, ProbeBudget
+from typing import TYPE_CHECKING
 
-# Load environment variables from .env file
-load_dotenv()
+# pynostr pulls in tornado and dominates import time; it is imported where it is
+# used, so commands that don't talk to relays (see cli.py) start fast
+if TYPE_CHECKING:
+    from pynostr.event import Event
+    from pynostr.relay_manager import RelayManager
 
 # --- Configuration ---
 # Placeholder: User should set this in their .env file
 NOSTR_BOT_NSEC = os.getenv("NOSTR_BOT_NSEC")
 MAIN_RELAYS = ["wss://relay.damus.io", "wss://nos.lol"]
 BACKUP_RELAYS = ["wss://multiplexer.huszonegy.world"]
-DATA_FILE = "routstr_data.json" # File to store last status and event ID
 PRODUCTION = os.getenv("PRODUCTION")
+CASSETTE_FILE = os.getenv("ROUTSTR_CASSETTE") # Record provider/wallet HTTP traffic to this file
 
-PROXIES = [
+PROXIES = [ # Seed providers, more are discovered from announcements (see discovery.py)
     "https://api.routstr.com",
     "https://ai.redsh1ft.com",
     "https://staging.routstr.com",
     "https://privateprovider.xyz",
-    "https://routstr.otrta.me"
-    "https://routstr.rewolf.dev", 
-    "http://localhost:8000",
+    "https://routstr.otrta.me",
+    "https://routstr.rewolf.dev",
 ]
+LOCAL_PROVIDER = os.getenv("ROUTSTR_LOCAL_PROVIDER") # e.g. http://localhost:8000, probed as a seed while developing a provider
+if LOCAL_PROVIDER:
+    PROXIES.append(LOCAL_PROVIDER)
 
 PROMPTS = [
     " Bitcoin relates to it. ",
@@ -47,8 +66,154 @@ PROMPTS = [
 CHEAPEST_MODELS_ABOVE=5
 NUMBER_OF_PROXIES_TO_TEST=4
 DEFAULT_MAX_COSTS_RANGE=10
+RUN_DEADLINE_SECONDS = float(os.getenv("RUN_DEADLINE_SECONDS", "240")) # Keep below the cron interval
+PUBLISH_RESERVE_SECONDS = 15 # Part of the run budget kept back for publishing the report
+REFUND_MIN_SECONDS = 5 # Don't start a refund with less time left, it is retried next run
+PREWARM_TIMEOUT = 5 # Seconds allowed per connection while pre-warming
+WALLET_TIMEOUT = 10 # Seconds allowed per wallet request
+STATUS_EVENT_KIND = 30078 # Parameterized replaceable event, one per provider ("d" tag = provider URL)
+STATUS_EVENT_TAG = "routstr-status" # "t" tag consumers filter the status events by
+LATENCY_CHANGE_RATIO = 0.5 # Republish when latency moved by 50% of the published value...
+LATENCY_CHANGE_MIN_MS = 2000 # ...and by at least this many milliseconds
+STATUS_REFRESH_SECONDS = float(os.getenv("STATUS_REFRESH_SECONDS", str(24 * 3600))) # Republish unchanged status this often
+SUMMARY_INTERVAL_SECONDS = float(os.getenv("SUMMARY_INTERVAL_SECONDS", str(6 * 3600))) # Cadence of the kind-1 summary note
+COMPLETION_CACHE_DIR = os.getenv("ROUTSTR_COMPLETION_CACHE", "completion_cache") # Paid completions kept for re-scoring, "" disables
+COMPLETION_CACHE_MAX_BYTES = int(float(os.getenv("ROUTSTR_COMPLETION_CACHE_MB", "256")) * 1024 * 1024)
+RUN_ID = uuid.uuid4().hex[:12] # Groups this run's cached completions, see completion_cache.py
+PROVIDER_ANNOUNCEMENT_KIND = int(os.getenv("ROUTSTR_PROVIDER_KIND", "38421")) # Nostr kind of provider announcements
+PROVIDER_ANNOUNCERS = parse_authors(os.getenv("ROUTSTR_PROVIDER_ANNOUNCERS", "")) # Hex pubkeys whose announcements are trusted, none disables discovery
+DISCOVERY_INTERVAL_SECONDS = float(os.getenv("DISCOVERY_INTERVAL_SECONDS", "3600")) # Query announcements at most this often
+PROVIDER_MAX_AGE_SECONDS = 30 * 24 * 3600 # Forget discovered providers not announced for this long
+CYCLE_SATS_BUDGET = float(os.getenv("CYCLE_SATS_BUDGET", "100")) # Most sats the probes of one run may spend
+TOKEN_HEADROOM_SATS = 15 # Minted on top of the probe model's max cost, so a token lasts a few probes
+PROBE_MAX_SATS = CHEAPEST_MODELS_ABOVE + DEFAULT_MAX_COSTS_RANGE + TOKEN_HEADROOM_SATS # Most a budgeted probe may commit (token minted for a new provider)
+PREWARM_MAX_PROVIDERS = 32 # Only the providers first in the probe queue are pre-warmed
+DISCOVERY_LEASE = "discovery" # Lease in the state db, so one run or worker queries announcements per interval
+
+# Shared by all provider requests so connections opened while pre-warming are reused
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_connections=PREWARM_MAX_PROVIDERS + 1, pool_maxsize=4))
+HTTP_SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=PREWARM_MAX_PROVIDERS + 1, pool_maxsize=4))
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage runs out of the run's time budget."""
+
+class Deadline:
+    """
+    Time budget of one run, passed down to every stage that does I/O.
+
+    Stages check it between steps and cap each network timeout at the time
+    left, so an unfinished stage stops by the deadline instead of overrunning.
+    """
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self):
+        if self.expired:
+            raise DeadlineExceeded()
+
+    def timeout(self, cap: float) -> float:
+        """A network timeout of at most `cap` seconds that ends by the deadline."""
+        self.check()
+        return min(cap, self.remaining())
+
+    def reserve(self, seconds: float) -> "Deadline":
+        """A deadline ending `seconds` earlier, leaving that time for later stages."""
+        child = Deadline(0)
+        child.expires_at = self.expires_at - seconds
+        return child
+
+def _timeout(deadline: Deadline | None, cap: float) -> float:
+    return deadline.timeout(cap) if deadline else cap
+
+def _receive_timeout(deadline: Deadline | None) -> float:
+    """Wallet timeout for receiving a token already issued: may run past the deadline, but not unbounded."""
+    return min(WALLET_TIMEOUT, max(deadline.remaining(), REFUND_MIN_SECONDS)) if deadline else WALLET_TIMEOUT
+
+def _deadline_chunks(chunks, deadline: Deadline | None):
+    """Stops a streamed body once the deadline passes (each read only has a per-read timeout)."""
+    for chunk in chunks:
+        if deadline:
+            deadline.check()
+        yield chunk
+# --- Connection Pre-warming ---
+
+def _warm_target(url: str, session: requests.Session | None, timeout: float) -> dict:
+    """Resolves a URL's host and opens a connection to it, timing both steps."""
+    parsed = urlparse(url)
+    secure = parsed.scheme in ("https", "wss")
+    port = parsed.port or (443 if secure else 80)
+    setup = {"url": url, "dns_ms": None, "connect_ms": None, "error": None}
+    try:
+        started = time.perf_counter()
+        socket.getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)
+        setup["dns_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        started = time.perf_counter()
+        if session is not None:
+            # Goes through the session's pool, so the TCP/TLS connection stays open for later requests
+            session.head(url, timeout=timeout)
+        else:
+            # Relay websockets are opened by pynostr itself; this only measures the setup cost
+            with socket.create_connection((parsed.hostname, port), timeout=timeout) as sock:
+                if secure:
+                    ssl.create_default_context().wrap_socket(sock, server_hostname=parsed.hostname).close()
+        setup["connect_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    except (OSError, requests.exceptions.RequestException) as e:
+        setup["error"] = str(e)
+    return setup
+
+def prewarm_connections(deadline: Deadline = None, provider_urls: list[str] = None) -> list[dict]:
+    """
+    Resolves and opens connections to the providers (default PROXIES), relays and the wallet in parallel.
+
+    Providers and the wallet are warmed through the sessions later requests use,
+    so DNS, TCP and TLS setup is paid here and not counted as provider latency.
+    Returns the setup cost per target.
+    """
+    timeout = _timeout(deadline, PREWARM_TIMEOUT)
+    wallet_client = get_default_client()
+    targets = [(url, HTTP_SESSION) for url in (PROXIES if provider_urls is None else provider_urls)]
+    targets += [(url, None) for url in MAIN_RELAYS + BACKUP_RELAYS]
+    targets.append((wallet_client.base_url, wallet_client.session))
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        return list(executor.map(lambda target: _warm_target(target[0], target[1], timeout), targets))
+
+def print_setup_costs(setup_costs: list[dict]):
+    print("Connection setup (not included in probe latency):")
+    for setup in setup_costs:
+        if setup["error"]:
+            print(f"  {setup['url']}: failed ({setup['error']})")
+        else:
+            print(f"  {setup['url']}: dns {setup['dns_ms']} ms, connect {setup['connect_ms']} ms")
+
 # --- Data Management Functions ---
 
+@contextlib.contextmanager
+def ledger_lock():
+    """
+    Holds an exclusive lock on the data file while it is read, modified and saved.
+
+    Several bot processes (see worker.py) can share one DATA_FILE; without the
+    lock one process' save_data would overwrite another's token updates.
+    """
+    with open(DATA_FILE + ".lock", "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 def load_data():
     """Loads data from the JSON file."""
     if os.path.exists(DATA_FILE):
@@ -58,24 +223,55 @@ def load_data():
 
 def save_data(data):
     """Saves data to the JSON file."""
-    with open(DATA_FILE, 'w') as f:
+    # Write then rename so readers never see a half-written file
+    tmp_file = f"{DATA_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
         json.dump(data, f, indent=4)
+    os.replace(tmp_file, DATA_FILE)
+
+def get_cashu_token(provider_url: str) -> str | None:
+    """The cashu token held for a provider, None if there is none."""
+    return load_data().get("cashu_tokens", {}).get(provider_url, {}).get("cashu_token")
 
 def get_cashu_balance(provider_url: str) -> int | None:
     """Fetches the cashu token balance for a given provider URL."""
     data = load_data()
     return data.get("cashu_tokens", {}).get(provider_url, {}).get("balance")
 
-def increment_token_usage_and_store_balance(provider_url: str, balance: int):
+def increment_token_usage_and_store_balance(provider_url: str, balance: int, count: int = 1):
     """Increments the usage count for a cashu token associated with a provider."""
-    data = load_data()
-    if provider_url in data.get("cashu_tokens", {}) and "count" in data["cashu_tokens"][provider_url]:
-        data["cashu_tokens"][provider_url]["count"] += 1
-        data["cashu_tokens"][provider_url]["balance"] = balance
+    with ledger_lock():
+        data = load_data()
+        if provider_url in data.get("cashu_tokens", {}) and "count" in data["cashu_tokens"][provider_url]:
+            data["cashu_tokens"][provider_url]["count"] += count
+            data["cashu_tokens"][provider_url]["balance"] = balance
+            save_data(data)
+            # print(f"Incremented usage count for {provider_url} to {data['cashu_tokens'][provider_url]['count']}")
+        else:
+            print(f"Warning: Could not increment count for {provider_url}. Token or count not found.")
+
+def set_token_synced(provider_url: str, synced: bool, balance: int | None = None):
+    """
+    Flags whether the stored balance of a provider's token matches the provider.
+
+    A probe interrupted after paying leaves the stored balance stale; the next
+    probe then re-reads it from the provider before paying again.
+    """
+    with ledger_lock():
+        data = load_data()
+        entry = data.get("cashu_tokens", {}).get(provider_url)
+        if entry is None:
+            return
+        if synced:
+            entry.pop("unsynced", None)
+            if balance is not None:
+                entry["balance"] = balance
+        else:
+            entry["unsynced"] = True
         save_data(data)
-        # print(f"Incremented usage count for {provider_url} to {data['cashu_tokens'][provider_url]['count']}")
-    else:
-        print(f"Warning: Could not increment count for {provider_url}. Token or count not found.")
+
+def is_token_synced(provider_url: str) -> bool:
+    return not load_data().get("cashu_tokens", {}).get(provider_url, {}).get("unsynced")
 
 # --- Helper Functions ---
 
@@ -86,12 +282,28 @@ def generate_comment(status: str, provider_url: str) -> str:
     else:
         return "\n🔴 Provider: `"+provider_url+"` is NOT routing AI queries rn, use alternatives. \n"
 
-async def get_latest_nostr_event(public_key: str) -> Event | None:
+def get_bot_public_key() -> str | None:
+    """The bot's hex public key from NOSTR_BOT_NSEC, None (with the reason printed) if unusable."""
+    if not NOSTR_BOT_NSEC:
+        print("NOSTR_BOT_NSEC not set, cannot query latest relay event.")
+        return None
+    from pynostr.key import PrivateKey
+    try:
+        return PrivateKey.from_nsec(NOSTR_BOT_NSEC).public_key.hex()
+    except ValueError as e:
+        print(f"Error: Invalid NOSTR_BOT_NSEC for deriving public key. Details: {e}")
+        return None
+
+async def get_latest_nostr_event(public_key: str, deadline: Deadline = None) -> Event | None:
     """Queries Nostr relays for the latest event from a specific public key with 'routstr-status' tag."""
+    from pynostr.relay_manager import RelayManager
+    from pynostr.filters import FiltersList, Filters
+    from pynostr.event import EventKind
+
     def _fetch_events_sync():
         try:
             # Create a new relay manager for fetching events
-            relay_manager = RelayManager(timeout=2)
+            relay_manager = RelayManager(timeout=_timeout(deadline, 2))
             for relay_url in MAIN_RELAYS + BACKUP_RELAYS:
                 relay_manager.add_relay(relay_url)
             
@@ -135,13 +347,14 @@ def get_cheapest_model_above_price(models_data: list, max_cost_sats: float, max_
     cheapest_model_costs = 100000000
 
     for model in models_data:
+        # ModelRecord.get returns a prebuilt dict of floats, plain dicts are the provider's JSON
         pricing = model.get("sats_pricing")
         if pricing and "max_cost" in pricing:
             try:
                 max_cost_this_model = float(pricing["max_cost"])
-                total_inference_costs = float(pricing['prompt'])+float(pricing['completion'])
-
+                # Most models are out of range, only price the ones that aren't
                 if max_cost_this_model < max_cost_sats+max_costs_range and max_cost_this_model >= max_cost_sats:
+                    total_inference_costs = float(pricing['prompt'])+float(pricing['completion'])
                     if cheapest_model_costs > total_inference_costs:
                         cheapest_model_costs = total_inference_costs
                         cheapest_model = model
@@ -151,8 +364,93 @@ def get_cheapest_model_above_price(models_data: list, max_cost_sats: float, max_
     if not cheapest_model and retry_if_not_found:
         cheapest_model = get_cheapest_model_above_price(models_data, 0, 10000, False)
     return cheapest_model
+
+def select_probe_model(models_data: list) -> dict | None:
+    """Picks the model a provider is probed with."""
+    return get_cheapest_model_above_price(models_data, CHEAPEST_MODELS_ABOVE, DEFAULT_MAX_COSTS_RANGE, True)
+
+def build_probe_prompt(note_content: str, custom_addon: str) -> str:
+    """Creates the AI prompt sent to providers, including the latest event content if available."""
+    return f"Here's a nostr note someone made: '{note_content}'. Add a witty comment about how '{custom_addon}'. Keep it short and concise, within 2 sentences. No hashtags. "
+
+def check_costs(usage: dict, sats_pricing: dict, actual_costs_msats: float) -> str:
+    """
+    The cost check of a completion: "good" if the provider charged the advertised
+    price (to 1 msat over), else "bad <charged minus expected msats>".
+    """
+    total_costs = usage['prompt_tokens'] * sats_pricing['prompt'] + usage['completion_tokens'] * sats_pricing['completion']
+    difference = actual_costs_msats - total_costs * 1000
+    if difference > 1 or difference < 0:
+        return "bad " + str(difference)
+    return "good"
+
+def score_completion(entry: dict) -> dict:
+    """
+    Scores a completion from what was recorded about it (see CompletionCache.put).
+
+    Pure, so cached runs can be re-scored with new scoring rules without paying again.
+    """
+    try:
+        ai_data = json.loads(entry["body"])
+        answered = bool(ai_data['choices'][0]['message']['content'])
+    except (ValueError, KeyError, IndexError, TypeError):
+        ai_data, answered = {}, False
+    usage = entry.get("usage") or ai_data.get("usage")
+    if usage and entry.get("actual_costs_msats") is not None:
+        cost_check = check_costs(usage, entry["sats_pricing"], entry["actual_costs_msats"])
+    else:
+        cost_check = "unknown"
+    return {"cost_check": cost_check, "answered": answered}
+
+_completion_cache: CompletionCache | None = None
+
+def get_completion_cache() -> CompletionCache | None:
+    """The completion cache at COMPLETION_CACHE_DIR, opened once per process; None if disabled."""
+    global _completion_cache
+    if not COMPLETION_CACHE_DIR:
+        return None
+    if _completion_cache is None or _completion_cache.directory != COMPLETION_CACHE_DIR:
+        if _completion_cache is not None:
+            _completion_cache.close()
+        _completion_cache = CompletionCache(COMPLETION_CACHE_DIR, COMPLETION_CACHE_MAX_BYTES)
+    return _completion_cache
+
+def cache_completion(provider_url: str, model: dict, messages: list, response: requests.Response,
+                     usage: dict, actual_costs_msats: float | None, scores: dict):
+    """Stores a paid completion in the completion cache; failures are printed, never raised."""
+    try:
+        cache = get_completion_cache()
+        if cache is None:
+            return
+        cache.put(provider_url, model['id'], messages, {}, {
+            "status_code": response.status_code,
+            # x-cashu carries the change token, it is not kept
+            "headers": {k: v for k, v in response.headers.items() if k.lower() != "x-cashu"},
+            "body": response.text,
+            "elapsed": response.elapsed.total_seconds(),
+            "usage": usage,
+            "sats_pricing": dict(model['sats_pricing']),
+            "actual_costs_msats": actual_costs_msats,
+            "scores": scores,
+        }, run_id=RUN_ID)
+    except Exception as e:
+        print(f"Could not cache completion of {provider_url}: {e}")
+
+def build_payment_headers(cashu_token: str, x_cashu: bool = False) -> dict:
+    """Request headers paying with the cashu token, either as x-cashu or as Bearer api key."""
+    if x_cashu:
+        return {
+            "Content-Type": "application/json",
+            "x-cashu": f"{cashu_token}",
+            "Accept-Encoding": "identity"
+        }
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {cashu_token}",
+        "Accept-Encoding": "identity"
+    }
     
-async def get_or_create_token(amount: int, provider_url: str):
+async def get_or_create_token(amount: int, provider_url: str, deadline: Deadline = None, budget: ProbeBudget = None):
     data = load_data()
     
     # Check if token exists for this provider
@@ -160,14 +458,24 @@ async def get_or_create_token(amount: int, provider_url: str):
         return data["cashu_tokens"][provider_url]["cashu_token"]
 
     # If not, create a new one
-    cashu_token_result = send_cashu_token(amount)
+    cashu_token_result = send_cashu_token(amount, timeout=_timeout(deadline, WALLET_TIMEOUT))
     if cashu_token_result["success"]:
         cashu_token = cashu_token_result["data"]["token"]
-        # Store the new token and initialize count
-        if "cashu_tokens" not in data:
-            data["cashu_tokens"] = {}
-        data["cashu_tokens"][provider_url] = {"cashu_token": cashu_token, "count": 0}
-        save_data(data)
+        with ledger_lock():
+            data = load_data()
+            existing = data.get("cashu_tokens", {}).get(provider_url, {}).get("cashu_token")
+            if not existing:
+                # Store the new token and initialize count
+                if "cashu_tokens" not in data:
+                    data["cashu_tokens"] = {}
+                data["cashu_tokens"][provider_url] = {"cashu_token": cashu_token, "count": 0}
+                save_data(data)
+        if existing:
+            # Another process stored a token meanwhile, take ours back into the wallet
+            receive_cashu_token(cashu_token, timeout=_receive_timeout(deadline))
+            return existing
+        if budget:
+            budget.charge(amount)
         print(f"Created and stored new cashu token for {provider_url}")
         return cashu_token
     else:
@@ -175,18 +483,39 @@ async def get_or_create_token(amount: int, provider_url: str):
         return ""
 
 async def delete_token(provider_url: str):
-    data = load_data()
-    if "cashu_tokens" in data and provider_url in data["cashu_tokens"]:
-        del data["cashu_tokens"][provider_url]
-        save_data(data)
-        print(f"Deleted cashu token for {provider_url}")
-    else:
-        print(f"No cashu token found for {provider_url} to delete.")
+    with ledger_lock():
+        data = load_data()
+        if "cashu_tokens" in data and provider_url in data["cashu_tokens"]:
+            del data["cashu_tokens"][provider_url]
+            save_data(data)
+            print(f"Deleted cashu token for {provider_url}")
+        else:
+            print(f"No cashu token found for {provider_url} to delete.")
+
+def refund_token(provider_url: str, headers: dict, timeout: float = 10) -> int | None:
+    """Takes what is left on the api key in `headers` back into the wallet; returns the sats received, None on failure."""
+    response = HTTP_SESSION.post(provider_url + "/v1/wallet/refund", headers=headers, timeout=timeout)
+    if not response.ok:
+        print(f"Refund at {provider_url} returned {response.status_code}: {response.text}")
+        return None
+    refund = response.json()
+    result = receive_cashu_token(refund["token"], timeout=timeout)
+    if not result['success']:
+        print(f"Could not receive the refund from {provider_url}: {result.get('message')}", refund)
+        return None
+    return result['data']['importedAmount']
 
-async def get_witty_bitcoin_comment(note_content: str, custom_addon: str, provider_url: str) -> tuple[str, str, str]:
+async def get_witty_bitcoin_comment(note_content: str, custom_addon: str, provider_url: str, deadline: Deadline = None,
+                                    budget: ProbeBudget = None) -> tuple[str, str, str]:
     """
     Generates a witty Bitcoin-related comment using the Routstr AI API.
-    Returns the AI response content and the API status ("up" or "down").
+    Returns the AI response content and the API status ("up", "down",
+    "timeout" if the run deadline passed before the probe finished, or
+    "skipped" if the provider's probe model costs more than the budget allows).
+
+    With a budget, the probe is charged what it spent: a token minted for it
+    less what was refunded, or what the provider deducted from a token held
+    from before (its max cost if that isn't known).
     """
     current_status = "down"  # Assume down by default
     ai_response_content = ""
@@ -195,63 +524,96 @@ async def get_witty_bitcoin_comment(note_content: str, custom_addon: str, provid
     cost_check = 'unknown' 
     refund_status = 'unknown'
     version = 'unknwon'
+    paid = False # Set once the completion request went out, the ledger balance is stale until re-read
+    spent_on_held = False # Set once the completion request went out on a token held from before
+    actual_costs = None
+    refunded_sats = 0
 
     try:
         # Create AI prompt including the latest event content if available
-        base_prompt = f"Here's a nostr note someone made: '{note_content}'. Add a witty comment about how '{custom_addon}'. Keep it short and concise, within 2 sentences. No hashtags. "
+        base_prompt = build_probe_prompt(note_content, custom_addon)
 
-        response = requests.get(
+        response = HTTP_SESSION.get(
             provider_url, 
-            timeout=10
+            timeout=_timeout(deadline, 10),
+            stream=True
             )
-        models_data = {}
-        if response.ok and response.status_code == 200:
-            # API is working, extract AI response content
-            try:
-                provider_data = response.json()
-                version = provider_data['version']
-                if 'models' in provider_data and provider_data['models']:
-                    models_data = provider_data['models']
-            except json.JSONDecodeError:
-                models_data = {}
-                print(f"Could not decode models data from JSON. Provider URL: {provider_url}")
+        # Closed on every path, so an unread or half-read body doesn't hold the connection
+        with response:
+            models_data = {}
+            if response.ok and response.status_code == 200:
+                # API is working, extract AI response content
+                try:
+                    # Stream the catalog, keeping only compact model records
+                    provider_data = parse_provider_document(_deadline_chunks(response.iter_content(STREAM_CHUNK_SIZE), deadline))
+                    version = provider_data['version']
+                    if 'models' in provider_data and provider_data['models']:
+                        models_data = provider_data['models']
+                except json.JSONDecodeError:
+                    models_data = {}
+                    print(f"Could not decode models data from JSON. Provider URL: {provider_url}")
+                    return ai_response_content, current_status, model_id, cost_check, refund_status, version
+            else:
+                print(f"API returned non-OK status: {response.status_code}. Provider URL: {provider_url}")
                 return ai_response_content, current_status, model_id, cost_check, refund_status, version
-        else:
-            print(f"API returned non-OK status: {response.status_code}. Provider URL: {provider_url}")
-            return ai_response_content, current_status, model_id, cost_check, refund_status, version
 
         models_count = len(models_data)
-        model = get_cheapest_model_above_price(models_data, CHEAPEST_MODELS_ABOVE, DEFAULT_MAX_COSTS_RANGE, True)
+        model = select_probe_model(models_data)
+        if model is None:
+            print(f"No model with sats pricing offered. Provider URL: {provider_url}")
+            return ai_response_content, current_status, model_id, cost_check, refund_status, version
         max_cost = int(math.ceil(model['sats_pricing']['max_cost']))
         model_id = model['id']
         print(f"Costs for model {model['id']}: ", model['sats_pricing']['max_cost'], " total no. of models: ", models_count)
 
-        cashu_token = await get_or_create_token(max_cost+15, provider_url)
+        token_sats = max_cost + TOKEN_HEADROOM_SATS
 
         x_cashu = False
 
-        if x_cashu:
-            headers = {
-                "Content-Type": "application/json",
-                "x-cashu": f"{cashu_token}",
-                "Accept-Encoding": "identity"
-            }
-        else:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {cashu_token}",
-                "Accept-Encoding": "identity"
-            } 
+        held_token = get_cashu_token(provider_url)
+        if held_token and not x_cashu:
+            headers = build_payment_headers(held_token, x_cashu)
+            if not is_token_synced(provider_url):
+                # A previous probe was interrupted after paying, re-read the balance first
+                response = HTTP_SESSION.get(provider_url + "/v1/wallet/info", headers=headers, timeout=_timeout(deadline, 10))
+                if response.ok:
+                    set_token_synced(provider_url, True, response.json()['balance'])
+            balance = get_cashu_balance(provider_url)
+            if balance is not None and balance < max_cost * 1000:
+                # The provider would answer 402, take the rest back and pay with a new token
+                print(f"Token balance {balance} msats at {provider_url} is below the max cost of {model_id}, refunding it")
+                refunded = refund_token(provider_url, headers, _timeout(deadline, 10))
+                if refunded is not None:
+                    await delete_token(provider_url)
+                    held_token = None
+                    refunded_sats += refunded
+
+        if budget:
+            # A held token only pays the completion, a new one is minted with headroom
+            needed_sats = max_cost if held_token else token_sats
+            if needed_sats > budget.probe_cap():
+                print(f"Skipping {provider_url}: probing model {model_id} needs {needed_sats} sats, "
+                      f"the budget allows {budget.probe_cap():.0f}")
+                return ai_response_content, "skipped", model_id, cost_check, refund_status, version
+        cashu_token = held_token or await get_or_create_token(token_sats, provider_url, deadline, budget)
+
+        headers = build_payment_headers(cashu_token, x_cashu)
 
-        response = requests.post(
+        if deadline:
+            deadline.check()
+        paid = True
+        spent_on_held = bool(held_token)
+        messages = [{"role": "user", "content": base_prompt}]
+        response = HTTP_SESSION.post(
             provider_url + "/v1/chat/completions",
             headers=headers,
             json={
                 "model": model['id'],
-                "messages": [{"role": "user", "content": base_prompt}]
+                "messages": messages
             },
-            timeout=10
+            timeout=_timeout(deadline, 10)
         )
+        completion_response = response
         
         if response.ok and response.status_code == 200:
             # API is working, extract AI response content
@@ -271,7 +633,7 @@ async def get_witty_bitcoin_comment(note_content: str, custom_addon: str, provid
                 if x_cashu:
                     refund_amount = 0
                     if response.headers["x-cashu"]:
-                        result = receive_cashu_token(response.headers["x-cashu"])
+                        result = receive_cashu_token(response.headers["x-cashu"], timeout=_receive_timeout(deadline))
                         if not result['success']:
                             if result['amount'] and result['amount'] != '':
                                 refund_amount = result['amount']
@@ -281,41 +643,43 @@ async def get_witty_bitcoin_comment(note_content: str, custom_addon: str, provid
                             refund_amount = result['data']['importedAmount']
                         old_balance = get_cashu_balance(provider_url)
                         if old_balance == None:
-                            old_balance = (max_cost+15)*1000
+                            old_balance = token_sats*1000
                             actual_costs = old_balance - refund_amount
                         else:
                             actual_costs = old_balance - refund_amount
-                        if ( actual_costs - total_costs*1000 > 1 or actual_costs - total_costs*1000 < 0 ):
-                            cost_check = "bad "+ str(actual_costs - total_costs*1000)
+                        cost_check = check_costs(ai_data['usage'], model['sats_pricing'], actual_costs)
+                        paid = False
                     else:
                         refund_status = "failed"
                 else:
-                    response = requests.get(
+                    response = HTTP_SESSION.get(
                         provider_url + "/v1/wallet/info",
                         headers=headers,
-                        timeout=10
+                        timeout=_timeout(deadline, 10)
                     )
                     if response.ok:
                         old_balance = get_cashu_balance(provider_url)
                         balance = response.json()['balance']
                         if old_balance == None:
-                            old_balance = (max_cost+15)*1000
+                            old_balance = token_sats*1000
                             actual_costs = old_balance - balance
                         else:
                             actual_costs = old_balance - balance
                         print(f'Old Balance: {old_balance} New Balance: {balance} - ACTUAL COSTS: ', actual_costs)
-                        if ( actual_costs - total_costs*1000 > 1 or  actual_costs - total_costs*1000 < 0 ):
-                            cost_check = "bad "+ str(actual_costs - total_costs*1000)
+                        cost_check = check_costs(ai_data['usage'], model['sats_pricing'], actual_costs)
 
-                        if(balance % 1000 < 21):
-                            refund_response = response = requests.post(
+                        paid = False
+                        out_of_time = deadline is not None and deadline.remaining() < REFUND_MIN_SECONDS
+                        if(balance % 1000 < 21 and not out_of_time):
+                            # Once the refund is issued its token is always received, deadline or not
+                            refund_response = response = HTTP_SESSION.post(
                                 provider_url + "/v1/wallet/refund",
                                 headers=headers,
-                                timeout=10
+                                timeout=_timeout(deadline, 10)
                             )
                             if refund_response.ok:
                                 print(refund_response.json())
-                                result = receive_cashu_token(refund_response.json()["token"])
+                                result = receive_cashu_token(refund_response.json()["token"], timeout=_receive_timeout(deadline))
                                 if not result['success']:
                                     if result['amount'] and result['amount'] != '':
                                         refund_amount = result['amount']
@@ -323,6 +687,7 @@ async def get_witty_bitcoin_comment(note_content: str, custom_addon: str, provid
                                     print(result)
                                 else:
                                     refund_amount = result['data']['importedAmount']
+                                    refunded_sats += refund_amount
                                     await delete_token(provider_url)
                                     refund_status = "success"
                                 if (refund_amount*1000 != balance - balance % 1000):
@@ -336,23 +701,48 @@ async def get_witty_bitcoin_comment(note_content: str, custom_addon: str, provid
                     else:
                         print(response.status_code)
                         print(response.text)
+                cache_completion(provider_url, model, messages, completion_response, ai_data['usage'], actual_costs,
+                                 {"cost_check": cost_check, "answered": bool(ai_response_content)})
             except json.JSONDecodeError:
                 print(json.JSONDecodeError.msg)
                 ai_response_content = "AI response received but couldn't parse content."
         else:
             print(f"API returned non-OK status: {response.status_code}. Response text: {response.text}")
 
+    except DeadlineExceeded:
+        print(f"Run deadline reached, probe of {provider_url} cancelled")
+        current_status = "timeout"
     except requests.exceptions.RequestException as e:
-        print(f"Routstr API unreachable: {e}")
-        current_status = "down"
+        if deadline and deadline.expired:
+            print(f"Run deadline reached, probe of {provider_url} cancelled: {e}")
+            current_status = "timeout"
+        else:
+            print(f"Routstr API unreachable: {e}")
+            current_status = "down"
+
+    if paid:
+        set_token_synced(provider_url, False)
+    if budget and spent_on_held:
+        budget.charge(actual_costs / 1000 if actual_costs is not None else max_cost)
+    elif budget and refunded_sats:
+        # The new token was charged in full, what came back (of it or of the token it replaced) wasn't spent
+        budget.charge(-refunded_sats)
     
     return ai_response_content, current_status, model_id, cost_check, refund_status, version
 
-async def publish_nostr_event(event_content: str, tags: list[list[str]] = None, relay_manager: RelayManager = None) -> str | None:
+async def publish_nostr_event(event_content: str, tags: list[list[str]] = None, relay_manager: RelayManager = None, deadline: Deadline = None, kind: int = 1) -> str | None:
     """Publishes a Nostr event to configured relays."""
+    event_ids = await publish_nostr_events([(event_content, tags, kind)], deadline)
+    return event_ids[0] if event_ids else None
+
+async def publish_nostr_events(events: list[tuple[str, list[list[str]], int]], deadline: Deadline = None) -> list[str] | None:
+    """Signs and publishes (content, tags, kind) events in one relay session, returning their IDs."""
     if not NOSTR_BOT_NSEC:
         print("Error: NOSTR_BOT_NSEC environment variable not set.")
         return None
+    from pynostr.event import Event
+    from pynostr.key import PrivateKey
+    from pynostr.relay_manager import RelayManager
 
     def _publish_sync():
         try:
@@ -362,29 +752,34 @@ async def publish_nostr_event(event_content: str, tags: list[list[str]] = None,
             return None
 
         # Create a fresh RelayManager like in tes.py
-        relay_manager = RelayManager(timeout=6)
+        # Publishing runs on the time reserved for it, never less than a second per step
+        relay_manager = RelayManager(timeout=min(6, max(1.0, deadline.remaining())) if deadline else 6)
         for relay_url in MAIN_RELAYS + BACKUP_RELAYS:
             relay_manager.add_relay(relay_url)
 
-        event = Event(
-            content=event_content,
-            tags=tags if tags else [],
-            kind=1 # Default to Note event
-        )
-        event.sign(private_key.hex())
+        signed_events = []
+        for event_content, tags, kind in events:
+            event = Event(
+                content=event_content,
+                tags=tags if tags else [],
+                kind=kind
+            )
+            event.sign(private_key.hex())
+            signed_events.append(event)
 
         try:
-            relay_manager.publish_event(event)
+            for event in signed_events:
+                relay_manager.publish_event(event)
             relay_manager.run_sync()
             import time
-            time.sleep(5) # allow the messages to send
+            time.sleep(min(5, max(1.0, deadline.remaining())) if deadline else 5) # allow the messages to send
             
             while relay_manager.message_pool.has_ok_notices():
                 ok_msg = relay_manager.message_pool.get_ok_notice()
                 if("True" not in str(ok_msg)):
                     print(f"Relay not OK: {ok_msg}")
             
-            return event.id
+            return [event.id for event in signed_events]
         except Exception as e:
             print(f"Error publishing event: {e}")
             return None
@@ -392,100 +787,283 @@ async def publish_nostr_event(event_content: str, tags: list[list[str]] = None,
     # Run the synchronous function in a thread to avoid blocking the event loop
     return await asyncio.to_thread(_publish_sync)
 
+# --- Status Report ---
+
+def build_status_report(latest_event: Event, results: list[dict]) -> str:
+    """
+    Builds the human-readable status note from probe results.
+
+    Each result holds provider_url, status, model_id, cost_check, refund_status,
+    version and response (the AI answer, empty if it failed).
+    """
+    proofs = ""
+    down_list = []
+    up_list = []
+    warning_list = []
+    timeout_list = []
+    for result in results:
+        provider_host = result["provider_url"].replace("http://","").replace("https://","")
+        # Generate event content (use AI response if available, otherwise fallback to generated comment)
+        if result["response"]:
+            proofs = proofs + result["response"] + "\nFrom provider: "+ provider_host + " (" + result["model_id"] + ") \n"+"\n"
+        else:
+            proofs = proofs + "AI Response Failed!" + "\nFrom provider: "+ provider_host + " (" + result["model_id"] + ") \n" +"\n"
+
+        provider_url = '`' + result["provider_url"] + f'` ({result["version"]})'
+        cost_check = result["cost_check"]
+        refund_status = result["refund_status"]
+        if result["status"] == "down":
+            down_list.append(provider_url)
+        elif result["status"] == "timeout":
+            timeout_list.append(provider_url)
+        else:
+            if (cost_check == 'good' and refund_status == 'unknown'):
+                up_list.append(provider_url)
+            elif (cost_check == 'good' and refund_status == 'success'):
+                provider_url = provider_url + " (✅ Refund checked) "
+                up_list.append(provider_url)
+            else:
+                if cost_check != 'good':
+                    provider_url = provider_url + f" (⚠️ Warning: Cost check failed! {cost_check.split(' ')[1]} difference) "
+                if refund_status == 'failed':
+                    provider_url = provider_url + " (🔴 Refund failed) "
+                warning_list.append(provider_url)
+
+    event_content = ("✅ Providers working as expected:" + "\n " + "\n ".join(up_list)) if len(up_list) > 0 else ""
+    event_content += ("\n⚠️ Providers with issues:" + "\n " +"\n ".join(warning_list)) if len(warning_list) > 0 else ""
+    event_content += ("\n🔴 Providers that are down:" + "\n " +"\n ".join(down_list)) if len(down_list) > 0 else ""
+    event_content += ("\n⏱️ Providers not checked in time:" + "\n " +"\n ".join(timeout_list)) if len(timeout_list) > 0 else ""
+    event_content += "\n\nProof \n\nA recent Nostr note: \n'" + latest_event.content + "'\nNote ID: "+ latest_event.bech32() + "\n\nAIs responses: \n" + proofs
+    return event_content
+
+def build_summary_event(latest_event: Event, results: list[dict]) -> tuple[str, list[list[str]], int]:
+    """The (content, tags, kind) of the summary note quoting the latest event."""
+    tags = [
+        ["q", latest_event.id, "wss://relay.damus.io", latest_event.pubkey],  # Quote tag with proper format
+        # ["p", '4ad6fa2d16e2a9b576c863b4cf7404a70d4dc320c0c447d10ad6ff58993eacc8']  # Tag the original author
+    ]
+    return build_status_report(latest_event, results) + "nostr:" + latest_event.bech32(), tags, 1
+
+def status_record(result: dict, checked_at: float) -> dict:
+    """The machine-readable content of a provider's status event."""
+    cost_check = result["cost_check"] or "unknown"
+    category, _, diff = cost_check.partition(" ")
+    return {
+        "provider": result["provider_url"],
+        "status": result["status"],
+        "latency_ms": round((result.get("latency") or 0) * 1000),
+        "cost_check": category,
+        "cost_diff_msats": float(diff) if diff else 0.0,
+        "refund_status": result["refund_status"],
+        "version": result["version"],
+        "model": result["model_id"],
+        "checked_at": int(checked_at),
+    }
+
+def status_changed(published: dict | None, record: dict, now: float) -> bool:
+    """
+    Whether a provider's status event needs republishing.
+
+    Any change of status, cost check, refund, version or model counts; latency
+    only once it moved by LATENCY_CHANGE_RATIO and LATENCY_CHANGE_MIN_MS, so
+    normal jitter doesn't cause an event per run. Unchanged events are still
+    refreshed every STATUS_REFRESH_SECONDS so consumers can tell they are current.
+    """
+    if not published:
+        return True
+    for field in ("status", "cost_check", "refund_status", "version", "model"):
+        if published.get(field) != record[field]:
+            return True
+    latency_diff = abs(record["latency_ms"] - published.get("latency_ms", 0))
+    if latency_diff >= LATENCY_CHANGE_MIN_MS and latency_diff >= LATENCY_CHANGE_RATIO * published.get("latency_ms", 0):
+        return True
+    return now - published.get("checked_at", 0) >= STATUS_REFRESH_SECONDS
+
+def build_status_event(record: dict) -> tuple[str, list[list[str]], int]:
+    """The (content, tags, kind) of a provider's replaceable status event."""
+    tags = [
+        ["d", record["provider"]],
+        ["t", STATUS_EVENT_TAG],
+        ["status", record["status"]],
+        ["alt", f"Routstr provider status: {record['provider']} is {record['status']}"],
+    ]
+    return json.dumps(record, separators=(",", ":")), tags, STATUS_EVENT_KIND
+
+async def publish_status_updates(latest_event: Event, results: list[dict], deadline: Deadline = None,
+                                 store: StateStore = None):
+    """
+    Publishes the status events of providers whose status changed, plus the summary note when due.
+
+    Everything goes out in one relay session, so publishing fits the time
+    PUBLISH_RESERVE_SECONDS keeps for it. The last published record per
+    provider and the time of the last summary are kept in the state store
+    (STATE_DB if none is given). Timed out probes say nothing new about a
+    provider and are left out. Outside production the changes and the summary
+    are printed and nothing is stored.
+    """
+    if store is None:
+        store = StateStore(STATE_DB)
+        try:
+            return await publish_status_updates(latest_event, results, deadline, store)
+        finally:
+            store.close()
+
+    now = time.time()
+    published = store.published_status()
+    changed = []
+    for result in results:
+        if result["status"] == "timeout":
+            continue
+        record = status_record(result, result.get("probed_at") or now)
+        if status_changed(published.get(result["provider_url"]), record, now):
+            changed.append(record)
+    summary_due = now - store.last_summary_at() >= SUMMARY_INTERVAL_SECONDS
+    print(f"{len(changed)} of {len(results)} provider status event(s) to update, summary note "
+          f"{'due' if summary_due else 'not due'}")
+
+    events = [build_status_event(record) for record in changed]
+    if summary_due:
+        events.append(build_summary_event(latest_event, results))
+    if PRODUCTION != 'true':
+        for content, _, _ in events:
+            print(content)
+        return
+    if not events:
+        return
+
+    event_ids = await publish_nostr_events(events, deadline)
+    if event_ids:
+        print(f"Published {len(changed)} status event(s)" + (" and the summary note" if summary_due else ""))
+        store.record_published(changed, now if summary_due else None)
+    else:
+        print("Failed to publish status events.")
+
+async def probe_provider(note_content: str, custom_addon: str, provider_url: str, store: StateStore = None,
+                         worker_id: str = None, deadline: Deadline = None, budget: ProbeBudget = None) -> dict:
+    """Probes one provider and records the result in the state store (skipped probes aren't recorded)."""
+    started = time.monotonic()
+    ai_response_content, current_status, model_id, cost_check, refund_status, version = await get_witty_bitcoin_comment(
+        note_content, custom_addon,
+        provider_url, deadline, budget
+        )
+    result = {
+        "provider_url": provider_url,
+        "status": current_status,
+        "model_id": model_id,
+        "cost_check": cost_check,
+        "refund_status": refund_status,
+        "version": version,
+        "response": ai_response_content,
+        "latency": time.monotonic() - started,
+    }
+    if store and current_status != "skipped":
+        store.record_result(worker_id=worker_id, **result)
+    return result
+
+# --- Provider Discovery and Scheduling ---
+
+async def discover_providers(store: StateStore, deadline: Deadline = None) -> list[str]:
+    """
+    Refreshes the discovered providers from relay announcements and returns them.
+
+    Only announcements by PROVIDER_ANNOUNCERS count; without any, discovery is
+    off. Relays are queried at most once per DISCOVERY_INTERVAL_SECONDS across
+    runs and workers (whoever takes the discovery lease); otherwise, or if the
+    query fails, the providers stored earlier are returned.
+    """
+    if not PROVIDER_ANNOUNCERS:
+        print("Provider discovery off, set ROUTSTR_PROVIDER_ANNOUNCERS to the pubkeys to trust")
+        return []
+    if store.claim(RUN_ID, [DISCOVERY_LEASE], DISCOVERY_INTERVAL_SECONDS):
+        try:
+            events = await asyncio.to_thread(fetch_announcements, MAIN_RELAYS + BACKUP_RELAYS,
+                                             PROVIDER_ANNOUNCEMENT_KIND, _timeout(deadline, 5),
+                                             authors=PROVIDER_ANNOUNCERS)
+            providers = providers_from_events(events, PROVIDER_ANNOUNCERS)
+            new = store.add_providers(providers)
+            print(f"Discovery: {len(events)} announcement(s), {len(providers)} provider(s), {new} new")
+        except Exception as e:
+            print(f"Provider discovery failed: {e}")
+    return stored_discoveries(store)
+
+def stored_discoveries(store: StateStore) -> list[str]:
+    """Discovered providers in the state db, still announced and by a trusted announcer."""
+    return store.discovered_providers(seen_since=time.time() - PROVIDER_MAX_AGE_SECONDS, pubkeys=PROVIDER_ANNOUNCERS)
+
+def known_providers(store: StateStore) -> list[str]:
+    """The seed providers followed by the discovered ones, without refreshing them."""
+    return list(dict.fromkeys(PROXIES + stored_discoveries(store)))
+
+async def probe_by_priority(queue: ProbeQueue, note_content: str, store: StateStore = None, deadline: Deadline = None,
+                            budget: ProbeBudget = None, worker_id: str = None) -> list[dict]:
+    """
+    Probes providers from the queue, highest priority first, while time and sats last.
+
+    Each answer becomes the note the next provider comments on. A provider whose
+    usual probe time no longer fits before the deadline is passed over for a
+    quicker one; providers left in the queue get more overdue and go first next run.
+    """
+    results = []
+    while len(queue):
+        if deadline and deadline.expired:
+            break
+        if budget and not budget.allows_probe():
+            print(f"Sats budget reached ({budget.spent_sats:.3f} of {budget.sats} sats spent)")
+            break
+        provider_url = queue.pop()
+        if deadline and deadline.remaining() < queue.expected_seconds[provider_url]:
+            continue
+        result = await probe_provider(note_content, PROMPTS[len(results) % len(PROMPTS)], provider_url,
+                                      store, worker_id, deadline, budget)
+        if result["status"] == "skipped":
+            continue
+        results.append(result)
+        if result["response"]:
+            note_content = result["response"]
+    print(f"Probed {len(results)} provider(s), {len(queue)} left for later runs")
+    return results
+
 # --- Main Logic ---
 
 async def main():
-    print('\nLogging: ', time.asctime())
-    if not NOSTR_BOT_NSEC:
-        print("NOSTR_BOT_NSEC not set, cannot query latest relay event.")
+    print('\nLogging: ', time.asctime(), 'run', RUN_ID)
+    deadline = Deadline(RUN_DEADLINE_SECONDS)
+    # Probing stops early enough to always publish whatever results are in
+    probe_deadline = deadline.reserve(PUBLISH_RESERVE_SECONDS)
+    public_key = get_bot_public_key()
+    if not public_key:
         return
 
+    store = StateStore(STATE_DB)
     try:
-        private_key = PrivateKey.from_nsec(NOSTR_BOT_NSEC)
-        public_key = private_key.public_key.hex()
-    except ValueError as e:
-        print(f"Error: Invalid NOSTR_BOT_NSEC for deriving public key. Details: {e}")
-        return
+        discovered = await discover_providers(store, probe_deadline)
+        queue = ProbeQueue(store, PROXIES, discovered)
+        print(f"{len(queue)} provider(s) known ({len(discovered)} discovered)")
+        try:
+            print_setup_costs(await asyncio.to_thread(prewarm_connections, probe_deadline,
+                                                      queue.ordered()[:PREWARM_MAX_PROVIDERS]))
+        except DeadlineExceeded:
+            print("Run deadline reached, connections not pre-warmed")
 
-    # Fetch the latest event from relays instead of local file
-    latest_event = await get_latest_nostr_event(public_key)
-    
-    current_status = "down" # Assume down by default
-    ai_response_content = ""
+        # Fetch the latest event from relays instead of local file
+        latest_event = await get_latest_nostr_event(public_key, probe_deadline)
 
-    note_content = "Error fetching event"
-    # Set up tags
-    tags = []
-    if latest_event:
-        note_content = latest_event.content
-        statuses = []
-        proofs = ""
-        refunds_checks = []
-        cost_checks = []
-        versions = []
-
-        # for n in range(len(proxies)):
-        for n in range(NUMBER_OF_PROXIES_TO_TEST):
-            ai_response_content, current_status, model_id, cost_check, refund_status, version = await get_witty_bitcoin_comment(
-                note_content, PROMPTS[n], 
-                PROXIES[n]
-                )
-            cost_checks.append(cost_check)
-            refunds_checks.append(refund_status)
-            versions.append(version)
-            # Generate event content (use AI response if available, otherwise fallback to generated comment)
-            if ai_response_content:
-                proofs = proofs + ai_response_content + "\nFrom provider: "+ PROXIES[n].replace("http://","").replace("https://","") + " (" + model_id + ") \n"+"\n"
-                note_content = ai_response_content
-                statuses.append(current_status)
-            else:
-                proofs = proofs + "AI Response Failed!" + "\nFrom provider: "+ PROXIES[n].replace("http://","").replace("https://","") + " (" + model_id + ") \n" +"\n"
-                statuses.append(current_status)
-    
-        tags.extend([
-            ["q", latest_event.id, "wss://relay.damus.io", latest_event.pubkey],  # Quote tag with proper format
-            # ["p", '4ad6fa2d16e2a9b576c863b4cf7404a70d4dc320c0c447d10ad6ff58993eacc8']  # Tag the original author
-        ])
-
-        down_list = []
-        up_list = []
-        warning_list = []
-        for n, s in enumerate(statuses):
-            if s == "down":
-                provider_url = '`' + PROXIES[n] + f'` ({versions[n]})'
-                down_list.append(provider_url)
-            else:
-                provider_url = '`' + PROXIES[n] + f'` ({versions[n]})'
-                if (cost_checks[n] == 'good' and refunds_checks[n] == 'unknown'):
-                    up_list.append(provider_url)
-                elif (cost_checks[n] == 'good' and refunds_checks[n] == 'success'):
-                    provider_url = provider_url + " (✅ Refund checked) "
-                    up_list.append(provider_url)
-                else:
-                    if cost_checks[n] != 'good':
-                        provider_url = provider_url + f" (⚠️ Warning: Cost check failed! {cost_checks[n].split(' ')[1]} difference) "
-                    if refunds_checks[n] == 'failed':
-                        provider_url = provider_url + " (🔴 Refund failed) "
-                    warning_list.append(provider_url)
-
-        event_content = ("✅ Providers working as expected:" + "\n " + "\n ".join(up_list)) if len(up_list) > 0 else ""
-        event_content += ("\n⚠️ Providers with issues:" + "\n " +"\n ".join(warning_list)) if len(warning_list) > 0 else ""
-        event_content += ("\n🔴 Providers that are down:" + "\n " +"\n ".join(down_list)) if len(down_list) > 0 else ""
-        event_content += "\n\nProof \n\nA recent Nostr note: \n'" + latest_event.content + "'\nNote ID: "+ latest_event.bech32() + "\n\nAIs responses: \n" + proofs
-
-        if (PRODUCTION=='true'):
-            new_event_id = await publish_nostr_event(event_content+"nostr:"+latest_event.bech32(), tags)
-
-            if new_event_id:
-                print(f"Published new status event: {new_event_id}")
-                # Save status for reference (keeping this for backward compatibility)
-            else:
-                print("Failed to publish Nostr event.")
+        if latest_event:
+            # Once a budget is spent, the remaining providers wait for the next run
+            results = await probe_by_priority(queue, latest_event.content, store, probe_deadline,
+                                              ProbeBudget(CYCLE_SATS_BUDGET, PROBE_MAX_SATS, CHEAPEST_MODELS_ABOVE))
+            await publish_status_updates(latest_event, results, deadline, store)
         else:
-            print(event_content)
-
-    else:
-        print("NOSTR DIDN'T WOWKR")
+            print("NOSTR DIDN'T WOWKR")
+    finally:
+        store.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if CASSETTE_FILE:
+        import cassette
+        import wallet
+        with cassette.record(CASSETTE_FILE, metadata={"ledger": load_data(), "wallet_url": wallet.DEFAULT_BASE_URL}):
+            asyncio.run(main())
+        print(f"Recorded HTTP traffic to {CASSETTE_FILE}")
+    else:
+        asyncio.run(main())
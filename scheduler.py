@@ -0,0 +1,104 @@
+"""
+Priority queue deciding which providers are probed first.
+
+A provider's priority grows with the time since its last probe (staleness),
+with how often its outcome flipped recently (instability) and with its
+importance: seed providers from PROXIES weigh double, and a higher score
+(see store.provider_score) means more users rely on it. Seeds never probed
+get the highest staleness. Discovered providers never probed age from when
+they were first announced, so an unvetted newcomer starts behind the curated
+seeds and moves up the longer it waits. Popping the queue within a run's
+time and sats budget covers hundreds of providers over a few runs, the most
+overdue ones first.
+"""
+import heapq
+import time
+from typing import Optional, Dict, List, Tuple
+
+from store import StateStore, provider_score
+
+STALE_AFTER_SECONDS = 3600  # a provider last probed this long ago has staleness 1
+MAX_STALENESS = 24.0
+INSTABILITY_WEIGHT = 2.0  # a provider flipping on every probe weighs 3x
+SEED_IMPORTANCE = 2.0
+DISCOVERED_IMPORTANCE = 1.0
+HISTORY_LIMIT = 20  # latest probes per provider considered
+DEFAULT_PROBE_SECONDS = 10.0  # expected probe time without an observed latency
+
+
+def probe_priority(score: Dict, importance: float, now: float, first_seen: Optional[float] = None) -> float:
+    """
+    Priority of a provider from its score summary; higher is probed first.
+
+    first_seen: When a discovered provider was first announced, its staleness
+                counts from then until it is probed
+    """
+    since = score["last_probed_at"] if score["last_probed_at"] is not None else first_seen
+    if since is None:
+        staleness = MAX_STALENESS
+    else:
+        staleness = min(max(now - since, 0) / STALE_AFTER_SECONDS, MAX_STALENESS)
+    ranking = 0.5 + score["score"] / 100
+    return staleness * (1 + INSTABILITY_WEIGHT * score["instability"]) * importance * ranking
+
+
+class ProbeQueue:
+    """Providers ordered by probe_priority, with the expected probe time of each."""
+
+    def __init__(self, store: StateStore, seeds: List[str], discovered: List[str], now: Optional[float] = None):
+        now = now or time.time()
+        self.heap: List[Tuple[float, int, str]] = []
+        self.expected_seconds: Dict[str, float] = {}
+        first_seen = store.first_seen()
+        for n, url in enumerate(dict.fromkeys(seeds + discovered)):
+            score = provider_score(store.history(url, HISTORY_LIMIT))
+            if url in seeds:
+                priority = probe_priority(score, SEED_IMPORTANCE, now)
+            else:
+                priority = probe_priority(score, DISCOVERED_IMPORTANCE, now, first_seen.get(url, now))
+            # n breaks ties in list order, seeds first
+            self.heap.append((-priority, n, url))
+            self.expected_seconds[url] = score["latency_p50"] or DEFAULT_PROBE_SECONDS
+        heapq.heapify(self.heap)
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def pop(self) -> str:
+        return heapq.heappop(self.heap)[2]
+
+    def ordered(self) -> List[str]:
+        """Every queued provider, highest priority first (the queue itself is left as is)."""
+        return [url for _, _, url in sorted(self.heap)]
+
+
+class ProbeBudget:
+    """
+    Sats a run may spend on probes.
+
+    A probe may commit at most probe_cap() sats: a new token (the probe model's
+    max cost plus headroom) or, with a token held from before, the max cost of
+    one completion. A provider whose probe needs more is skipped. Probes are
+    charged what they spent: a new token's amount less what it refunded, or
+    what the provider deducted from a held token.
+    """
+
+    def __init__(self, sats: float, probe_max_sats: float, min_probe_sats: float = 1):
+        self.sats = sats
+        self.probe_max_sats = probe_max_sats
+        self.min_probe_sats = min_probe_sats
+        self.spent_sats = 0.0
+
+    def remaining(self) -> float:
+        return max(0.0, self.sats - self.spent_sats)
+
+    def probe_cap(self) -> float:
+        """The most the next probe may commit."""
+        return min(self.probe_max_sats, self.remaining())
+
+    def allows_probe(self) -> bool:
+        """Whether enough is left for the cheapest probe."""
+        return self.remaining() >= self.min_probe_sats
+
+    def charge(self, sats: float):
+        self.spent_sats += sats
@@ -0,0 +1,262 @@
+"""
+SQLite state shared by bot processes: provider leases, probe results and known providers.
+
+Several workers (see worker.py), on one host or on several hosts sharing the
+database file, coordinate through the leases table: a worker only probes a
+provider while it holds an unexpired lease on it, and a provider whose lease
+expired (e.g. because its worker died) can be claimed by anyone. Every probe
+result is appended to probe_results, from which the merged status report is
+built. Providers found through Nostr announcements (see discovery.py) are
+kept in the providers table. What was last published (each provider's status
+event and the summary note) is kept in published_status and published_summary.
+"""
+import json
+import sqlite3
+import time
+from typing import Optional, Dict, Any, List
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS probe_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    provider_url TEXT NOT NULL,
+    worker_id TEXT,
+    probed_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    model_id TEXT,
+    cost_check TEXT,
+    refund_status TEXT,
+    version TEXT,
+    response TEXT,
+    latency REAL
+);
+CREATE INDEX IF NOT EXISTS probe_results_provider ON probe_results (provider_url, probed_at);
+CREATE TABLE IF NOT EXISTS providers (
+    url TEXT PRIMARY KEY,
+    pubkey TEXT,
+    announced_at REAL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS published_status (
+    provider_url TEXT PRIMARY KEY,
+    record TEXT NOT NULL,
+    published_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS published_summary (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    published_at REAL NOT NULL
+);
+"""
+
+RESULT_FIELDS = ("provider_url", "worker_id", "probed_at", "status", "model_id",
+                 "cost_check", "refund_status", "version", "response", "latency")
+
+
+class StateStore:
+    """Leases and probe history in a SQLite database file."""
+
+    def __init__(self, path: str, busy_timeout: float = 30.0):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't
+        # both see a lease as free and claim it
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def claim(self, worker_id: str, names: List[str], lease_seconds: float,
+              limit: Optional[int] = None) -> List[str]:
+        """
+        Claims up to `limit` of `names` that are free, expired or already held by this worker.
+
+        Leases already held are renewed. Returns the names now held, in the given order.
+        """
+        now = time.time()
+        held = []
+        connection = self._transaction()
+        try:
+            for name in names:
+                if limit is not None and len(held) >= limit:
+                    break
+                cursor = connection.execute(
+                    "INSERT INTO leases (name, worker_id, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET worker_id = excluded.worker_id, "
+                    "expires_at = excluded.expires_at "
+                    "WHERE leases.expires_at < ? OR leases.worker_id = excluded.worker_id",
+                    (name, worker_id, now + lease_seconds, now),
+                )
+                if cursor.rowcount:
+                    held.append(name)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return held
+
+    def renew(self, worker_id: str, name: str, lease_seconds: float) -> bool:
+        """Extends a lease this worker holds; False if it was lost to another worker."""
+        cursor = self.connection.execute(
+            "UPDATE leases SET expires_at = ? WHERE name = ? AND worker_id = ?",
+            (time.time() + lease_seconds, name, worker_id),
+        )
+        return cursor.rowcount == 1
+
+    def release(self, worker_id: str, name: str):
+        """Gives up a lease so another worker can claim it right away."""
+        self.connection.execute("DELETE FROM leases WHERE name = ? AND worker_id = ?", (name, worker_id))
+
+    def held(self, worker_id: str) -> List[str]:
+        """Names this worker holds unexpired leases on."""
+        rows = self.connection.execute("SELECT name FROM leases WHERE worker_id = ? AND expires_at >= ?",
+                                       (worker_id, time.time()))
+        return [row[0] for row in rows]
+
+    def holder(self, name: str) -> Optional[Dict[str, Any]]:
+        """Returns the current, unexpired lease on a name, if any."""
+        row = self.connection.execute(
+            "SELECT worker_id, expires_at FROM leases WHERE name = ? AND expires_at >= ?",
+            (name, time.time()),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def record_result(self, provider_url: str, status: str, model_id: str = None, cost_check: str = None,
+                      refund_status: str = None, version: str = None, response: str = None,
+                      latency: float = None, worker_id: str = None, probed_at: float = None):
+        """Appends one probe result."""
+        self.connection.execute(
+            f"INSERT INTO probe_results ({', '.join(RESULT_FIELDS)}) VALUES ({', '.join('?' * len(RESULT_FIELDS))})",
+            (provider_url, worker_id, probed_at or time.time(), status, model_id,
+             cost_check, refund_status, version, response, latency),
+        )
+
+    def latest_results(self, since: float = 0, providers: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """The most recent result per provider probed after `since`, oldest probe first."""
+        rows = self.connection.execute(
+            f"SELECT {', '.join(RESULT_FIELDS)} FROM probe_results AS r WHERE probed_at >= ? AND id = ("
+            "SELECT id FROM probe_results WHERE provider_url = r.provider_url "
+            "ORDER BY probed_at DESC, id DESC LIMIT 1) ORDER BY probed_at",
+            (since,),
+        ).fetchall()
+        results = [dict(row) for row in rows]
+        if providers is not None:
+            results = [r for r in results if r["provider_url"] in providers]
+        return results
+
+    def add_providers(self, providers: List[Dict[str, Any]]) -> int:
+        """
+        Stores discovered providers (url, pubkey, announced_at), refreshing those already known.
+
+        Returns how many were new.
+        """
+        now = time.time()
+        connection = self._transaction()
+        try:
+            known = {row[0] for row in connection.execute("SELECT url FROM providers")}
+            for provider in providers:
+                connection.execute(
+                    "INSERT INTO providers (url, pubkey, announced_at, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(url) DO UPDATE SET pubkey = excluded.pubkey, "
+                    "announced_at = excluded.announced_at, last_seen = excluded.last_seen",
+                    (provider["url"], provider.get("pubkey"), provider.get("announced_at"), now, now),
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return sum(1 for provider in providers if provider["url"] not in known)
+
+    def discovered_providers(self, seen_since: float = 0, pubkeys: Optional[List[str]] = None) -> List[str]:
+        """
+        URLs of the discovered providers still announced after `seen_since`, oldest first.
+
+        With `pubkeys`, only providers whose latest announcement is by one of them.
+        """
+        rows = self.connection.execute(
+            "SELECT url, pubkey FROM providers WHERE last_seen >= ? ORDER BY first_seen, url", (seen_since,))
+        return [row[0] for row in rows if pubkeys is None or row[1] in pubkeys]
+
+    def first_seen(self) -> Dict[str, float]:
+        """When each discovered provider was first announced."""
+        return {row[0]: row[1] for row in self.connection.execute("SELECT url, first_seen FROM providers")}
+
+    def published_status(self) -> Dict[str, Dict[str, Any]]:
+        """The last published status record per provider."""
+        rows = self.connection.execute("SELECT provider_url, record FROM published_status")
+        return {row[0]: json.loads(row[1]) for row in rows}
+
+    def last_summary_at(self) -> float:
+        """When the summary note was last published, 0 if never."""
+        row = self.connection.execute("SELECT published_at FROM published_summary WHERE id = 1").fetchone()
+        return row[0] if row else 0.0
+
+    def record_published(self, records: List[Dict[str, Any]], summary_at: Optional[float] = None):
+        """Stores the status records just published (keyed by their "provider") and, if given, the summary time."""
+        now = time.time()
+        connection = self._transaction()
+        try:
+            connection.executemany(
+                "INSERT INTO published_status (provider_url, record, published_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(provider_url) DO UPDATE SET record = excluded.record, published_at = excluded.published_at",
+                [(record["provider"], json.dumps(record), now) for record in records],
+            )
+            if summary_at is not None:
+                connection.execute("INSERT INTO published_summary (id, published_at) VALUES (1, ?) "
+                                   "ON CONFLICT(id) DO UPDATE SET published_at = excluded.published_at", (summary_at,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def providers(self) -> List[str]:
+        """Every provider with at least one recorded result."""
+        rows = self.connection.execute("SELECT DISTINCT provider_url FROM probe_results ORDER BY provider_url")
+        return [row[0] for row in rows]
+
+    def history(self, provider_url: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """The latest `limit` results of one provider, newest first."""
+        rows = self.connection.execute(
+            f"SELECT {', '.join(RESULT_FIELDS)} FROM probe_results WHERE provider_url = ? "
+            "ORDER BY probed_at DESC, id DESC LIMIT ?",
+            (provider_url, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def provider_score(history: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Summarizes a provider's history (newest first, as returned by StateStore.history).
+
+    Timed out probes were cut short by the run deadline and say nothing about the
+    provider, so they are left out. The score (0-100) is the share of probes that
+    were up with a good cost check. Instability (0-1) is how often the outcome
+    (status and cost check) changed from one probe to the next.
+    """
+    checked = [r for r in history if r["status"] != "timeout"]
+    up = [r for r in checked if r["status"] == "up"]
+    good = [r for r in up if r["cost_check"] == "good"]
+    latencies = sorted(r["latency"] for r in up if r["latency"] is not None)
+    outcomes = [(r["status"], (r["cost_check"] or "").split(" ")[0]) for r in checked]
+    flips = sum(1 for newer, older in zip(outcomes, outcomes[1:]) if newer != older)
+    return {
+        "probes": len(checked),
+        "uptime": len(up) / len(checked) if checked else 0.0,
+        "cost_ok": len(good) / len(up) if up else 0.0,
+        "refund_failures": sum(1 for r in up if r["refund_status"] == "failed"),
+        "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+        "instability": flips / (len(outcomes) - 1) if len(outcomes) > 1 else 0.0,
+        "last_status": history[0]["status"] if history else None,
+        "last_probed_at": history[0]["probed_at"] if history else None,
+        "score": round(100 * len(good) / len(checked), 1) if checked else 0.0,
+    }
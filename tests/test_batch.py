@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import pytest
+
+import fake_services
+import routstr_bot
+import wallet
+from batch import BatchRunner, Checkpoint, _recover_output
+
+LINES = 30
+
+
+@pytest.fixture
+def fakes(tmp_path, monkeypatch):
+    provider = fake_services.serve_in_thread(fake_services.FakeProvider(catalog_size=5))
+    wallet_server = fake_services.serve_in_thread(fake_services.FakeWallet())
+    monkeypatch.setattr(routstr_bot, "DATA_FILE", str(tmp_path / "routstr_data.json"))
+    monkeypatch.setattr(wallet, "DEFAULT_BASE_URL", fake_services.base_url(wallet_server))
+    yield fake_services.base_url(provider)
+    provider.shutdown()
+    wallet_server.shutdown()
+
+
+def _write_input(path, provider_url):
+    offsets = []
+    with open(path, "wb") as f:
+        for i in range(LINES):
+            f.write(json.dumps({"id": f"q{i}", "provider": provider_url, "model": "fake/model-0",
+                                "messages": [{"role": "user", "content": f"hi {i}"}]}).encode() + b"\n")
+            offsets.append(f.tell())
+    return offsets
+
+
+def _record(line, end_offset):
+    return json.dumps({"line": line, "input_end": end_offset, "status": "ok"}) + "\n"
+
+
+def test_recover_output_truncates_partial_line(tmp_path):
+    output = tmp_path / "out.jsonl"
+    checkpointed = _record(0, 10) + _record(1, 20)
+    output.write_text(checkpointed + _record(3, 40) + '{"line": 2, "input_')
+    checkpoint = Checkpoint(str(tmp_path / "out.jsonl.checkpoint"), str(tmp_path / "in.jsonl"))
+    checkpoint.line, checkpoint.offset, checkpoint.output_offset = 2, 20, len(checkpointed)
+
+    _recover_output(str(output), checkpoint)
+
+    assert output.read_text() == checkpointed + _record(3, 40)
+    assert checkpoint.done_ahead == {3: 40}
+    checkpoint.done(2, 30)
+    assert (checkpoint.line, checkpoint.offset, checkpoint.done_ahead) == (4, 40, {})
+
+
+def test_checkpoint_round_trip(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "c.json"), str(tmp_path / "in.jsonl"))
+    checkpoint.done(0, 10)
+    checkpoint.done(2, 30)
+    checkpoint.save(123)
+    loaded = Checkpoint(str(tmp_path / "c.json"), str(tmp_path / "in.jsonl"))
+    assert loaded.load()
+    assert (loaded.line, loaded.offset, loaded.output_offset, loaded.done_ahead) == (1, 10, 123, {2: 30})
+    with pytest.raises(ValueError):
+        Checkpoint(str(tmp_path / "c.json"), str(tmp_path / "other.jsonl")).load()
+
+
+def test_resume_after_crash_runs_each_line_once(tmp_path, fakes):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    offsets = _write_input(input_path, fakes)
+    # State after a crash: lines 0-9 checkpointed, 12 and 13 written after the
+    # checkpoint, and line 10 cut off halfway through its record
+    checkpointed = "".join(_record(i, offsets[i]) for i in range(10))
+    output_path.write_text(checkpointed + _record(12, offsets[12]) + _record(13, offsets[13]) + '{"line": 10, "inp')
+    checkpoint = Checkpoint(str(output_path) + ".checkpoint", str(input_path))
+    checkpoint.line, checkpoint.offset = 10, offsets[9]
+    checkpoint.save(len(checkpointed))
+
+    summary = asyncio.run(BatchRunner(str(input_path), str(output_path), concurrency=4, per_provider=2).run())
+
+    records = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert sorted(record["line"] for record in records) == list(range(LINES))
+    assert summary["skipped"] == 2
+    assert summary["ok"] == LINES - 12
+    resumed = Checkpoint(str(output_path) + ".checkpoint", str(input_path))
+    resumed.load()
+    assert (resumed.line, resumed.offset, resumed.done_ahead) == (LINES, offsets[-1], {})
+
+
+def test_invalid_lines_are_reported(tmp_path, fakes):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    bad = ['not json', '[1, 2]', '{"provider": "x"}',
+           '{"provider": 5, "model": "m", "messages": []}',
+           '{"provider": "x", "model": ["m"], "messages": []}',
+           '{"provider": "x", "model": "m", "messages": "hi"}',
+           '{"provider": " ", "model": "m", "messages": []}']
+    input_path.write_text("\n".join(bad) + "\n\n")
+    summary = asyncio.run(BatchRunner(str(input_path), str(output_path), concurrency=2).run())
+    records = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert summary["error"] == len(bad)
+    assert [record["line"] for record in records] == list(range(len(bad)))
+    assert all(record["error"].startswith("invalid request") for record in records)
+    assert records[3]["error"] == "invalid request: provider must be a str"
@@ -0,0 +1,88 @@
+import gzip
+import json
+
+import pytest
+import requests
+
+import cassette
+import fake_services
+from wallet import CashuWalletClient
+
+
+@pytest.fixture
+def wallet_url():
+    server = fake_services.serve_in_thread(fake_services.FakeWallet(balance=1000))
+    yield fake_services.base_url(server)
+    server.shutdown()
+
+
+def test_redact():
+    token = "cashuAeyJ0b2tlbiI6W3sibWludCI6Imh0dHBzOi8vbWludC5leGFtcGxlIn1dfQ"
+    assert cassette.redact(f"pay with {token} please") == "pay with <redacted> please"
+    assert cassette.redact('{"token": "abc", "api_key": "sk-1", "amount": 5}') == \
+        '{"token": "<redacted>", "api_key": "<redacted>", "amount": 5}'
+    assert cassette.redact("cashu is fine") == "cashu is fine"
+
+
+def test_record_redacts_secrets(tmp_path, wallet_url):
+    path = str(tmp_path / "c.cassette.gz")
+    with cassette.record(path, metadata={"ledger": {"cashu_tokens": {"p": "cashuAsecretsecret"}}}):
+        sent = CashuWalletClient(wallet_url).send_token(20)
+        requests.Session().get(wallet_url + "/api/balance",
+                               headers={"Authorization": "Bearer sk-secret", "X-Cashu": "cashuBsecretsecret"})
+    with gzip.open(path, "rt") as f:
+        text = f.read()
+    assert sent["data"]["token"] not in text
+    assert "secret" not in text
+    header, exchanges = cassette.load(path)
+    assert header["metadata"]["ledger"]["cashu_tokens"]["p"] == cassette.REDACTED
+    assert exchanges[-1]["request_headers"] == {"Authorization": "Bearer <redacted>", "X-Cashu": "<redacted>"}
+
+
+def test_record_replay_round_trip(tmp_path, wallet_url):
+    path = str(tmp_path / "c.cassette.gz")
+    with cassette.record(path):
+        client = CashuWalletClient(wallet_url)
+        recorded = [client.get_balance(), client.send_token(20, fake_services.FAKE_MINT_URL), client.get_balance()]
+        with pytest.raises(requests.exceptions.ConnectionError):
+            requests.get("http://127.0.0.1:9/unreachable", timeout=1)
+
+    with cassette.replay(path, speed=0) as player:
+        client = CashuWalletClient(wallet_url)
+        replayed = [client.get_balance(), client.send_token(20, fake_services.FAKE_MINT_URL), client.get_balance()]
+        with pytest.raises(requests.exceptions.ConnectionError):
+            requests.get("http://127.0.0.1:9/unreachable", timeout=1)
+        assert player.remaining() == 0
+        with pytest.raises(cassette.CassetteMiss):
+            requests.get(wallet_url + "/api/balance")
+
+    # Same answers in the same order, with the token redacted
+    assert replayed[0]["data"] == recorded[0]["data"]
+    assert replayed[2]["data"] == recorded[2]["data"]
+    assert replayed[2]["data"]["balance"] == 980
+    assert replayed[1]["data"]["token"] == cassette.REDACTED
+    assert {k: v for k, v in replayed[1]["data"].items() if k != "token"} == \
+        {k: v for k, v in recorded[1]["data"].items() if k != "token"}
+    assert requests.Session.request is cassette._original_request
+
+
+def test_cassettes_do_not_nest(tmp_path):
+    with cassette.record(str(tmp_path / "a.gz")):
+        with pytest.raises(RuntimeError):
+            with cassette.record(str(tmp_path / "b.gz")):
+                pass
+
+
+def test_unsupported_version(tmp_path):
+    path = tmp_path / "old.gz"
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps({"cassette": 0}) + "\n")
+    with pytest.raises(ValueError):
+        cassette.load(str(path))
+
+
+def test_provider_urls():
+    exchanges = [{"url": u} for u in ("https://a.example/v1/chat/completions", "https://a.example/",
+                                      "https://b.example/v1/chat/completions",
+                                      "https://a.example/v1/chat/completions")]
+    assert cassette.provider_urls(exchanges) == ["https://a.example", "https://b.example"]
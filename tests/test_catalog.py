@@ -0,0 +1,159 @@
+import json
+import math
+
+import pytest
+
+import catalog
+import model_utils
+import routstr_bot
+from catalog import ModelCatalog, ModelRecord, normalize_pricing, parse_provider_document
+
+SATS_OFFER = {"id": "m", "sats_pricing": {"prompt": 1.0, "completion": 2.0, "max_cost": 9.0},
+              "context_length": 8192}
+USD_OFFER = {"id": "m", "pricing": {"prompt": "0.002", "completion": "0.004"},
+             "architecture": {"input_modalities": ["text", "image"]}, "context_length": 128000}
+
+
+@pytest.fixture
+def merged():
+    merged = ModelCatalog()
+    merged.add_provider("https://a.example", [SATS_OFFER, {"id": "n", "sats_pricing": {"prompt": 0.1, "completion": 0.1,
+                                                                                         "max_cost": 1.0}}])
+    merged.add_provider("https://b.example", [USD_OFFER, {"id": "broken", "pricing": {"prompt": "n/a"}}])
+    return merged
+
+
+def test_normalize_pricing():
+    assert normalize_pricing(SATS_OFFER) == (1.0, 2.0, 9.0)
+    prompt, completion, max_cost = normalize_pricing(USD_OFFER)
+    assert (prompt, completion) == (0.002 * catalog.SATS_PER_USD, 0.004 * catalog.SATS_PER_USD)
+    assert math.isnan(max_cost)
+    assert all(map(math.isnan, normalize_pricing({"id": "x"})))
+
+
+def test_usd_offers_need_a_rate(monkeypatch):
+    monkeypatch.setattr(catalog, "SATS_PER_USD", 0)
+    assert all(map(math.isnan, normalize_pricing(USD_OFFER)))
+
+
+def test_find_ranks_by_total_and_skips_unknown_prices(merged):
+    offers = merged.find()
+    assert [(o["provider"], o["model"]) for o in offers] == [
+        ("https://a.example", "n"), ("https://a.example", "m"), ("https://b.example", "m")]
+    assert offers[1]["max_cost_sats"] == 9.0 and offers[2]["max_cost_sats"] is None
+    assert [o["model"] for o in merged.find(price="max_cost")] == ["n", "m"]
+    assert [o["provider"] for o in merged.find(min_sats=1, max_sats=4)] == ["https://a.example"]
+    assert [o["provider"] for o in merged.find(image_input=True)] == ["https://b.example"]
+    assert [o["model"] for o in merged.find(min_context=10000)] == ["m"]
+    with pytest.raises(ValueError):
+        merged.find(price="cheapest")
+
+
+def test_cheapest_provider_and_spread(merged):
+    assert merged.cheapest_provider("m")["provider"] == "https://a.example"
+    assert merged.cheapest_provider("m", price="prompt")["provider"] == "https://a.example"
+    assert merged.cheapest_provider("broken") is None
+    spread = merged.price_spread()
+    assert spread["m"] == {"min": 3.0, "max": 6.0, "spread": 3.0, "providers": 2}
+    assert "broken" not in spread
+
+
+def test_re_adding_a_provider_replaces_its_offers(merged):
+    merged.add_provider("https://a.example", [{"id": "o", "sats_pricing": {"prompt": 1, "completion": 1}}])
+    assert len(merged) == 3
+    assert [o["provider"] for o in merged.offers("m")] == ["https://b.example"]
+    merged.remove_provider("https://b.example")
+    assert [o["model"] for o in merged.find()] == ["o"]
+
+
+def test_model_utils_converts_like_the_catalog():
+    models = {"models": [USD_OFFER, {"id": "x", "pricing": {"prompt": "bad"}}, {"id": "y"}]}
+    assert model_utils.get_cheapest_model_above_price(models, 0) is USD_OFFER
+    assert model_utils.get_cheapest_model_above_price(models, 0.002 * catalog.SATS_PER_USD) is None
+
+
+MODELS = [
+    {"id": "vendor/modèle-ü", "description": "Ünïcödé 🚀 " * 20, "context_length": 32768,
+     "architecture": {"input_modalities": ["text", "image"]},
+     "sats_pricing": {"prompt": 0.001, "completion": 0.002, "max_cost": 7.25}},
+    {"id": "vendor/plain", "pricing": {"prompt": "0.000001", "completion": "0.000002"},
+     "top_provider": {"context_length": 8192}},
+    {"id": "vendor/big-number", "sats_pricing": {"prompt": 12345678901234567890, "completion": 1e-9,
+                                                 "max_cost": 123456.789}},
+]
+DOCUMENT = {"name": "Prövider ✓", "version": "1.2.3", "models": MODELS, "mints": ["https://mint.example"]}
+BODY = json.dumps(DOCUMENT, ensure_ascii=False, indent=1).encode("utf-8")
+
+
+def _chunks(body: bytes, size: int):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, 1000, len(BODY)])
+def test_chunk_boundaries_and_unicode(size):
+    document = parse_provider_document(_chunks(BODY, size), keep_raw=True)
+    assert document["name"] == DOCUMENT["name"]
+    assert document["version"] == "1.2.3"
+    assert document["mints"] == DOCUMENT["mints"]
+    assert [model.id for model in document["models"]] == [model["id"] for model in MODELS]
+    # Numbers split across chunks must not be cut short
+    assert document["models"][2].max_cost == 123456.789
+    assert document["models"][2].prompt == float(12345678901234567890)
+    # The raw bytes of each model decode back to the published dict
+    assert [model.load() for model in document["models"]] == MODELS
+
+
+def test_every_split_point_of_a_multibyte_character():
+    body = json.dumps({"models": [{"id": "é🚀"}], "note": "ü"}, ensure_ascii=False).encode("utf-8")
+    for split in range(1, len(body)):
+        document = parse_provider_document([body[:split], body[split:]])
+        assert document["models"][0].id == "é🚀"
+        assert document["note"] == "ü"
+
+
+def test_record_fields():
+    first, second, _ = parse_provider_document([BODY])["models"]
+    assert first["sats_pricing"] == {"prompt": 0.001, "completion": 0.002, "max_cost": 7.25}
+    assert first.context_length == 32768 and first.image_input
+    assert second.get("sats_pricing") is None
+    assert second.context_length == 8192
+    # Without keep_raw, fields the record doesn't keep are absent
+    assert second.get("architecture") is None
+    with pytest.raises(KeyError):
+        second["architecture"]
+
+
+def test_empty_and_invalid_documents():
+    assert parse_provider_document([b"{}"]) == {}
+    assert parse_provider_document([b'{"models": []}']) == {"models": []}
+    with pytest.raises(json.JSONDecodeError):
+        parse_provider_document([b'{"models": [{"id": "a"}'])
+    with pytest.raises(json.JSONDecodeError):
+        parse_provider_document([b"[]"])
+    with pytest.raises(json.JSONDecodeError):
+        parse_provider_document([b'{"a": 1} trailing'])
+
+
+def test_record_without_sats_pricing_is_skipped_by_selection():
+    records = parse_provider_document([BODY])["models"]
+    assert isinstance(records[0], ModelRecord)
+    selected = routstr_bot.get_cheapest_model_above_price(records, 5, 10, True)
+    assert selected.id == "vendor/modèle-ü"
+
+
+def test_records_price_like_normalize_pricing():
+    for model in MODELS + [{"id": "usd", "pricing": {"prompt": "0.001", "completion": "x"}},
+                           {"id": "no-max", "sats_pricing": {"prompt": 1, "completion": 2}}]:
+        record = ModelRecord(model)
+        expected = normalize_pricing(model)
+        assert [str(v) for v in (record.prompt, record.completion, record.max_cost)] == [str(v) for v in expected]
+    assert ModelRecord({"id": "no-max", "sats_pricing": {"prompt": 1, "completion": 2}}).sats_pricing == \
+        {"prompt": 1.0, "completion": 2.0}
+
+
+def test_selection_agrees_on_dicts_and_records():
+    records = parse_provider_document([BODY])["models"]
+    for low, width in ((5, 10), (0, 10), (100, 1e6), (1000, 1)):
+        from_dicts = routstr_bot.get_cheapest_model_above_price(MODELS, low, width, False)
+        from_records = routstr_bot.get_cheapest_model_above_price(records, low, width, False)
+        assert (from_dicts and from_dicts["id"]) == (from_records and from_records.id)
@@ -0,0 +1,89 @@
+import json
+import os
+
+import pytest
+
+from completion_cache import CompletionCache, completion_key, rescore
+
+PROVIDER = "https://provider.example"
+MESSAGES = [{"role": "user", "content": "gm"}]
+PRICING = {"prompt": 0.001, "completion": 0.002}
+
+
+def _response(content="gm", actual_costs_msats=3000.0, **changes):
+    response = {"status_code": 200, "headers": {}, "elapsed": 0.5,
+                "body": json.dumps({"choices": [{"message": {"content": content}}]}),
+                "usage": {"prompt_tokens": 1000, "completion_tokens": 1000},
+                "sats_pricing": PRICING, "actual_costs_msats": actual_costs_msats,
+                "scores": {"cost_check": "good", "answered": True}}
+    response.update(changes)
+    return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = CompletionCache(str(tmp_path / "cache"))
+    yield cache
+    cache.close()
+
+
+def test_completion_key():
+    key = completion_key(PROVIDER, "m", MESSAGES)
+    assert key == completion_key(PROVIDER + "/", "m", MESSAGES, {})
+    assert key != completion_key(PROVIDER, "other", MESSAGES)
+    assert key != completion_key(PROVIDER, "m", MESSAGES, {"temperature": 0})
+
+
+def test_put_and_lookup(cache):
+    assert cache.lookup(PROVIDER, "m", MESSAGES) is None
+    key = cache.put(PROVIDER, "m", MESSAGES, {}, _response())
+    entry = cache.lookup(PROVIDER, "m", MESSAGES)
+    assert entry["key"] == key and entry["model"] == "m" and entry["actual_costs_msats"] == 3000.0
+    assert cache.get(key) == entry
+    assert cache.get("0" * 64) is None
+
+
+def test_entries_are_immutable(cache):
+    first = cache.put(PROVIDER, "m", MESSAGES, {}, _response("first"))
+    assert cache.put(PROVIDER, "m", MESSAGES, {}, _response("first")) == first
+    second = cache.put(PROVIDER, "m", MESSAGES, {}, _response("second"))
+    assert second != first
+    # Lookup returns the latest response, the earlier one is kept
+    assert json.loads(cache.lookup(PROVIDER, "m", MESSAGES)["body"])["choices"][0]["message"]["content"] == "second"
+    assert cache.get(first) is not None
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    keys = [cache.put(PROVIDER, f"m{n}", MESSAGES, {}, _response()) for n in range(4)]
+    cache.get(keys[0])
+    cache.max_bytes = cache.size() - 1
+    assert cache.evict() == 1
+    assert cache.get(keys[1]) is None and not os.path.exists(cache._path(keys[1]))
+    assert all(cache.get(key) is not None for key in (keys[0], keys[2], keys[3]))
+    assert cache.size() <= cache.max_bytes
+    assert cache.evict() == 0
+
+
+def test_runs_and_rescore(cache):
+    cache.put(PROVIDER, "m", MESSAGES, {}, _response(), run_id="run1")
+    cache.put(PROVIDER, "m2", MESSAGES, {}, _response(actual_costs_msats=5000.0), run_id="run1")
+    cache.put(PROVIDER, "m3", MESSAGES, {}, _response(""), run_id="run2")
+    assert [(run["run_id"], run["entries"]) for run in cache.runs()] == [("run1", 2), ("run2", 1)]
+    assert [entry["model"] for entry in cache.iter_run("run1")] == ["m", "m2"]
+    assert len(list(cache.iter_run())) == 3
+
+    results = list(rescore(cache, "run1"))
+    assert [result["rescored"] for result in results] == [
+        {"cost_check": "good", "answered": True}, {"cost_check": "bad 2000.0", "answered": True}]
+    assert results[1]["stored"] == {"cost_check": "good", "answered": True}
+    assert list(rescore(cache, "run2"))[0]["rescored"] == {"cost_check": "good", "answered": False}
+
+
+def test_reopened_cache_keeps_its_entries(tmp_path):
+    cache = CompletionCache(str(tmp_path / "cache"))
+    key = cache.put(PROVIDER, "m", MESSAGES, {}, _response(), run_id="run1")
+    cache.close()
+    cache = CompletionCache(str(tmp_path / "cache"))
+    assert cache.lookup(PROVIDER, "m", MESSAGES)["key"] == key
+    assert cache.runs()[0]["run_id"] == "run1"
+    cache.close()
@@ -0,0 +1,36 @@
+import pytest
+
+from discovery import normalize_provider_url
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://api.example.com", "https://api.example.com"),
+    ("HTTPS://API.Example.COM/", "https://api.example.com"),
+    ("  https://api.example.com/v1/ ", "https://api.example.com/v1"),
+    ("https://api.example.com:443", "https://api.example.com"),
+    ("http://api.example.com:80/", "http://api.example.com"),
+    ("https://api.example.com:8443", "https://api.example.com:8443"),
+    ("https://api.example.com.", "https://api.example.com"),
+    ("https://8.8.8.8:3000", "https://8.8.8.8:3000"),
+    ("https://[2001:4860:4860::8888]:8443/", "https://[2001:4860:4860::8888]:8443"),
+])
+def test_normalizes(url, expected):
+    assert normalize_provider_url(url) == expected
+
+
+@pytest.mark.parametrize("url", [
+    None, 42, "", "api.example.com", "ftp://api.example.com", "wss://relay.example.com",
+    "https://", "https://api.example.com:99999",
+])
+def test_rejects_invalid(url):
+    assert normalize_provider_url(url) is None
+
+
+@pytest.mark.parametrize("host", [
+    "localhost", "LOCALHOST.", "router.local", "db.internal", "app.localhost", "abc.onion",
+    "127.0.0.1", "127.1", "2130706433", "0x7f000001", "0.0.0.0", "10.1.2.3", "172.16.0.1",
+    "192.168.1.1", "169.254.169.254", "100.64.0.1", "[::1]", "[fe80::1]", "[fd00::1]",
+    "[::ffff:127.0.0.1]",
+])
+def test_rejects_private_hosts(host):
+    assert normalize_provider_url(f"http://{host}:8000") is None
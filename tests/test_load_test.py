@@ -0,0 +1,69 @@
+import asyncio
+import math
+
+import pytest
+
+import fake_services
+import routstr_bot
+import wallet
+from load_test import find_knee, run_load_test
+
+
+def _steps(*points):
+    return [{"concurrency": c, "rps": rps, "error_rate": errors} for c, rps, errors in points]
+
+
+def test_knee_where_throughput_flattens():
+    steps = _steps((1, 10, 0), (2, 19, 0), (4, 35, 0), (8, 36, 0), (16, 37, 0))
+    assert find_knee(steps) == 4
+
+
+def test_knee_where_errors_rise():
+    steps = _steps((1, 10, 0), (2, 20, 0), (4, 40, 0.5))
+    assert find_knee(steps) == 2
+
+
+def test_no_knee_while_scaling():
+    assert find_knee(_steps((1, 10, 0), (2, 20, 0), (4, 40, 0.1))) is None
+    assert find_knee(_steps((1, 10, 0))) is None
+    assert find_knee([]) is None
+
+
+def test_thresholds():
+    steps = _steps((1, 10, 0), (2, 10.5, 0))
+    assert find_knee(steps) == 1
+    assert find_knee(steps, min_gain=0.01) is None
+    steps = _steps((1, 10, 0), (2, 20, 0.3))
+    assert find_knee(steps, max_error_rate=0.5) is None
+
+
+def test_zero_throughput_is_a_knee():
+    assert find_knee(_steps((1, 0, 1.0), (2, 0, 1.0))) == 1
+
+
+@pytest.fixture
+def fakes(tmp_path, monkeypatch):
+    provider = fake_services.serve_in_thread(fake_services.FakeProvider(catalog_size=20))
+    wallet_backend = fake_services.FakeWallet(balance=1000)
+    wallet_server = fake_services.serve_in_thread(wallet_backend)
+    monkeypatch.setattr(routstr_bot, "DATA_FILE", str(tmp_path / "routstr_data.json"))
+    monkeypatch.setattr(wallet, "DEFAULT_BASE_URL", fake_services.base_url(wallet_server))
+    yield fake_services.base_url(provider), wallet_backend
+    provider.shutdown()
+    wallet_server.shutdown()
+
+
+def test_load_test_pays_with_its_own_token(fakes):
+    provider_url, wallet_backend = fakes
+    # A small probe token in the ledger, as left behind by a normal probe
+    routstr_bot.save_data({"cashu_tokens": {provider_url: {"cashu_token": fake_services.make_fake_token(20),
+                                                           "count": 1, "balance": 20000}}})
+    ledger = routstr_bot.load_data()
+
+    result = asyncio.run(run_load_test(provider_url, [1, 4], 0.3, spend_cap_sats=100))
+
+    assert all(step["payment_errors"] == 0 and step["errors"] == 0 for step in result["steps"])
+    assert 0 < result["spent_sats"] <= 100
+    assert routstr_bot.load_data() == ledger
+    # Everything not spent went back into the wallet
+    assert wallet_backend.mint_balances[fake_services.FAKE_MINT_URL] == 1000 - math.ceil(result["spent_sats"])
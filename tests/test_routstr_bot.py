@@ -0,0 +1,236 @@
+import asyncio
+import time
+
+import pytest
+
+import fake_services
+import routstr_bot
+import wallet
+from routstr_bot import Deadline, DeadlineExceeded, status_changed, status_record, STATUS_REFRESH_SECONDS
+from scheduler import ProbeBudget
+from store import StateStore
+
+
+@pytest.fixture
+def fakes(tmp_path, monkeypatch):
+    backend = fake_services.FakeProvider(catalog_size=20)
+    provider = fake_services.serve_in_thread(backend)
+    wallet_backend = fake_services.FakeWallet()
+    wallet_server = fake_services.serve_in_thread(wallet_backend)
+    monkeypatch.setattr(routstr_bot, "DATA_FILE", str(tmp_path / "routstr_data.json"))
+    monkeypatch.setattr(routstr_bot, "COMPLETION_CACHE_DIR", "")
+    monkeypatch.setattr(wallet, "DEFAULT_BASE_URL", fake_services.base_url(wallet_server))
+    yield fake_services.base_url(provider), backend, wallet_backend
+    provider.shutdown()
+    wallet_server.shutdown()
+
+
+def _probe(provider_url, deadline=None, budget=None):
+    return asyncio.run(routstr_bot.get_witty_bitcoin_comment("gm", routstr_bot.PROMPTS[0], provider_url, deadline,
+                                                             budget))
+
+
+def test_deadline():
+    deadline = Deadline(10)
+    assert 9 < deadline.remaining() <= 10 and not deadline.expired
+    assert deadline.timeout(3) == 3
+    assert 4 < deadline.reserve(5).remaining() <= 5
+    assert deadline.reserve(20).expired
+    expired = Deadline(0)
+    assert expired.expired and expired.remaining() == 0
+    with pytest.raises(DeadlineExceeded):
+        expired.check()
+    with pytest.raises(DeadlineExceeded):
+        expired.timeout(3)
+
+
+def test_timeouts():
+    assert routstr_bot._timeout(None, 7) == 7
+    assert routstr_bot._timeout(Deadline(2), 7) <= 2
+    assert routstr_bot._receive_timeout(None) == routstr_bot.WALLET_TIMEOUT
+    # A token already issued is received even with the deadline gone, for a bounded time
+    assert routstr_bot._receive_timeout(Deadline(0)) == routstr_bot.REFUND_MIN_SECONDS
+    assert routstr_bot._receive_timeout(Deadline(3600)) == routstr_bot.WALLET_TIMEOUT
+
+
+def test_deadline_chunks():
+    assert list(routstr_bot._deadline_chunks([b"a", b"b"], None)) == [b"a", b"b"]
+    chunks = routstr_bot._deadline_chunks([b"a", b"b"], Deadline(0))
+    with pytest.raises(DeadlineExceeded):
+        next(chunks)
+
+
+def test_probe_past_deadline_is_a_timeout(fakes):
+    provider_url, backend, _ = fakes
+    backend.latency = 0.3
+    started = time.monotonic()
+    _, status, *_ = _probe(provider_url, Deadline(0.1))
+    assert status == "timeout"
+    assert time.monotonic() - started < 1
+
+
+def test_interrupted_probe_resyncs_the_ledger(fakes):
+    provider_url, backend, _ = fakes
+    assert _probe(provider_url)[1] == "up"
+    token = routstr_bot.load_data()["cashu_tokens"][provider_url]["cashu_token"]
+    assert routstr_bot.is_token_synced(provider_url)
+
+    # The completion request goes out and is charged, but its answer comes after the deadline
+    backend.latency = 0.5
+    assert _probe(provider_url, Deadline(0.8))[1] == "timeout"
+    assert not routstr_bot.is_token_synced(provider_url)
+    time.sleep(0.6)
+    charged_balance = backend.balances[token]
+    assert routstr_bot.get_cashu_balance(provider_url) != charged_balance
+
+    # The next probe re-reads the balance before paying, so its cost check is right
+    backend.latency = 0
+    _, status, _, cost_check, *_ = _probe(provider_url)
+    assert (status, cost_check) == ("up", "good")
+    assert routstr_bot.is_token_synced(provider_url)
+    assert routstr_bot.get_cashu_balance(provider_url) == backend.balances[token]
+
+
+def _only_model(backend, max_cost):
+    """Serves a single model costing a few sats per probe, with the given max cost."""
+    model = fake_services.generate_catalog(1)[0]
+    model["sats_pricing"].update({"prompt": 0.05, "completion": 0.05, "max_cost": max_cost})
+    backend.set_models([model])
+
+
+def test_repeated_probes_keep_paying_and_charge_what_they_spend(fakes):
+    provider_url, backend, wallet_backend = fakes
+    # Minted at max cost + headroom, a token lasts a few probes before it's replaced
+    _only_model(backend, 14.5)
+    wallet_balances = wallet_backend.mint_balances
+    minted = 0
+    for _ in range(10):
+        budget = ProbeBudget(100, routstr_bot.PROBE_MAX_SATS, routstr_bot.CHEAPEST_MODELS_ABOVE)
+        wallet_before = sum(wallet_balances.values())
+        held_before = sum(backend.balances.values())
+        _, status, _, cost_check, *_ = _probe(provider_url, budget=budget)
+        assert (status, cost_check) == ("up", "good")
+        wallet_spent = wallet_before - sum(wallet_balances.values())
+        if wallet_spent > 0:
+            # A new token: charged what left the wallet
+            minted += 1
+            assert budget.spent_sats == wallet_spent
+        else:
+            # A held token: charged what the provider took (a refund drops the msats below a sat)
+            consumed = (wallet_before * 1000 + held_before - sum(wallet_balances.values()) * 1000
+                        - sum(backend.balances.values())) / 1000
+            assert budget.spent_sats == pytest.approx(consumed, abs=1)
+            assert 0 < budget.spent_sats <= 15
+    assert 1 < minted < 10
+
+
+def test_probe_needing_more_than_the_budget_is_skipped(fakes):
+    provider_url, backend, _ = fakes
+    _only_model(backend, 14.5)
+    budget = ProbeBudget(25, routstr_bot.PROBE_MAX_SATS)
+    assert _probe(provider_url, budget=budget)[1] == "skipped"
+    assert budget.spent_sats == 0 and backend.balances == {}
+
+    # A held token only needs the max cost of one completion
+    assert _probe(provider_url)[1] == "up"
+    assert _probe(provider_url, budget=budget)[1] == "up"
+    assert 0 < budget.spent_sats < 15
+
+
+NOW = 1_800_000_000
+
+
+def _record_result(**changes):
+    result = {"provider_url": "https://provider.example", "status": "up", "model_id": "m", "cost_check": "good",
+              "refund_status": "unknown", "version": "1.0", "latency": 2.0, "response": "gm"}
+    result.update(changes)
+    return result
+
+
+def _record(**changes):
+    return status_record(_record_result(**changes), NOW)
+
+
+def test_first_record_is_published():
+    assert status_changed(None, _record(), NOW)
+    assert status_changed({}, _record(), NOW)
+
+
+def test_unchanged_record_is_not_republished():
+    assert not status_changed(_record(), _record(), NOW + 60)
+
+
+def test_field_changes_are_republished():
+    published = _record()
+    assert status_changed(published, _record(status="down"), NOW)
+    assert status_changed(published, _record(cost_check="bad 1200.0"), NOW)
+    assert status_changed(published, _record(refund_status="failed"), NOW)
+    assert status_changed(published, _record(version="1.1"), NOW)
+    assert status_changed(published, _record(model_id="other"), NOW)
+
+
+def test_cost_difference_alone_is_not_a_change():
+    assert not status_changed(_record(cost_check="bad 1200.0"), _record(cost_check="bad 1300.0"), NOW)
+
+
+def test_latency_needs_relative_and_absolute_jump():
+    published = _record(latency=2.0)
+    assert not status_changed(published, _record(latency=3.5), NOW)  # +75% but only 1.5s
+    assert status_changed(published, _record(latency=4.5), NOW)  # +125% and 2.5s
+    slow = _record(latency=20.0)
+    assert not status_changed(slow, _record(latency=25.0), NOW)  # 5s but only +25%
+    assert status_changed(slow, _record(latency=31.0), NOW)
+
+
+def test_unchanged_record_is_refreshed():
+    published = _record()
+    assert not status_changed(published, _record(), NOW + STATUS_REFRESH_SECONDS - 1)
+    assert status_changed(published, _record(), NOW + STATUS_REFRESH_SECONDS)
+
+
+@pytest.fixture
+def latest_event():
+    from pynostr.event import Event
+    from pynostr.key import PrivateKey
+
+    event = Event(content="A note long enough to be commented on")
+    event.sign(PrivateKey().hex())
+    return event
+
+
+def test_status_updates_and_summary_go_out_together(tmp_path, monkeypatch, latest_event):
+    sessions = []
+
+    async def publish_nostr_events(events, deadline=None):
+        sessions.append(events)
+        return [f"id{n}" for n in range(len(events))]
+
+    monkeypatch.setattr(routstr_bot, "PRODUCTION", "true")
+    monkeypatch.setattr(routstr_bot, "publish_nostr_events", publish_nostr_events)
+    store = StateStore(str(tmp_path / "state.db"))
+    results = [dict(_record_result(), provider_url=f"https://p{n}.example") for n in range(3)]
+
+    asyncio.run(routstr_bot.publish_status_updates(latest_event, results, None, store))
+    assert len(sessions) == 1
+    assert [kind for _, _, kind in sessions[0]] == [routstr_bot.STATUS_EVENT_KIND] * 3 + [1]
+    assert set(store.published_status()) == {r["provider_url"] for r in results}
+    assert store.last_summary_at() > 0
+
+    # Nothing changed and the summary isn't due: nothing is sent
+    asyncio.run(routstr_bot.publish_status_updates(latest_event, results, None, store))
+    assert len(sessions) == 1
+    results[1]["status"] = "down"
+    asyncio.run(routstr_bot.publish_status_updates(latest_event, results, None, store))
+    assert len(sessions) == 2 and len(sessions[1]) == 1
+    assert store.published_status()["https://p1.example"]["status"] == "down"
+
+
+def test_failed_publish_is_retried_next_run(tmp_path, monkeypatch, latest_event):
+    async def publish_nostr_events(events, deadline=None):
+        return None
+
+    monkeypatch.setattr(routstr_bot, "PRODUCTION", "true")
+    monkeypatch.setattr(routstr_bot, "publish_nostr_events", publish_nostr_events)
+    store = StateStore(str(tmp_path / "state.db"))
+    asyncio.run(routstr_bot.publish_status_updates(latest_event, [_record_result()], None, store))
+    assert store.published_status() == {} and store.last_summary_at() == 0
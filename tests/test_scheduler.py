@@ -0,0 +1,34 @@
+from scheduler import ProbeBudget
+
+
+def test_cap_is_the_smaller_of_probe_max_and_remaining():
+    budget = ProbeBudget(100, 30)
+    assert budget.probe_cap() == 30
+    budget.charge(80)
+    assert budget.remaining() == 20
+    assert budget.probe_cap() == 20
+
+
+def test_overspend_leaves_nothing():
+    budget = ProbeBudget(100, 30)
+    budget.charge(130)
+    assert budget.remaining() == 0
+    assert budget.probe_cap() == 0
+    assert not budget.allows_probe()
+
+
+def test_allows_probe_needs_the_cheapest_probe():
+    budget = ProbeBudget(100, 30, min_probe_sats=10)
+    budget.charge(90)
+    assert budget.allows_probe()
+    budget.charge(0.5)
+    assert not budget.allows_probe()
+
+
+def test_charges_accumulate():
+    budget = ProbeBudget(50, 50)
+    for _ in range(5):
+        assert budget.allows_probe()
+        budget.charge(10)
+    assert budget.spent_sats == 50
+    assert not budget.allows_probe()
@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+from store import StateStore
+
+NAMES = [f"https://provider{i}.example" for i in range(20)]
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "state.db")
+
+
+def test_claim_is_exclusive_until_expiry(db):
+    a, b = StateStore(db), StateStore(db)
+    assert a.claim("a", NAMES[:3], 60) == NAMES[:3]
+    assert b.claim("b", NAMES[:5], 60) == NAMES[3:5]
+    assert a.holder(NAMES[0])["worker_id"] == "a"
+    # Claiming again renews the worker's own leases
+    assert a.claim("a", NAMES[:5], 60) == NAMES[:3]
+    assert sorted(a.held("a")) == sorted(NAMES[:3])
+
+
+def test_claim_limit(db):
+    store = StateStore(db)
+    assert store.claim("a", NAMES, 60, limit=4) == NAMES[:4]
+    assert store.claim("b", NAMES, 60, limit=4) == NAMES[4:8]
+
+
+def test_expired_lease_moves_and_old_holder_cannot_renew(db):
+    a, b = StateStore(db), StateStore(db)
+    assert a.claim("a", NAMES[:1], 0.05) == NAMES[:1]
+    assert a.renew("a", NAMES[0], 0.05)
+    assert b.claim("b", NAMES[:1], 60) == []
+    time.sleep(0.1)
+    assert a.holder(NAMES[0]) is None
+    assert b.claim("b", NAMES[:1], 60) == NAMES[:1]
+    assert not a.renew("a", NAMES[0], 60)
+    assert b.renew("b", NAMES[0], 60)
+    assert a.holder(NAMES[0])["worker_id"] == "b"
+
+
+def test_release(db):
+    a, b = StateStore(db), StateStore(db)
+    a.claim("a", NAMES[:2], 60)
+    b.release("b", NAMES[0])  # not b's to release
+    assert b.claim("b", NAMES[:2], 60) == []
+    a.release("a", NAMES[0])
+    assert b.claim("b", NAMES[:2], 60) == NAMES[:1]
+
+
+def test_concurrent_claims_never_share_a_name(db):
+    claimed = {}
+
+    def worker(worker_id):
+        store = StateStore(db)
+        try:
+            claimed[worker_id] = store.claim(worker_id, NAMES, 60, limit=5)
+        finally:
+            store.close()
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    names = [name for held in claimed.values() for name in held]
+    assert len(names) == len(set(names)) == len(NAMES)
@@ -0,0 +1,156 @@
+import base64
+import json
+import threading
+import time
+
+import pytest
+
+import fake_services
+from wallet import CashuWalletClient, token_mint_url
+
+MINT_A = "https://mint-a.example"
+MINT_B = "https://mint-b.example"
+
+
+class CountingWallet(fake_services.FakeWallet):
+    """FakeWallet that takes `delay` seconds per request and counts requests and overlap per path."""
+
+    def __init__(self, delay: float = 0.2, **kwargs):
+        super().__init__(mints=[MINT_A, MINT_B], **kwargs)
+        self.delay = delay
+        self.requests = {}
+        self.active = 0
+        self.max_active = 0
+        self.count_lock = threading.Lock()
+
+    def handle(self, request, method):
+        with self.count_lock:
+            self.requests[request.path] = self.requests.get(request.path, 0) + 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            super().handle(request, method)
+        finally:
+            with self.count_lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def counting_wallet():
+    backend = CountingWallet()
+    server = fake_services.serve_in_thread(backend)
+    yield CashuWalletClient(fake_services.base_url(server)), backend
+    server.shutdown()
+
+
+def _in_threads(*calls):
+    results = [None] * len(calls)
+
+    def run(i, call):
+        results[i] = call()
+
+    threads = [threading.Thread(target=run, args=(i, call)) for i, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_balance_requests_share_one_request(counting_wallet):
+    client, backend = counting_wallet
+    results = _in_threads(*[client.get_balance] * 5)
+    assert backend.requests["/api/balance"] == 1
+    assert all(result == results[0] and result["success"] for result in results)
+    # Each caller gets its own copy
+    results[0]["data"]["balance"] = -1
+    assert results[1]["data"]["balance"] != -1
+
+
+def test_balance_after_a_send_is_not_shared_from_before(counting_wallet):
+    client, backend = counting_wallet
+    assert client.get_balance()["data"]["balance"] == 2_000_000
+    client.send_token(10, MINT_A)
+    assert client.get_balance()["data"]["balance"] == 2_000_000 - 10
+    assert backend.requests["/api/balance"] == 2
+
+
+def test_sends_are_serialized_per_mint(counting_wallet):
+    client, backend = counting_wallet
+    results = _in_threads(lambda: client.send_token(10, MINT_A), lambda: client.send_token(10, MINT_A))
+    assert all(result["success"] for result in results)
+    assert backend.max_active == 1
+    assert backend.mint_balances[MINT_A] == 1_000_000 - 20
+
+
+def test_different_mints_proceed_in_parallel(counting_wallet):
+    client, backend = counting_wallet
+    _in_threads(lambda: client.send_token(10, MINT_A), lambda: client.send_token(10, MINT_B))
+    assert backend.max_active == 2
+
+
+def test_waiter_gives_up_after_its_timeout():
+    backend = CountingWallet(delay=1.0)
+    server = fake_services.serve_in_thread(backend)
+    try:
+        client = CashuWalletClient(fake_services.base_url(server))
+        leader = threading.Thread(target=client.get_balance)
+        leader.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        result = client.get_balance(timeout=0.2)
+        assert time.monotonic() - started < 0.6
+        assert not result["success"] and "Timed out" in result["message"]
+        leader.join()
+    finally:
+        server.shutdown()
+
+
+def _cbor(value) -> bytes:
+    """Minimal CBOR encoder for the types cashuB tokens use."""
+    def head(major, n):
+        if n < 24:
+            return bytes([major << 5 | n])
+        for info, size in ((24, 1), (25, 2), (26, 4), (27, 8)):
+            if n < 1 << (8 * size):
+                return bytes([major << 5 | info]) + n.to_bytes(size, "big")
+
+    if isinstance(value, int):
+        return head(0, value)
+    if isinstance(value, bytes):
+        return head(2, len(value)) + value
+    if isinstance(value, str):
+        data = value.encode()
+        return head(3, len(data)) + data
+    if isinstance(value, list):
+        return head(4, len(value)) + b"".join(map(_cbor, value))
+    if isinstance(value, dict):
+        return head(5, len(value)) + b"".join(_cbor(k) + _cbor(v) for k, v in value.items())
+    raise TypeError(value)
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def test_token_mint_url():
+    v4 = {"m": MINT_A, "u": "sat", "t": [{"i": bytes.fromhex("00ad268c4d1f5826"),
+                                           "p": [{"a": 1000, "s": "a" * 64, "c": bytes(33)}]}]}
+    assert token_mint_url("cashuB" + _b64(_cbor(v4))) == MINT_A
+    v3 = {"token": [{"mint": MINT_B, "proofs": [{"amount": 2, "id": "009a1f293253e41e", "secret": "s", "C": "c"}]}]}
+    assert token_mint_url(" cashuA" + _b64(json.dumps(v3).encode()) + "\n") == MINT_B
+    for token in ("cashuBnotcbor", "cashuA" + _b64(b"{}"), "cashuB" + _b64(_cbor([1, 2])),
+                  "cashuB" + _b64(_cbor({"m": MINT_A})[:-3]), "somethingelse", fake_services.make_fake_token(5)):
+        assert token_mint_url(token) is None
+
+
+def test_receive_locks_on_the_mint_of_the_token(monkeypatch):
+    client = CashuWalletClient("http://127.0.0.1:9")
+    locked = []
+    monkeypatch.setattr(client, "_mint_lock", lambda mint: locked.append(mint) or threading.Lock())
+    monkeypatch.setattr(client, "_make_request", lambda *args: {"success": True})
+    token = "cashuB" + _b64(_cbor({"m": MINT_B, "u": "sat", "t": []}))
+    client.receive_token(token)
+    client.receive_token(token, mint_url=MINT_A)
+    assert locked == [MINT_B, MINT_A]
@@ -1,30 +1,166 @@
+import os
+import base64
+import copy
+import struct
+import threading
 import requests
 import json
 from typing import Optional, Dict, Any
 from datetime import datetime
 
+# Base URL of the Cashu wallet REST API, overridable for local/offline setups
+DEFAULT_BASE_URL = os.getenv("CASHU_WALLET_URL", "http://localhost:3002")
+DEFAULT_TIMEOUT = 30  # Seconds per wallet request unless the caller passes a shorter timeout
+
+
+def _cbor_decode(data: bytes, pos: int = 0) -> tuple:
+    """Decodes the CBOR item at `pos` (the subset cashuB tokens use); returns (value, end)."""
+    initial = data[pos]
+    major, info = initial >> 5, initial & 0x1f
+    pos += 1
+    if info < 24:
+        arg = info
+    elif info in (24, 25, 26, 27):
+        size = 1 << (info - 24)
+        if pos + size > len(data):
+            raise ValueError("Truncated CBOR item")
+        if major == 7:  # half, single and double floats carry no length
+            value = struct.unpack(">" + {2: "e", 4: "f", 8: "d"}[size], data[pos:pos + size])[0]
+            return value, pos + size
+        arg = int.from_bytes(data[pos:pos + size], "big")
+        pos += size
+    else:
+        raise ValueError("Indefinite-length CBOR items are not supported")
+    if major == 0:
+        return arg, pos
+    if major == 1:
+        return -1 - arg, pos
+    if major in (2, 3):
+        if pos + arg > len(data):
+            raise ValueError("Truncated CBOR item")
+        value = data[pos:pos + arg]
+        return (value if major == 2 else value.decode("utf-8")), pos + arg
+    if major == 4:
+        items = []
+        for _ in range(arg):
+            item, pos = _cbor_decode(data, pos)
+            items.append(item)
+        return items, pos
+    if major == 5:
+        items = {}
+        for _ in range(arg):
+            key, pos = _cbor_decode(data, pos)
+            items[key], pos = _cbor_decode(data, pos)
+        return items, pos
+    if major == 6:  # tag, the tagged item is returned as is
+        return _cbor_decode(data, pos)
+    return {20: False, 21: True, 22: None}.get(arg), pos
+
+
+def token_mint_url(token: str) -> Optional[str]:
+    """The mint a serialized cashu token (V3 cashuA or V4 cashuB) is from, None if it can't be decoded."""
+    token = token.strip()
+    try:
+        payload = token[6:]
+        raw = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        if token.startswith("cashuA"):
+            return json.loads(raw)["token"][0]["mint"]
+        if token.startswith("cashuB"):
+            return _cbor_decode(raw)[0]["m"]
+    except (ValueError, KeyError, IndexError, TypeError, struct.error, RecursionError):
+        pass
+    return None
+
+
+class _Flight:
+    """One in-flight request whose result is shared by every caller that joined it."""
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+
 
 class CashuWalletClient:
     """
     Python client for interacting with Cashu token REST API endpoints.
     Provides functions to send, receive, and check balance of Cashu tokens.
+
+    The client is safe to share between threads. Concurrent get_balance calls
+    share one HTTP request (single-flight), and sends and receives are
+    serialized per mint (for receives, the mint of the token) so two of them
+    never select the same proofs, while different mints proceed in parallel.
     """
     
-    def __init__(self, base_url: str = "http://localhost:3002"):
+    def __init__(self, base_url: Optional[str] = None):
         """
         Initialize the Cashu wallet client.
         
         Args:
-            base_url: Base URL of the Cashu API server (default: http://localhost:3002)
+            base_url: Base URL of the Cashu API server (default: DEFAULT_BASE_URL,
+                      i.e. $CASHU_WALLET_URL or http://localhost:3002)
         """
-        self.base_url = base_url.rstrip('/')
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
         self.session = requests.Session()
         self.session.headers.update({
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._mint_locks: Dict[Optional[str], threading.Lock] = {}
+        # Bumped after every send/receive; a balance request started before
+        # one finished is not joined by callers arriving after it
+        self._generation = 0
+
+    def _single_flight(self, endpoint: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        GETs an endpoint, sharing the response of an identical request already in flight.
+
+        Callers joining a request wait at most their own timeout for it, so a
+        hung request doesn't hold them longer than making it themselves would.
+        """
+        with self._lock:
+            flight = self._flights.get(endpoint)
+            if flight is not None and flight.generation == self._generation:
+                leader = False
+            else:
+                flight = self._flights[endpoint] = _Flight(self._generation)
+                leader = True
+        if not leader:
+            if not flight.done.wait(DEFAULT_TIMEOUT if timeout is None else timeout):
+                print(f"Request failed: timed out waiting for the shared {endpoint} request")
+                return {
+                    'success': False,
+                    'message': f'Timed out waiting for the wallet ({endpoint})',
+                    'timestamp': datetime.now().isoformat()
+                }
+            return copy.deepcopy(flight.result)
+        try:
+            flight.result = self._make_request('GET', endpoint, timeout=timeout)
+        finally:
+            with self._lock:
+                if self._flights.get(endpoint) is flight:
+                    del self._flights[endpoint]
+            flight.done.set()
+        return copy.deepcopy(flight.result)
+
+    def _mint_lock(self, mint_url: Optional[str]) -> threading.Lock:
+        with self._lock:
+            return self._mint_locks.setdefault(mint_url, threading.Lock())
+
+    def _mutate(self, endpoint: str, mint_url: Optional[str], payload: Dict[str, Any],
+                timeout: Optional[float] = None) -> Dict[str, Any]:
+        """POSTs a proof-changing request, one at a time per mint."""
+        try:
+            with self._mint_lock(mint_url):
+                return self._make_request('POST', endpoint, payload, timeout)
+        finally:
+            with self._lock:
+                self._generation += 1
     
-    def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Dict[str, Any]:
+    def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None,
+                      timeout: Optional[float] = None) -> Dict[str, Any]:
         """
         Make HTTP request to the API.
         
@@ -32,6 +168,7 @@ class CashuWalletClient:
             method: HTTP method (GET, POST)
             endpoint: API endpoint path
             data: Request payload for POST requests
+            timeout: Seconds to wait for the wallet (default: DEFAULT_TIMEOUT)
             
         Returns:
             Dict containing the API response
@@ -42,10 +179,11 @@ class CashuWalletClient:
         url = f"{self.base_url}/api{endpoint}"
         
         try:
+            timeout = DEFAULT_TIMEOUT if timeout is None else timeout
             if method.upper() == 'GET':
-                response = self.session.get(url)
+                response = self.session.get(url, timeout=timeout)
             elif method.upper() == 'POST':
-                response = self.session.post(url, json=data)
+                response = self.session.post(url, json=data, timeout=timeout)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
             
@@ -70,7 +208,8 @@ class CashuWalletClient:
                 'timestamp': datetime.now().isoformat()
             }
     
-    def send_token(self, amount: int, mint_url: Optional[str] = None, unit: str = 'sat') -> Dict[str, Any]:
+    def send_token(self, amount: int, mint_url: Optional[str] = None, unit: str = 'sat',
+                   timeout: Optional[float] = None) -> Dict[str, Any]:
         """
         Generate a send token for a specified amount.
         
@@ -78,6 +217,7 @@ class CashuWalletClient:
             amount: Amount to send (must be positive integer)
             mint_url: Optional mint URL (uses default if not provided). If None, the mint with the highest balance will be used.
             unit: Token unit (default: 'sat')
+            timeout: Seconds to wait for each wallet request (default: DEFAULT_TIMEOUT)
             
         Returns:
             Dict containing:
@@ -94,7 +234,7 @@ class CashuWalletClient:
             }
         
         if mint_url is None:
-            balance_result = self.get_balance()
+            balance_result = self.get_balance(timeout)
             if balance_result.get('success') and 'mintBalances' in balance_result.get('data', {}):
                 mint_balances = balance_result['data']['mintBalances']
                 if mint_balances:
@@ -120,9 +260,10 @@ class CashuWalletClient:
         }
         print(payload)
         
-        return self._make_request('POST', '/send', payload)
+        return self._mutate('/send', mint_url, payload, timeout)
     
-    def receive_token(self, token: str, mint_url: Optional[str] = None, unit: Optional[str] = None) -> Dict[str, Any]:
+    def receive_token(self, token: str, mint_url: Optional[str] = None, unit: Optional[str] = None,
+                      timeout: Optional[float] = None) -> Dict[str, Any]:
         """
         Import a Cashu token and add proofs to storage.
         
@@ -130,6 +271,7 @@ class CashuWalletClient:
             token: Cashu token string to import
             mint_url: Optional mint URL (uses default if not provided)
             unit: Optional token unit
+            timeout: Seconds to wait for the wallet (default: DEFAULT_TIMEOUT)
             
         Returns:
             Dict containing:
@@ -154,11 +296,16 @@ class CashuWalletClient:
         if unit:
             payload['unit'] = unit
         
-        return self._make_request('POST', '/receive', payload)
+        return self._mutate('/receive', mint_url or token_mint_url(token), payload, timeout)
     
-    def get_balance(self) -> Dict[str, Any]:
+    def get_balance(self, timeout: Optional[float] = None) -> Dict[str, Any]:
         """
         Get current balance from stored proofs.
+
+        Calls made while an identical request is in flight share its response.
+
+        Args:
+            timeout: Seconds to wait for the wallet (default: DEFAULT_TIMEOUT)
         
         Returns:
             Dict containing:
@@ -167,17 +314,33 @@ class CashuWalletClient:
                 - data: dict with balance, proofCount, unit (if successful)
                 - timestamp: str
         """
-        return self._make_request('GET', '/balance')
+        return self._single_flight('/balance', timeout)
 
 
 # Convenience functions for direct usage
-def create_wallet_client(base_url: str = "http://localhost:3002") -> CashuWalletClient:
+_default_clients: Dict[str, CashuWalletClient] = {}
+
+
+def create_wallet_client(base_url: Optional[str] = None) -> CashuWalletClient:
     """Create a new CashuWalletClient instance."""
     return CashuWalletClient(base_url)
 
 
+def get_default_client(base_url: Optional[str] = None) -> CashuWalletClient:
+    """
+    Get the shared client for a base URL, creating it on first use.
+
+    The convenience functions below all go through it, so they reuse one
+    HTTP session (and its open connections) instead of a new one per call.
+    """
+    base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+    if base_url not in _default_clients:
+        _default_clients[base_url] = CashuWalletClient(base_url)
+    return _default_clients[base_url]
+
+
 def send_cashu_token(amount: int, mint_url: Optional[str] = None, unit: str = 'sat', 
-                    base_url: str = "http://localhost:3002") -> Dict[str, Any]:
+                    base_url: Optional[str] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
     """
     Convenience function to send a Cashu token.
     
@@ -185,17 +348,18 @@ def send_cashu_token(amount: int, mint_url: Optional[str] = None, unit: str = 's
         amount: Amount to send
         mint_url: Optional mint URL
         unit: Token unit (default: 'sat')
-        base_url: API base URL
+        base_url: API base URL (default: DEFAULT_BASE_URL)
+        timeout: Seconds to wait for each wallet request (default: DEFAULT_TIMEOUT)
         
     Returns:
         API response dict
     """
-    client = CashuWalletClient(base_url)
-    return client.send_token(amount, mint_url, unit)
+    client = get_default_client(base_url)
+    return client.send_token(amount, mint_url, unit, timeout)
 
 
 def receive_cashu_token(token: str, mint_url: Optional[str] = None, unit: Optional[str] = None,
-                       base_url: str = "http://localhost:3002") -> Dict[str, Any]:
+                       base_url: Optional[str] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
     """
     Convenience function to receive a Cashu token.
     
@@ -203,27 +367,29 @@ def receive_cashu_token(token: str, mint_url: Optional[str] = None, unit: Option
         token: Cashu token string
         mint_url: Optional mint URL
         unit: Optional token unit
-        base_url: API base URL
+        base_url: API base URL (default: DEFAULT_BASE_URL)
+        timeout: Seconds to wait for the wallet (default: DEFAULT_TIMEOUT)
         
     Returns:
         API response dict
     """
-    client = CashuWalletClient(base_url)
-    return client.receive_token(token, mint_url, unit)
+    client = get_default_client(base_url)
+    return client.receive_token(token, mint_url, unit, timeout)
 
 
-def get_wallet_balance(base_url: str = "http://localhost:3002") -> Dict[str, Any]:
+def get_wallet_balance(base_url: Optional[str] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
     """
     Convenience function to get wallet balance.
     
     Args:
-        base_url: API base URL
+        base_url: API base URL (default: DEFAULT_BASE_URL)
+        timeout: Seconds to wait for the wallet (default: DEFAULT_TIMEOUT)
         
     Returns:
         API response dict
     """
-    client = CashuWalletClient(base_url)
-    return client.get_balance()
+    client = get_default_client(base_url)
+    return client.get_balance(timeout)
 
 
 # Example usage
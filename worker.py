@@ -0,0 +1,113 @@
+"""
+Worker mode: several bot processes share the providers through leases.
+
+Each worker claims up to --max-providers providers in the state database
+(ROUTSTR_STATE_DB), taking the seed and discovered providers in probe priority
+order (see scheduler.py), probes only the providers it holds and records the
+results there. Leases last --lease seconds and are renewed every cycle by the
+holder; when a worker dies its providers become claimable by the others once
+the lease expires. The token ledger (DATA_FILE) is locked around every update,
+so workers on one host (or on hosts sharing the data file) keep it consistent.
+
+One worker per cycle also wins the "publisher" lease and publishes the status
+updates (see publish_status_updates) merged from every provider's latest result:
+
+    python worker.py --worker-id a --max-providers 2 --loop 600
+    python worker.py --worker-id b --max-providers 2 --loop 600
+"""
+import argparse
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+import routstr_bot
+from scheduler import ProbeQueue, ProbeBudget
+from store import StateStore
+
+PUBLISHER_LEASE = "publisher"
+DEFAULT_LEASE_SECONDS = 600
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def run_cycle(store: StateStore, worker_id: str, max_providers: int, lease_seconds: float) -> list[dict]:
+    """Claims providers, probes those held and publishes the merged report if this worker is publisher."""
+    deadline = routstr_bot.Deadline(routstr_bot.RUN_DEADLINE_SECONDS)
+    # Every cycle is a run of its own in the completion cache
+    routstr_bot.RUN_ID = uuid.uuid4().hex[:12]
+    probe_deadline = deadline.reserve(routstr_bot.PUBLISH_RESERVE_SECONDS)
+    public_key = routstr_bot.get_bot_public_key()
+    if not public_key:
+        return []
+
+    latest_event = await routstr_bot.get_latest_nostr_event(public_key, probe_deadline)
+    if not latest_event:
+        print("NOSTR DIDN'T WOWKR")
+        return []
+
+    discovered = await routstr_bot.discover_providers(store, probe_deadline)
+    # Claiming in priority order leaves the least overdue providers unclaimed when workers are few
+    providers = ProbeQueue(store, routstr_bot.PROXIES, discovered).ordered()
+    previously_held = set(store.held(worker_id)) & set(providers)
+    held = store.claim(worker_id, providers, lease_seconds, max_providers)
+    for provider_url in previously_held - set(held):
+        # Probed last cycle and now less overdue than others, let another worker take it
+        store.release(worker_id, provider_url)
+    print(f"Worker {worker_id} holds {len(held)} provider(s): {', '.join(held) or '-'}")
+    cycle_started = time.time()
+    budget = ProbeBudget(routstr_bot.CYCLE_SATS_BUDGET, routstr_bot.PROBE_MAX_SATS, routstr_bot.CHEAPEST_MODELS_ABOVE)
+    results = []
+    for n, provider_url in enumerate(held):
+        if not budget.allows_probe():
+            # Left for a worker with budget to spare, or for the next cycle
+            print(f"Sats budget reached ({budget.spent_sats:.3f} of {budget.sats} sats spent), "
+                  f"releasing {provider_url}")
+            store.release(worker_id, provider_url)
+            continue
+        # Skip providers lost to another worker (e.g. after a long stall past the lease)
+        if not store.renew(worker_id, provider_url, lease_seconds):
+            print(f"Lease on {provider_url} lost, skipping")
+            continue
+        result = await routstr_bot.probe_provider(
+            latest_event.content, routstr_bot.PROMPTS[n % len(routstr_bot.PROMPTS)],
+            provider_url, store, worker_id, probe_deadline, budget,
+        )
+        if result["status"] != "skipped":
+            results.append(result)
+
+    if store.claim(worker_id, [PUBLISHER_LEASE], lease_seconds):
+        # Results of the other workers from this lease period are merged in
+        merged = store.latest_results(since=cycle_started - lease_seconds, providers=providers)
+        if merged:
+            await routstr_bot.publish_status_updates(latest_event, merged, deadline, store)
+    return results
+
+
+async def run_worker(worker_id: str, max_providers: int, lease_seconds: float, loop_seconds: float = 0):
+    store = StateStore(routstr_bot.STATE_DB)
+    try:
+        while True:
+            print('\nLogging: ', time.asctime())
+            started = time.monotonic()
+            await run_cycle(store, worker_id, max_providers, lease_seconds)
+            if not loop_seconds:
+                break
+            await asyncio.sleep(max(0.0, loop_seconds - (time.monotonic() - started)))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Probe providers as one of several lease-coordinated workers.")
+    parser.add_argument("--worker-id", default=default_worker_id())
+    parser.add_argument("--max-providers", type=int, default=routstr_bot.NUMBER_OF_PROXIES_TO_TEST,
+                        help="most providers this worker holds at once")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS,
+                        help="lease duration in seconds; use the loop interval or longer")
+    parser.add_argument("--loop", type=float, default=0, help="repeat every N seconds (default: run once)")
+    args = parser.parse_args()
+    asyncio.run(run_worker(args.worker_id, args.max_providers, args.lease, args.loop))